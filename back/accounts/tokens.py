@@ -0,0 +1,11 @@
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+def access_token_for(user):
+    """
+    Access token carrying the username as a claim, so the WebSocket
+    middleware (game/auth.py) can identify the user without a DB query.
+    """
+    refresh = RefreshToken.for_user(user)
+    refresh["username"] = user.username
+    return str(refresh.access_token)
@@ -17,7 +17,7 @@ django.setup()
 
 # Now import Channels components
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from game.auth import JWTAuthMiddleware
 from game.routing import websocket_urlpatterns
 
 # Get Django ASGI application
@@ -25,7 +25,8 @@ django_asgi_app = get_asgi_application()
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
+    # JWT vérifié localement : pas de requête session/user au connect
+    "websocket": JWTAuthMiddleware(
         URLRouter(websocket_urlpatterns)
     ),
 })
\ No newline at end of file
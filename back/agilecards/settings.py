@@ -77,25 +77,132 @@ DATABASES = {
     }
 }
 
+# Connexions persistantes : réutilisées pendant CONN_MAX_AGE secondes au lieu d'une par requête.
+# DB_POOL_MAX_SIZE > 0 active à la place le pool psycopg 3 (les deux sont exclusifs dans Django).
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "0"))
+if DB_POOL_MAX_SIZE > 0:
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        },
+    }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("CONN_MAX_AGE", "60"))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+# Helpers base des consumers (game/db.py) : 0 = thread-sensitive (un seul thread partagé),
+# N > 0 = pool de N threads, au plus N accès concurrents. Garder N <= DB_POOL_MAX_SIZE.
+DB_ASYNC_THREADS = int(os.getenv("DB_ASYNC_THREADS", "0"))
+
 # ----------------------------
 # CHANNELS (WebSockets)
 # ----------------------------
+# Un ou plusieurs Redis : REDIS_HOSTS="redis:6379,redis-2:6379" (REDIS_HOST seul sinon).
+# channels_redis répartit les groupes (un par room) entre les hôtes par hash du nom.
+REDIS_HOSTS = [
+    (host, int(port or 6379))
+    for host, _, port in (
+        h.strip().partition(":") for h in os.getenv("REDIS_HOSTS", os.getenv("REDIS_HOST", "redis")).split(",")
+    )
+    if host
+]
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [(os.getenv("REDIS_HOST", "redis"), 6379)],  # Docker hostname = redis
+            "hosts": REDIS_HOSTS,
         },
     },
 }
 
+# État des rooms gardé en mémoire par les consumers (game/state.py).
+# Durabilité : un vote est écrit en base au plus tard après ce délai (secondes).
+ROOM_STATE_FLUSH_INTERVAL = float(os.getenv("ROOM_STATE_FLUSH_INTERVAL", "0.25"))
+# Durée de vie max (secondes) des réponses REST de room mises en cache (game/snapshots.py).
+SNAPSHOT_CACHE_TTL = float(os.getenv("SNAPSHOT_CACHE_TTL", "5"))
+# Fenêtre (secondes) pendant laquelle les votes d'une room sont fusionnés en une seule trame.
+BROADCAST_COALESCE_WINDOW = float(os.getenv("BROADCAST_COALESCE_WINDOW", "0.05"))
+# Threads qui calculent l'analyse des votes (game/analysis.py), hors de la boucle asyncio.
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+# Durée d'un round (secondes) avant le reveal automatique côté serveur (game/timers.py) ; 0 = désactivé.
+ROUND_TIMEOUT = float(os.getenv("ROUND_TIMEOUT", "120"))
+# Présence (game/presence.py) : sorted set Redis par room, repli en mémoire si Redis est absent.
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", "redis")
+# Une URL par shard, dans le même ordre que REDIS_HOSTS : la présence d'une room suit son groupe.
+PRESENCE_REDIS_URLS = os.getenv(
+    "PRESENCE_REDIS_URLS", ",".join(f"redis://{host}:{port}/1" for host, port in REDIS_HOSTS)
+).split(",")
+# Sans heartbeat depuis ce délai (secondes), un joueur est considéré hors ligne.
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "30"))
+# Après une erreur Redis, la présence reste en mémoire ce délai (secondes) avant de réessayer Redis.
+PRESENCE_RETRY_AFTER = float(os.getenv("PRESENCE_RETRY_AFTER", "5"))
+# Chat (game/chat.py) : historique gardé par room, taille max d'un message, débit par joueur
+# (CHAT_RATE messages/s, rafales de CHAT_BURST) et délai d'écriture groupée en base (secondes).
+CHAT_HISTORY = int(os.getenv("CHAT_HISTORY", "50"))
+CHAT_MAX_LENGTH = int(os.getenv("CHAT_MAX_LENGTH", "500"))
+CHAT_RATE = float(os.getenv("CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("CHAT_BURST", "5"))
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", "1"))
+# Contre-pression par socket (game/backpressure.py) : messages en attente de traitement avant
+# fermeture, trames envoyées et non confirmées par le heartbeat du client avant fermeture,
+# et débit par type de message (messages/s, rafale) ; les types absents utilisent "default".
+WS_INBOX_SIZE = int(os.getenv("WS_INBOX_SIZE", "32"))
+WS_MAX_UNACKED = int(os.getenv("WS_MAX_UNACKED", "500"))
+WS_RATE_LIMITS = {
+    "default": (5, 10),
+    "vote": (5, 10),
+    "chat": (2, 5),
+    "heartbeat": (1, 5),
+    "resync": (1, 3),
+    "coffee": (1, 3),
+    "resume": (1, 3),
+    "reveal": (0.5, 3),
+    "force_reveal": (0.5, 3),
+}
+# Encodeur JSON des trames WebSocket et des réponses REST (game/encoding.py) :
+# "auto" (orjson s'il est installé, sinon json), "orjson" ou "json".
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+# Part des messages / trames chronométrés pour /metrics (game/metrics.py) ; les compteurs sont exacts.
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0.1"))
+
+# ----------------------------
+# LOGGING
+# ----------------------------
+# LOG_LEVEL=DEBUG pour suivre chaque vote / message de chat (coût nul au niveau INFO).
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "simple": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": "simple"},
+    },
+    "root": {"handlers": ["console"], "level": "WARNING"},
+    "loggers": {
+        "game": {"handlers": ["console"], "level": os.getenv("LOG_LEVEL", "INFO"), "propagate": False},
+    },
+}
+
 # ----------------------------
 # AUTH + JWT
 # ----------------------------
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+    ],
+    # JSON via orjson quand il est installé (game/encoding.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'game.encoding.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'game.encoding.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 SIMPLE_JWT = {
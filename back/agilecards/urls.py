@@ -18,10 +18,11 @@ from django.contrib import admin
 from django.urls import include, path
 
 from django.urls import path
-from api.urls import ping
+from api.urls import metrics, ping
 
 urlpatterns = [
     path("ping/", ping),
+    path("metrics", metrics),
     path("auth/", include("accounts.urls")),
     path("api/", include("game.urls")),    
 
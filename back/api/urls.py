@@ -1,4 +1,9 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+
+from game import metrics as game_metrics
 
 def ping(request):
     return JsonResponse({"status": "ok"})
+
+def metrics(request):
+    return HttpResponse(game_metrics.render(), content_type=game_metrics.CONTENT_TYPE)
@@ -0,0 +1,155 @@
+"""
+Vote analysis sent with `ai_analysis_event` once everybody has voted.
+
+Local and offline: the analysis is computed from the round's votes and the
+room's history (PlayerDivergence rollups and the last validated results of
+RoundArchive, see game/archive.py). It reports the distribution, the spread
+in card steps, the outliers and a suggested estimate, plus a short text for
+the front.
+
+`analysis_for()` never runs on the event loop: the history is read through
+database_sync_to_async and `analyze()` runs in a small thread pool
+(ANALYSIS_WORKERS, 2 by default). Results are cached per
+(room, task_index, vote-set hash), so a repeated reveal or a reconnect gets
+the cached result; concurrent requests for the same key share one
+computation.
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+
+from django.conf import settings
+
+from . import metrics
+from .estimation import CARDS, CODES
+from .metrics import db_helper
+from .models import PlayerDivergence, RoundArchive
+
+WORKERS = getattr(settings, "ANALYSIS_WORKERS", 2)
+CACHE_SIZE = 512
+HISTORY_ROUNDS = 20  # résultats validés récents pris en compte
+OUTLIER_STEPS = 2  # un vote à 2 cartes ou plus de la médiane est un outlier
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="analysis")
+_cache = OrderedDict()  # key -> result dict, or asyncio.Future while computing
+
+metrics.Gauge("pocker_analysis_queue", "Analyses waiting for a worker thread", lambda: _executor._work_queue.qsize())
+
+
+def cache_key(room_id, task_index, votes):
+    digest = hashlib.sha1(repr(sorted(votes.items())).encode()).hexdigest()[:16]
+    return room_id, task_index, digest
+
+
+def analyze(votes, divergence=None, recent=None):
+    """
+    Pure function. `votes`: {username: value}; `divergence`: {username: mean
+    card steps off the validated estimates}; `recent`: recent validated
+    results in points. Returns the payload merged into ai_analysis_event.
+    """
+    divergence = divergence or {}
+    distribution = {}
+    for value in votes.values():
+        distribution[value] = distribution.get(value, 0) + 1
+    distribution = dict(sorted(distribution.items(), key=lambda kv: CODES.get(kv[0], len(CARDS))))
+
+    cast = {u: CODES[v] for u, v in votes.items() if v in CODES}
+    if not cast:
+        return {
+            "vote_summary": distribution,
+            "spread": 0,
+            "outliers": [],
+            "suggested": None,
+            "consensus": "none",
+            "analysis": "☕ Analyse : aucun vote chiffré, pause café pour tout le monde.",
+        }
+
+    codes = sorted(cast.values())
+    spread = codes[-1] - codes[0]
+    mid = median(codes)
+    outliers = sorted(u for u, c in cast.items() if abs(c - mid) >= OUTLIER_STEPS)
+
+    # médiane pondérée : un joueur qui s'écarte souvent du résultat pèse moins
+    weighted = sorted((c, 1 / (1 + divergence.get(u, 0))) for u, c in cast.items())
+    half, acc = sum(w for _, w in weighted) / 2, 0
+    for code, weight in weighted:
+        acc += weight
+        if acc >= half:
+            break
+    suggested = CARDS[code]
+
+    consensus = "unanimous" if spread == 0 else "close" if spread <= 1 else "divergent"
+    if consensus == "unanimous":
+        text = f"🤖 Analyse : accord total sur {suggested} points."
+    elif consensus == "close":
+        text = f"🤖 Analyse : votes proches ({CARDS[codes[0]]}–{CARDS[codes[-1]]}). Estimation suggérée : {suggested} points."
+    else:
+        text = (
+            f"🤖 Analyse : divergence de {spread} cartes ({CARDS[codes[0]]}–{CARDS[codes[-1]]})"
+            + (f", à discuter avec {', '.join(outliers)}" if outliers else "")
+            + f". Estimation suggérée : {suggested} points."
+        )
+    if recent:
+        typical = median(recent)
+        text += f" Estimation habituelle de la room : {typical:g} points."
+
+    return {
+        "vote_summary": distribution,
+        "spread": spread,
+        "outliers": outliers,
+        "suggested": str(suggested),
+        "consensus": consensus,
+        "analysis": text,
+    }
+
+
+@db_helper("load_history")
+def _load_history(room_id, usernames):
+    divergence = {
+        row["username"]: row["steps"] / row["rounds"]
+        for row in PlayerDivergence.objects.filter(room_id=room_id, username__in=usernames, rounds__gt=0)
+        .values("username", "steps", "rounds")
+    }
+    results = (
+        RoundArchive.objects.filter(room_id=room_id, status=RoundArchive.VALIDATED)
+        .order_by("-id").values_list("result", flat=True)[:HISTORY_ROUNDS]
+    )
+    return divergence, [int(r) for r in results if r and r.isdigit()]
+
+
+def cached(room_id, task_index, votes):
+    """The finished analysis for this vote set, or None (never computes)."""
+    result = _cache.get(cache_key(room_id, task_index, votes))
+    return result if isinstance(result, dict) else None
+
+
+async def analysis_for(room_id, task_index, votes):
+    key = cache_key(room_id, task_index, votes)
+    hit = _cache.get(key)
+    if isinstance(hit, dict):
+        _cache.move_to_end(key)
+        return hit
+    if hit is not None:
+        return await asyncio.shield(hit)
+
+    future = _cache[key] = asyncio.get_running_loop().create_future()
+    try:
+        divergence, recent = await _load_history(room_id, list(votes))
+        result = await asyncio.get_running_loop().run_in_executor(
+            _executor, analyze, dict(votes), divergence, recent)
+    except asyncio.CancelledError:
+        _cache.pop(key, None)
+        future.cancel()
+        raise
+    except Exception as exc:
+        _cache.pop(key, None)
+        future.set_exception(exc)
+        future.exception()  # marque l'exception comme lue si personne n'attend
+        raise
+    _cache[key] = result
+    future.set_result(result)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
@@ -0,0 +1,133 @@
+"""
+Round archive and estimation analytics.
+
+Reveals used to delete the round's Vote rows and keep nothing else. Every
+reveal now appends a RoundArchive row (votes packed one byte per voter) and
+bumps two rollups in the same transaction:
+
+- RoomEstimateStats: rounds, validated / revote / skipped counts, points
+  estimated and time spent voting;
+- PlayerDivergence: per player, distance between their vote and the
+  validated estimate, in card steps (3 -> 8 is two steps).
+
+The analytics endpoints read the rollups only (one row per room, one per
+player), never the archive itself. Rollups are updated with F() expressions
+so concurrent reveals in different rooms or workers don't lose increments.
+"""
+from django.db.models import F
+
+from .estimation import CARDS, CODES, snap
+from .models import PlayerDivergence, RoomEstimateStats, RoundArchive
+from .votes import VALID_VOTES
+
+_VOTE_CODES = {v: i for i, v in enumerate(VALID_VOTES)}
+
+
+def pack(votes):
+    """{username: value} -> (usernames, bytes); unknown values are dropped."""
+    voters = [u for u, v in votes.items() if v in _VOTE_CODES]
+    return voters, bytes(_VOTE_CODES[votes[u]] for u in voters)
+
+
+def unpack(archived):
+    """{username: value} of an archived round."""
+    return {u: VALID_VOTES[code] for u, code in zip(archived.voters, bytes(archived.votes))}
+
+
+def _points(result):
+    try:
+        return float(result)
+    except (TypeError, ValueError):
+        return None
+
+
+def archive_round(room_id, task_index, mode, status, votes, result=None, started_at=None):
+    """
+    Append the round to the archive and update the rollups. Call it inside
+    the reveal transaction. `started_at` defaults to the previous reveal in
+    the room (None for the first one: its duration is unknown).
+    """
+    if started_at is None:
+        started_at = (
+            RoundArchive.objects.filter(room_id=room_id)
+            .order_by("-id").values_list("revealed_at", flat=True).first()
+        )
+    voters, packed = pack(votes)
+    archived = RoundArchive.objects.create(
+        room_id=room_id, task_index=task_index, mode=mode, status=status,
+        result=result, voters=voters, votes=packed, started_at=started_at,
+    )
+
+    points = _points(result) if status == RoundArchive.VALIDATED else None
+    seconds = (archived.revealed_at - started_at).total_seconds() if started_at else 0
+    RoomEstimateStats.objects.bulk_create([RoomEstimateStats(room_id=room_id)], ignore_conflicts=True)
+    RoomEstimateStats.objects.filter(room_id=room_id).update(
+        rounds=F("rounds") + 1,
+        validated=F("validated") + int(status == RoundArchive.VALIDATED),
+        revotes=F("revotes") + int(status == RoundArchive.REVOTE),
+        skipped=F("skipped") + int(status == RoundArchive.SKIPPED),
+        points=F("points") + (points or 0),
+        voting_seconds=F("voting_seconds") + max(seconds, 0),
+    )
+    if points is not None:
+        _update_divergence(room_id, votes, CARDS.index(snap(points)))
+    return archived
+
+
+def _update_divergence(room_id, votes, target):
+    # un UPDATE par écart distinct plutôt qu'un par joueur
+    by_offset = {}
+    for username, value in votes.items():
+        if value in CODES:
+            by_offset.setdefault(CODES[value] - target, []).append(username)
+    if not by_offset:
+        return
+
+    PlayerDivergence.objects.bulk_create(
+        [PlayerDivergence(room_id=room_id, username=u) for users in by_offset.values() for u in users],
+        ignore_conflicts=True,
+    )
+    for offset, usernames in by_offset.items():
+        PlayerDivergence.objects.filter(room_id=room_id, username__in=usernames).update(
+            rounds=F("rounds") + 1,
+            steps=F("steps") + abs(offset),
+            above=F("above") + int(offset > 0),
+            below=F("below") + int(offset < 0),
+        )
+
+
+# ---------- lectures (rollups uniquement) ----------
+
+def divergence(room):
+    """Players sorted from most to least divergent."""
+    rows = PlayerDivergence.objects.filter(room=room, rounds__gt=0).values(
+        "username", "rounds", "steps", "above", "below")
+    out = [{**row, "mean_steps": round(row["steps"] / row["rounds"], 2)} for row in rows]
+    return sorted(out, key=lambda r: (-r["mean_steps"], r["username"]))
+
+
+def _stats(room):
+    return RoomEstimateStats.objects.filter(room=room).first() or RoomEstimateStats(room=room)
+
+
+def velocity(room):
+    stats = _stats(room)
+    hours = stats.voting_seconds / 3600
+    return {
+        "estimated_tasks": stats.validated,
+        "points": stats.points,
+        "voting_seconds": round(stats.voting_seconds, 1),
+        "points_per_hour": round(stats.points / hours, 2) if hours else None,
+        "tasks_per_hour": round(stats.validated / hours, 2) if hours else None,
+        "seconds_per_round": round(stats.voting_seconds / stats.rounds, 1) if stats.rounds else None,
+    }
+
+
+def revote_rate(room):
+    stats = _stats(room)
+    return {
+        "rounds": stats.rounds,
+        "revotes": stats.revotes,
+        "skipped": stats.skipped,
+        "revote_rate": round(stats.revotes / stats.rounds, 3) if stats.rounds else 0.0,
+    }
@@ -0,0 +1,60 @@
+"""
+JWT authentication for WebSocket handshakes.
+
+The front opens `ws/rooms/<code>/?token=<access token>`. The token is the
+same SimpleJWT access token the REST API uses; it is verified locally
+(signature + expiry) and turned into a TokenUser, so a connect costs no
+session or user query. Tokens issued by accounts.tokens carry a `username`
+claim; older tokens without it are refused.
+
+Decoded tokens are kept in a small cache until they expire, which keeps a
+reconnect storm (every client of a room reconnecting at once) cheap.
+"""
+import time
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.tokens import AccessToken
+
+CACHE_SIZE = 4096
+
+_decoded = {}  # raw token -> (TokenUser, exp)
+
+
+def user_from_token(raw):
+    """TokenUser for a valid access token carrying a username, else None."""
+    if not raw:
+        return None
+    hit = _decoded.get(raw)
+    if hit is not None:
+        user, exp = hit
+        if exp > time.time():
+            return user
+        del _decoded[raw]
+        return None
+
+    try:
+        token = AccessToken(raw)
+    except TokenError:
+        return None
+    if not token.get("username"):
+        return None
+
+    if len(_decoded) >= CACHE_SIZE:
+        _decoded.pop(next(iter(_decoded)))
+    user = TokenUser(token)
+    _decoded[raw] = (user, token["exp"])
+    return user
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Sets scope["user"] from the `token` query parameter (AnonymousUser if missing or invalid)."""
+
+    async def __call__(self, scope, receive, send):
+        qs = parse_qs(scope.get("query_string", b"").decode())
+        user = user_from_token(qs.get("token", [None])[0])
+        scope = dict(scope, user=user or AnonymousUser())
+        return await super().__call__(scope, receive, send)
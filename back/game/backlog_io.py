@@ -0,0 +1,323 @@
+"""
+Streaming backlog import and export.
+
+Backlogs (Jira exports…) can hold tens of thousands of items, so nothing here
+loads the whole upload: the body is read in chunks, each record is validated
+as soon as it is parsed and rows are written with bulk_create in batches.
+Memory stays bounded by CHUNK_SIZE + BATCH_SIZE items whatever the file size.
+
+Supported formats: JSON array, NDJSON (one object per line) and CSV with a
+header row (`title`, `description`, `id`, or the Jira `Summary`,
+`Description`, `Issue key` columns).
+
+Exports go the other way with the same formats: rows are read through a
+server-side cursor and written out as they come, gzip-compressed on the fly
+when the client accepts it, behind an ETag so pollers get a 304.
+"""
+import codecs
+import csv
+import hashlib
+import io
+import json
+import uuid
+import zlib
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+
+from .models import BacklogItem
+
+CHUNK_SIZE = 64 * 1024
+BATCH_SIZE = 1000
+MAX_ITEM_SIZE = 1024 * 1024  # un item JSON plus gros est refusé (ou le JSON est invalide)
+
+FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+}
+EXTENSIONS = {".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+
+# colonnes CSV reconnues -> champ du backlog
+_CSV_ALIASES = {
+    "title": "title", "summary": "title",
+    "description": "description",
+    "id": "id", "external_id": "id", "issue key": "id", "key": "id",
+}
+
+
+class BacklogImportError(ValueError):
+    pass
+
+
+def normalize_item(item, i):
+    """Validate one record (1-based position `i`) and return the BacklogItem fields."""
+    if not isinstance(item, dict):
+        raise BacklogImportError(f"Item #{i} must be an object")
+    title = item.get("title")
+    if not title or not isinstance(title, str) or len(title.strip()) == 0:
+        raise BacklogImportError(f"Item #{i} is missing a valid 'title'")
+
+    return {
+        "external_id": str(item.get("id") or item.get("external_id") or uuid.uuid4())[:100],
+        "title": title.strip()[:255],
+        "description": (item.get("description") or "").strip()[:2000],
+    }
+
+
+def _read_text(stream, chunk_size=CHUNK_SIZE):
+    """Decode a binary stream chunk by chunk (a UTF-8 BOM is dropped)."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def _read_lines(stream):
+    """Lines with their line endings, like iterating over a text file."""
+    pending = ""
+    for text in _read_text(stream):
+        pending += text
+        start = 0
+        while True:
+            end = pending.find("\n", start)
+            if end < 0:
+                break
+            yield pending[start:end + 1]
+            start = end + 1
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+
+def iter_json_array(stream):
+    """Yield the elements of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    chunks = _read_text(stream)
+    buf, pos = "", 0
+    expect = "["  # then: value, "," or "]"
+
+    def skip_ws():
+        nonlocal buf, pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return True
+            buf, pos = "", 0
+            more = next(chunks, None)
+            if more is None:
+                return False
+            buf = more
+
+    while True:
+        if not skip_ws():
+            raise BacklogImportError("Backlog must be a non-empty array" if expect == "[" else "Unexpected end of JSON")
+        char = buf[pos]
+        if expect == "[":
+            if char != "[":
+                raise BacklogImportError("Backlog must be a non-empty array")
+            pos += 1
+            expect = "first"
+        elif expect in (",", "first") and char == "]":
+            return
+        elif expect == ",":
+            if char != ",":
+                raise BacklogImportError(f"Invalid JSON at character '{char}'")
+            pos += 1
+            expect = "value"
+        else:
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    break
+                except json.JSONDecodeError:
+                    more = next(chunks, None)
+                    if more is None or len(buf) - pos > MAX_ITEM_SIZE:
+                        raise BacklogImportError("Invalid JSON")
+                    buf, pos = buf[pos:] + more, 0
+            yield value
+            # on avance dans le tampon sans le recopier ; il n'est compacté qu'à la lecture d'un chunk
+            pos = end
+            expect = ","
+
+
+def iter_ndjson(stream):
+    for n, line in enumerate(_read_lines(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            raise BacklogImportError(f"Line {n} is not valid JSON")
+
+
+def iter_csv(stream):
+    reader = csv.reader(_read_lines(stream))
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [_CSV_ALIASES.get(h.strip().lower()) for h in header]
+    if "title" not in columns:
+        raise BacklogImportError("CSV must have a 'title' (or 'Summary') column")
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        yield {col: value for col, value in zip(columns, row) if col}
+
+
+READERS = {"json": iter_json_array, "ndjson": iter_ndjson, "csv": iter_csv}
+
+
+def import_backlog(room, records, batch_size=BATCH_SIZE, on_progress=None):
+    """
+    Replace `room`'s backlog with `records` (an iterable of dicts) and reset progress.
+    All or nothing: a bad record rolls the whole import back. Returns the item count.
+    """
+    count = 0
+    with transaction.atomic():
+        room.items.all().delete()
+        batch = []
+        for count, record in enumerate(records, start=1):
+            batch.append(BacklogItem(room=room, order=count - 1, **normalize_item(record, count)))
+            if len(batch) >= batch_size:
+                BacklogItem.objects.bulk_create(batch)
+                batch = []
+                if on_progress:
+                    on_progress(count)
+        if count == 0:
+            raise BacklogImportError("Backlog must be a non-empty array")
+        BacklogItem.objects.bulk_create(batch)
+
+        room.current_task_index = 0
+        room.version = F("version") + 1  # nouveau backlog = nouveau round
+        room.save(update_fields=["current_task_index", "version"])
+        room.refresh_from_db(fields=["version"])
+    return count
+
+
+EXPORT_FIELDS = ["external_id", "title", "description", "order", "estimate"]
+EXPORT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+CURSOR_CHUNK = 2000
+
+
+def export_etag(room, fmt="json", envelope=False, gzipped=False):
+    """
+    Changes whenever the backlog is replaced or an estimate is written (both
+    move these numbers). One tag per representation: format, envelope and
+    gzip (suffix) each give a different body.
+    """
+    stats = room.items.aggregate(n=Count("id"), last=Max("id"), estimated=Count("estimate"))
+    key = (f"{room.id}:{room.mode}:{room.current_task_index}:{stats['n']}:{stats['last']}:{stats['estimated']}"
+           f":{fmt}:{int(envelope)}")
+    return '"%s%s"' % (hashlib.sha1(key.encode()).hexdigest()[:20], "-gzip" if gzipped else "")
+
+
+def _export_rows(room):
+    rows = BacklogItem.objects.filter(room=room).order_by("order").values_list(*EXPORT_FIELDS)
+    for row in rows.iterator(chunk_size=CURSOR_CHUNK):
+        yield dict(zip(EXPORT_FIELDS, row))
+
+
+def iter_export(room, fmt, envelope=False):
+    """
+    Yield the export as bytes. `envelope` wraps the JSON list as
+    {"room", "mode", "results"} like export_results always did.
+    """
+    rows = _export_rows(room)
+    if fmt == "ndjson":
+        for row in rows:
+            yield (json.dumps(row) + "\n").encode()
+    elif fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow([row[f] if row[f] is not None else "" for f in EXPORT_FIELDS])
+            if buf.tell() >= CHUNK_SIZE:
+                yield buf.getvalue().encode()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode()
+    else:
+        head = json.dumps({"room": room.code, "mode": room.mode})[:-1] + ', "results": [' if envelope else "["
+        yield head.encode()
+        for i, row in enumerate(rows):
+            yield (("," if i else "") + json.dumps(row)).encode()
+        yield ("]}" if envelope else "]").encode()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> format gzip
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+async def _pull_async(chunks, per_hop=64):
+    """
+    Under ASGI Django buffers a sync iterator whole; hand it an async one instead.
+    Pulls run thread-sensitive so the server-side cursor stays on one connection.
+    """
+    it = iter(chunks)
+    pull = sync_to_async(lambda: list(islice(it, per_hop)), thread_sensitive=True)
+    while True:
+        block = await pull()
+        if not block:
+            return
+        for part in block:
+            yield part
+
+
+def export_response(request, room, envelope=False):
+    """
+    Streaming export of `room`'s backlog. Query param `export`: json (default),
+    ndjson or csv. Answers 304 when If-None-Match matches the current ETag.
+    """
+    fmt = request.GET.get("export", "json")
+    if fmt not in EXPORT_TYPES:
+        fmt = "json"
+
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "")
+    etag = export_etag(room, fmt, envelope, gzipped)
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+    content = iter_export(room, fmt, envelope)
+    if gzipped:
+        content = _gzip(content)
+    raw = getattr(request, "_request", request)
+    if isinstance(raw, ASGIRequest):
+        content = _pull_async(content)
+
+    response = StreamingHttpResponse(content, content_type=EXPORT_TYPES[fmt])
+    response["ETag"] = etag
+    response["Vary"] = "Accept-Encoding"
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    if fmt != "json":
+        response["Content-Disposition"] = f'attachment; filename="room_{room.code}_results.{fmt}"'
+    return response
@@ -0,0 +1,119 @@
+"""
+Per-socket backpressure for RoomConsumer.
+
+Channels hands a socket's frames to `receive_json` one at a time, and each
+one used to be handled on the spot: a client spamming `vote` or
+`force_reveal` got a presence update, a state lookup and often a broadcast
+per frame, and everything it sent piled up in the worker unbounded.
+Inbound frames now go through an `Inbox`:
+
+- rate limits per message type, WS_RATE_LIMITS (token buckets, see
+  game/throttle.py): over the limit the frame is dropped and the client
+  gets one error, then nothing until the bucket refills. Every frame is
+  charged, including the votes dropped or merged below;
+- a vote equal to the last one still waiting (or, if none waits, to the one
+  already recorded) is dropped, and a vote arriving right behind a waiting
+  vote replaces it (only the last value would have counted);
+- at most WS_INBOX_SIZE frames wait; one more and the socket is closed (4008).
+
+The consumer drains its inbox from a task of its own, so group frames keep
+reaching the socket while its messages are handled.
+
+Outbound, Daphne writes every frame into the Twisted transport without
+waiting for the client: the worker cannot see a socket's send buffer. The
+client therefore reports in its heartbeat how many frames it has received;
+a socket more than WS_MAX_UNACKED frames behind is closed (4008) and
+resyncs from a fresh snapshot when it reconnects. Clients that don't report
+are not checked.
+"""
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+from .throttle import TokenBucket
+
+INBOX_SIZE = getattr(settings, "WS_INBOX_SIZE", 32)
+MAX_UNACKED = getattr(settings, "WS_MAX_UNACKED", 500)
+# type -> (messages/s, rafale) ; "default" pour les autres types, sans entrée = pas de limite
+RATE_LIMITS = getattr(settings, "WS_RATE_LIMITS", {})
+
+CLOSE_CODE = 4008  # policy violation, côté application
+
+# issues de Inbox.offer
+QUEUED = "queued"
+THROTTLED = "throttled"
+FULL = "full"
+DROPPED = "dropped"
+
+
+class Inbox:
+    def __init__(self, limits=None):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.items = deque()
+        self.closed = False
+        self._buckets = {}
+        self._warned = set()  # types déjà signalés au client depuis que leur seau est vide
+
+    def __len__(self):
+        return len(self.items)
+
+    def popleft(self):
+        return self.items.popleft()
+
+    def close(self):
+        """Forget what is waiting; frames offered afterwards are dropped."""
+        self.closed = True
+        self.items.clear()
+
+    def offer(self, t, content, current_vote=None):
+        """
+        Queue the frame `content` of type `t` (a metrics label) unless it is
+        redundant or over its limit. `current_vote` is the socket's recorded
+        vote, None if unknown; a vote still queued takes precedence over it.
+        Returns QUEUED, DROPPED, THROTTLED (drop the client should hear
+        about) or FULL (close the socket).
+        """
+        if self.closed:
+            return DROPPED
+        # le seau est débité avant la fusion : un flot de votes reste limité même s'il se fusionne
+        if not self._allow(t):
+            metrics.dropped.inc(t, "throttled")
+            if t in self._warned:
+                return DROPPED
+            self._warned.add(t)
+            return THROTTLED
+        self._warned.discard(t)
+
+        if t == "vote":
+            value = content.get("value")
+            queued = next((c for k, c in reversed(self.items) if k == "vote"), None)
+            # le vote de référence est le dernier en attente, à défaut celui enregistré
+            previous = current_vote if queued is None else queued.get("value")
+            if previous is not None and value == previous:
+                metrics.dropped.inc(t, "redundant")
+                return DROPPED
+            if self.items and self.items[-1][0] == "vote":
+                self.items[-1] = (t, content)
+                metrics.dropped.inc(t, "merged")
+                return DROPPED
+
+        if len(self.items) >= INBOX_SIZE:
+            metrics.dropped.inc(t, "inbox_full")
+            return FULL
+        self.items.append((t, content))
+        return QUEUED
+
+    def _allow(self, t):
+        bucket = self._buckets.get(t)
+        if bucket is None:
+            limit = self.limits.get(t) or self.limits.get("default")
+            if limit is None:
+                return True
+            bucket = self._buckets[t] = TokenBucket(*limit)
+        return bucket.allow()
+
+
+def lagging(sent, received):
+    """True if a client that reported `received` frames is too far behind `sent`."""
+    return isinstance(received, int) and sent - received > MAX_UNACKED
@@ -0,0 +1,354 @@
+"""
+WebSocket benchmark for RoomConsumer.
+
+Simulates R rooms x P players through the real ASGI stack (JWT middleware,
+routing, RoomConsumer) with channels.testing.WebsocketCommunicator and an
+in-memory channel layer, so it runs offline. Each round, every player
+votes, the admin reveals once everybody's vote has reached everybody, then
+every player sends C chat messages.
+
+Measured:
+
+- vote / reveal / chat latency: from the moment a client sends the message
+  to the moment each member of the room receives the matching frame (vote
+  latency includes the time spent in the BROADCAST_COALESCE_WINDOW);
+- frames received per second by all the clients;
+- database queries per vote (voting phase, background flush and analysis
+  history included) and per reveal.
+
+`vote_path()` measures the DB side of the vote path alone: R rooms flushing
+one vote at a time concurrently (`_write_changes`, what the flusher runs),
+first thread-sensitive then on a DB_ASYNC_THREADS pool (game/db.py), and
+reports writes per second for both. Run it against PostgreSQL: with SQLite
+the pool is disabled and both figures measure the same thing.
+
+`encoding()` is a micro-benchmark of JSON encoding alone (game/encoding.py):
+the cost of one vote_batch frame, one snapshot frame and one room detail
+payload (whole backlog embedded) for several room and backlog sizes, with
+the former encoders (stdlib json.dumps for frames, DRF's JSONRenderer for
+REST) and each backend available here; frames also get the cost and size
+of the MessagePack wire format (game/wire.py).
+
+`run()` returns a JSON-serialisable dict; `manage.py bench_rooms` prints it
+and can fail a pipeline on thresholds. Rooms and users are created in the
+configured database under a `bench-` prefix and deleted afterwards.
+"""
+import asyncio
+import contextlib
+import json
+import math
+import random
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from rest_framework.renderers import JSONRenderer as DRFJSONRenderer
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from accounts.tokens import access_token_for
+
+from . import backpressure, chat as chat_module, db, encoding as encoding_module, metrics, wire
+from .models import BacklogItem, Room, RoomMembership
+from .presence import MemoryBackend, presence
+from .state import RoomState, _write_changes, room_states
+from .throttle import Throttle
+
+CARDS = ["1", "2", "3", "5", "8", "13"]
+TIMEOUT = 30  # secondes avant d'abandonner une attente de diffusion
+IN_MEMORY_LAYER = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def percentiles(samples):
+    """{p50, p99, max, samples} in milliseconds, nearest-rank."""
+    if not samples:
+        return {"p50": None, "p99": None, "max": None, "samples": 0}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return round(ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)] * 1000, 3)
+
+    return {"p50": rank(50), "p99": rank(99), "max": round(ordered[-1] * 1000, 3), "samples": len(ordered)}
+
+
+class _Client:
+    def __init__(self, bench, code, username, token):
+        self.bench = bench
+        self.username = username
+        self.ws = WebsocketCommunicator(bench.application, f"/ws/rooms/{code}/?token={token}")
+        self.frames = 0
+        self.votes = 0
+        self.reveals = 0
+        self.chats = 0
+
+    async def connect(self):
+        connected, _ = await self.ws.connect()
+        if not connected:
+            raise RuntimeError(f"{self.username}: handshake refused")
+        self._reader = asyncio.ensure_future(self._read())
+
+    async def _read(self):
+        while True:
+            frame = json.loads(await self.ws.receive_from(timeout=None))
+            now = time.perf_counter()
+            self.frames += 1
+            kind = frame.get("type")
+            if kind == "vote_batch":
+                for delta in frame["deltas"]:
+                    self.bench.record("vote", (delta["username"], self.bench.round), now)
+                    self.votes += 1
+            elif kind in ("vote_cast", "vote_changed"):
+                # vote seul dans sa fenêtre de fusion : envoyé tel quel, pas en vote_batch
+                self.bench.record("vote", (frame["username"], self.bench.round), now)
+                self.votes += 1
+            elif kind == "reveal":
+                self.bench.record("reveal", (self.ws.scope["path"], self.bench.round), now)
+                self.reveals += 1
+            elif kind == "chat":
+                self.bench.record("chat", frame["message"], now)
+                self.chats += 1
+
+    async def send(self, content):
+        await self.ws.send_to(text_data=json.dumps(content))
+
+    async def close(self):
+        self._reader.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._reader
+        await self.ws.disconnect()
+
+
+class Bench:
+    def __init__(self, rooms, players, rounds, chat, seed):
+        from agilecards.asgi import application
+
+        self.application = application
+        self.rooms, self.players, self.rounds, self.chat = rooms, players, rounds, chat
+        self.random = random.Random(seed)
+        self.round = 0
+        self.sent = {}  # (kind, key) -> perf_counter() of the send
+        self.latencies = {"vote": [], "reveal": [], "chat": []}
+        self.db = {"vote": 0, "reveal": 0}
+
+    @staticmethod
+    def queries():
+        """SQL queries run so far by the DB helpers, whatever thread they ran on."""
+        return sum(metrics.db_queries.values.values())
+
+    def record(self, kind, key, now):
+        sent = self.sent.get((kind, key))
+        if sent is not None:
+            self.latencies[kind].append(now - sent)
+
+    async def until(self, done):
+        deadline = time.perf_counter() + TIMEOUT
+        while not done():
+            if time.perf_counter() > deadline:
+                raise RuntimeError("bench: broadcast not received in time")
+            await asyncio.sleep(0.002)
+
+    async def play_round(self, clients):
+        # votes : chacun reçoit les P deltas de la room
+        before = self.queries()
+        target = [c.votes + self.players for c in clients]
+        for client in clients:
+            self.sent[("vote", (client.username, self.round))] = time.perf_counter()
+            await client.send({"type": "vote", "value": self.random.choice(CARDS)})
+        await self.until(lambda: all(c.votes >= t for c, t in zip(clients, target)))
+        await room_states.flush_all()
+        self.db["vote"] += self.queries() - before
+
+        # reveal par l'admin (premier joueur)
+        before = self.queries()
+        admin = clients[0]
+        self.sent[("reveal", (admin.ws.scope["path"], self.round))] = time.perf_counter()
+        await admin.send({"type": "reveal"})
+        await self.until(lambda: all(c.reveals > self.round for c in clients))
+        self.db["reveal"] += self.queries() - before
+
+        for n in range(self.chat):
+            target = [c.chats + len(clients) for c in clients]
+            for client in clients:
+                message = f"bench:{client.username}:{self.round}:{n}"
+                self.sent[("chat", message)] = time.perf_counter()
+                await client.send({"type": "chat", "message": message})
+            await self.until(lambda: all(c.chats >= t for c, t in zip(clients, target)))
+
+    async def run(self, setup):
+        rooms = []
+        for code, tokens in setup:
+            clients = [_Client(self, code, username, token) for username, token in tokens]
+            for client in clients:
+                await client.connect()
+            rooms.append(clients)
+
+        started = time.perf_counter()
+        frames_before = sum(c.frames for clients in rooms for c in clients)
+        try:
+            for n in range(self.rounds):
+                self.round = n
+                await asyncio.gather(*(self.play_round(clients) for clients in rooms))
+            elapsed = time.perf_counter() - started
+            frames = sum(c.frames for clients in rooms for c in clients) - frames_before
+        finally:
+            for clients in rooms:
+                for client in clients:
+                    await client.close()
+
+        votes = self.rooms * self.players * self.rounds
+        return {
+            "config": {"rooms": self.rooms, "players": self.players, "rounds": self.rounds, "chat": self.chat,
+                       "db_threads": db.threads()},
+            "elapsed_s": round(elapsed, 3),
+            "votes": votes,
+            "frames_received": frames,
+            "messages_per_second": round(frames / elapsed, 1) if elapsed else None,
+            "vote_latency_ms": percentiles(self.latencies["vote"]),
+            "reveal_latency_ms": percentiles(self.latencies["reveal"]),
+            "chat_latency_ms": percentiles(self.latencies["chat"]),
+            "db_queries_per_vote": round(self.db["vote"] / votes, 2) if votes else None,
+            "db_queries_per_reveal": round(self.db["reveal"] / (self.rooms * self.rounds), 2) if self.rounds else None,
+        }
+
+
+def _create_rooms(prefix, rooms, players, rounds):
+    """[(code, [(username, token), ...]), ...]; the first player of each room is its admin."""
+    setup = []
+    for r in range(rooms):
+        users = [
+            User.objects.create_user(username=f"{prefix}-r{r}-p{p}", password=uuid.uuid4().hex)
+            for p in range(players)
+        ]
+        room = Room.objects.create(mode="average", creator=users[0])
+        BacklogItem.objects.bulk_create(
+            BacklogItem(room=room, title=f"Bench task {i + 1}", order=i) for i in range(rounds)
+        )
+        RoomMembership.objects.bulk_create(
+            RoomMembership(room=room, user=user, role="admin" if p == 0 else "player")
+            for p, user in enumerate(users)
+        )
+        setup.append((room.code, [(u.username, access_token_for(u)) for u in users]))
+    return setup
+
+
+def _cleanup(prefix):
+    Room.objects.filter(creator__username__startswith=f"{prefix}-").delete()
+    User.objects.filter(username__startswith=f"{prefix}-").delete()
+
+
+def run(rooms=2, players=5, rounds=3, chat=1, seed=0):
+    """
+    Sync entry point (management command, tests). Runs the scenario on an
+    in-memory channel layer and in-memory presence, without the chat and
+    per-socket rate limits (they would cap the load); returns the results dict.
+    """
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    setup = _create_rooms(prefix, rooms, players, rounds)
+    backend, presence.backend = presence.backend, MemoryBackend()
+    throttle, chat_module.throttle = chat_module.throttle, Throttle(0, 0)
+    limits, backpressure.RATE_LIMITS = backpressure.RATE_LIMITS, {}
+    try:
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+            bench = Bench(rooms, players, rounds, chat, seed)
+            return async_to_sync(bench.run)(setup)
+    finally:
+        presence.backend = backend
+        chat_module.throttle = throttle
+        backpressure.RATE_LIMITS = limits
+        _cleanup(prefix)
+
+
+async def _flush_votes(room_ids, writes):
+    async def room(room_id):
+        for i in range(writes):
+            await _write_changes([(room_id, {(0, f"voter-{i % 8}"): CARDS[i % len(CARDS)]}, None)])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(room(room_id) for room_id in room_ids))
+    return time.perf_counter() - started
+
+
+def vote_path(rooms=8, writes=50, threads=8):
+    """Vote flush throughput, thread-sensitive vs a pool of `threads` DB threads."""
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    setup = _create_rooms(prefix, rooms, 1, 1)
+    room_ids = list(Room.objects.filter(code__in=[code for code, _ in setup]).values_list("id", flat=True))
+    configured = db.threads()
+    results = {"rooms": rooms, "writes": rooms * writes}
+    try:
+        for name, size in (("thread_sensitive", 0), ("pool", threads)):
+            db.configure(size)
+            elapsed = async_to_sync(_flush_votes)(room_ids, writes)
+            results[name] = {
+                "threads": db.threads(),
+                "elapsed_s": round(elapsed, 3),
+                "writes_per_second": round(rooms * writes / elapsed, 1),
+            }
+    finally:
+        db.configure(configured)
+        _cleanup(prefix)
+    results["speedup"] = round(
+        results["pool"]["writes_per_second"] / results["thread_sensitive"]["writes_per_second"], 2)
+    return results
+
+
+def _frames(players, backlog):
+    """Synthetic vote_batch, snapshot and room detail payloads of the given sizes."""
+    usernames = [f"joueur-{i}" for i in range(players)]
+    items = [
+        {"external_id": f"US-{i}", "title": f"En tant qu'utilisateur je veux la fonction {i}",
+         "description": "Critères d'acceptation : " + "é" * 150, "order": i, "estimate": None}
+        for i in range(backlog)
+    ]
+    votes = {u: CARDS[i % len(CARDS)] for i, u in enumerate(usernames)}
+    # le snapshot tel que le serveur l'envoie : construit par RoomState (room non enregistrée)
+    room = Room(code="ABC123", mode="strict", version=3, current_task_index=0, started=True)
+    state = RoomState(room, {u: "player" for u in usernames}, (backlog, items[0] if items else None), votes)
+    return {
+        "vote_batch": {
+            "type": "vote_batch", "v": 2, "seq": 42, "voters": players, "total": players,
+            "deltas": [{"kind": "vote_cast", "seq": 42, "username": u, "value": v} for u, v in votes.items()],
+        },
+        "snapshot": state.snapshot(),
+        "room_detail": {
+            "code": "ABC123", "mode": "strict", "current_task_index": 0,
+            "created_at": "2026-01-01T00:00:00Z", "started": True,
+            "players": [{"username": u, "role": "player"} for u in usernames], "backlog": items,
+        },
+    }
+
+
+def _cost(fn, payload, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(payload)
+    return round((time.perf_counter() - started) / repeat * 1e6, 2)
+
+
+def encoding(players=(5, 50), backlog=(10, 100, 1000), repeat=200):
+    """Microseconds per encode, per payload and size, for each JSON encoder."""
+    backends = ["json"] + (["orjson"] if encoding_module.orjson is not None else [])
+    drf = DRFJSONRenderer()
+    cases = []
+    for p in players:
+        for b in backlog:
+            for name, payload in _frames(p, b).items():
+                if name != "room_detail" and b != backlog[0]:
+                    continue  # les trames ne portent qu'une tâche : une seule taille de backlog
+                former = drf.render if name == "room_detail" else json.dumps
+                us = {"former": _cost(former, payload, repeat)}
+                for backend in backends:
+                    us[backend] = _cost(lambda data: encoding_module.dumpb(data, backend), payload, repeat)
+                case = {
+                    "payload": name,
+                    "players": p,
+                    "backlog": b if name == "room_detail" else None,
+                    "bytes": len(encoding_module.dumpb(payload)),
+                    "us_per_encode": us,
+                }
+                if name != "room_detail" and wire.msgpack is not None:
+                    us["msgpack"] = _cost(lambda data: wire.encode(data, wire.MSGPACK), payload, repeat)
+                    case["msgpack_bytes"] = len(wire.encode(payload, wire.MSGPACK))
+                cases.append(case)
+    return {"backend": encoding_module.BACKEND, "backends": backends, "repeat": repeat, "cases": cases}
@@ -0,0 +1,134 @@
+"""
+Per-room broadcast scheduler.
+
+When a whole room votes within a second, sending every vote delta on its own
+means one group_send per vote, each fanned out to every socket. Coalescible
+events (vote deltas) are held for BROADCAST_COALESCE_WINDOW seconds (50 ms by
+default) and leave as a single `vote_batch` frame; latency-critical events
+(reveal, pause, resume…) go out immediately, after flushing whatever is
+pending so ordering is preserved.
+
+Every frame sent carries a `frame_id`, unique across workers: the sockets
+that receive it encode it once per wire format (game/wire.py).
+
+Counters are process-wide and served on /metrics
+(`pocker_broadcast_events_total`, `pocker_group_frames_total`,
+`pocker_broadcast_frames_saved_total`); `stats()` reports the same numbers:
+events scheduled, frames sent and frames saved by coalescing.
+"""
+import asyncio
+import binascii
+import itertools
+import time
+import uuid
+
+from django.conf import settings
+
+from . import metrics
+from .wire import FRAME_ID
+
+WINDOW = getattr(settings, "BROADCAST_COALESCE_WINDOW", 0.05)
+
+_frame_ids = itertools.count()
+_WORKER = uuid.uuid4().hex[:8]  # préfixe des frame_id de ce process
+
+
+def room_group(code):
+    return f"room_{code}"
+
+
+def room_shard(code, ring_size):
+    """
+    Index of the Redis host (out of `ring_size`) that carries the room's group:
+    the same CRC mapping channels_redis applies to group names, so other
+    per-room keys (presence) can live on the same shard.
+    """
+    if ring_size == 1:
+        return 0
+    return int((binascii.crc32(room_group(code).encode("utf8")) & 0xFFF) / (4096 / ring_size))
+
+
+def stats():
+    return {
+        "events": metrics.broadcast_events.values.get((), 0),
+        "frames": sum(metrics.frames.values.values()),
+        "frames_saved": metrics.frames_saved.values.get((), 0),
+    }
+
+
+class RoomBroadcaster:
+    def __init__(self, channel_layer, group):
+        self.channel_layer = channel_layer
+        self.group = group
+        self._pending = []
+        self._timer = None
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    async def coalesce(self, event):
+        """Queue a vote_delta event; it leaves with the others of the same window."""
+        metrics.broadcast_events.inc()
+        self._pending.append(event)
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def send_now(self, event):
+        await self.flush()
+        metrics.broadcast_events.inc()
+        await self._send(event)
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        if len(pending) == 1:
+            await self._send(pending[0])
+            return
+        last = pending[-1]
+        metrics.frames_saved.inc(amount=len(pending) - 1)
+        await self._send({
+            "type": "vote_batch",
+            "deltas": [
+                {"kind": e["kind"], "seq": e["seq"], "username": e["username"], "value": e["value"]}
+                for e in pending
+            ],
+            "seq": last["seq"],
+            "voters": last["voters"],
+            "total": last["total"],
+        })
+
+    async def _flush_later(self):
+        await asyncio.sleep(WINDOW)
+        await self.flush()
+
+    async def _send(self, event):
+        event = {**event, FRAME_ID: f"{_WORKER}:{next(_frame_ids)}"}
+        metrics.frames.inc(event["type"])
+        if not metrics.sampled():
+            await self.channel_layer.group_send(self.group, event)
+            return
+        start = time.perf_counter()
+        await self.channel_layer.group_send(self.group, event)
+        metrics.group_send_seconds.observe(time.perf_counter() - start, event["type"])
+
+
+_broadcasters = {}
+
+metrics.Gauge("pocker_broadcast_pending", "Vote deltas waiting for their coalescing window",
+              lambda: sum(b.pending for b in _broadcasters.values()))
+
+
+def broadcaster_for(channel_layer, group):
+    broadcaster = _broadcasters.get(group)
+    if broadcaster is None or broadcaster.channel_layer is not channel_layer:
+        broadcaster = _broadcasters[group] = RoomBroadcaster(channel_layer, group)
+    return broadcaster
+
+
+async def release_broadcaster(group):
+    """Flush and forget a room's broadcaster once it has no local socket left."""
+    broadcaster = _broadcasters.pop(group, None)
+    if broadcaster is not None:
+        await broadcaster.flush()
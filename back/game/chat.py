@@ -0,0 +1,136 @@
+"""
+Room chat: bounded history, rate limits, batched persistence.
+
+Each active room keeps its last CHAT_HISTORY messages (50 by default) in a
+ring buffer; it is loaded from ChatMessage when the room's first socket
+connects and sent with the snapshot, so late joiners see the conversation.
+
+Posting a message never touches the database on the event loop: it is
+appended to the ring, broadcast, and queued; a background flusher writes
+the queue every CHAT_FLUSH_INTERVAL seconds (1 s) in one bulk INSERT, and
+`release()` flushes before a room is evicted. Like votes (game/state.py), a
+message can be lost if the process dies inside that window.
+
+Limits: CHAT_MAX_LENGTH characters per message (500) and a token bucket per
+user and room, CHAT_RATE messages per second with bursts of CHAT_BURST
+(1/s, burst 5).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from . import encoding, metrics
+from .metrics import db_helper
+from .models import ChatMessage
+from .throttle import Throttle
+
+logger = logging.getLogger(__name__)
+
+HISTORY = getattr(settings, "CHAT_HISTORY", 50)
+MAX_LENGTH = getattr(settings, "CHAT_MAX_LENGTH", 500)
+FLUSH_INTERVAL = getattr(settings, "CHAT_FLUSH_INTERVAL", 1.0)
+
+throttle = Throttle(getattr(settings, "CHAT_RATE", 1.0), getattr(settings, "CHAT_BURST", 5))
+
+
+class ChatRejected(Exception):
+    """Message refused (empty, too long, rate limited); str() is shown to the user."""
+
+
+@db_helper("load_chat")
+def _load_history(room_id):
+    rows = (
+        ChatMessage.objects.filter(room_id=room_id)
+        .order_by("-created_at", "-id").values_list("username", "message", "created_at")[:HISTORY]
+    )
+    return [{"username": u, "message": m, "at": at.timestamp()} for u, m, at in reversed(rows)]
+
+
+@db_helper("write_chat")
+def _write_messages(rows):
+    ChatMessage.objects.bulk_create(
+        ChatMessage(room_id=room_id, username=e["username"], message=e["message"],
+                    created_at=datetime.fromtimestamp(e["at"], tz=timezone.utc))
+        for room_id, e in rows
+    )
+
+
+class ChatLog:
+    def __init__(self):
+        self._rooms = {}  # code -> deque of entries
+        self._json = {}  # code -> history serialized for the snapshot
+        self._pending = []  # (room_id, entry) not yet written
+        self._flusher = None
+
+    async def load(self, code, room_id):
+        """Called on connect: fills the room's ring from the database once."""
+        if code not in self._rooms:
+            history = await _load_history(room_id)
+            self._rooms.setdefault(code, deque(history, maxlen=HISTORY))
+
+    def history(self, code):
+        return list(self._rooms.get(code, ()))
+
+    def history_json(self, code):
+        text = self._json.get(code)
+        if text is None:
+            text = self._json[code] = encoding.dumps(self.history(code))
+        return text
+
+    def post(self, code, room_id, username, message):
+        """Validate, rate-limit and record a message; returns the entry to broadcast."""
+        message = message.strip() if isinstance(message, str) else ""
+        if not message:
+            raise ChatRejected("Message vide")
+        if len(message) > MAX_LENGTH:
+            raise ChatRejected(f"Message trop long ({MAX_LENGTH} caractères max)")
+        if not throttle.allow((code, username)):
+            raise ChatRejected("Trop de messages, patientez un peu")
+
+        entry = {"username": username, "message": message, "at": time.time()}
+        self._rooms.setdefault(code, deque(maxlen=HISTORY)).append(entry)
+        self._json.pop(code, None)
+        self._pending.append((room_id, entry))
+        self._ensure_flusher()
+        return entry
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Chat : échec de l'écriture des messages, nouvel essai")
+
+    async def flush(self):
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            await _write_messages(rows)
+        except Exception:
+            self._pending = rows + self._pending
+            raise
+
+    async def release(self, code):
+        """The room's last local socket left: persist what is pending and drop the ring."""
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Chat : échec de l'écriture des messages, nouvel essai")
+            self._ensure_flusher()
+        self._rooms.pop(code, None)
+        self._json.pop(code, None)
+
+
+chat_log = ChatLog()
+
+metrics.Gauge("pocker_chat_pending", "Chat messages waiting to be written", lambda: len(chat_log._pending))
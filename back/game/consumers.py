@@ -1,131 +1,278 @@
-import json
-from urllib.parse import parse_qs
+import asyncio
+import logging
+import time
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
-from .models import Room, Vote
-from django.shortcuts import get_object_or_404
+from . import backpressure, encoding, metrics, wire
+from .models import Room
+from .analysis import analysis_for, cached as cached_analysis
+from .broadcast import broadcaster_for, release_broadcaster, room_group
+from .chat import ChatRejected, chat_log
+from .presence import presence
+from .reveal import reveal_round
+from .state import PROTOCOL_VERSION, room_states
+from .timers import broadcast_timer, round_timers
+from .votes import VALID_VOTES
+
+logger = logging.getLogger(__name__)
+
+# types de message connus ; le reste est compté comme "other" (labels des métriques bornés)
+MESSAGE_TYPES = {"heartbeat", "vote", "coffee", "resume", "force_reveal", "reveal", "resync", "chat"}
 
 class RoomConsumer(AsyncJsonWebsocketConsumer):
+    format = wire.JSON  # format négocié par la socket (game/wire.py)
+
     async def connect(self):
         self.code = self.scope["url_route"]["kwargs"]["code"].upper()
-        qs = parse_qs(self.scope["query_string"].decode())
-        self.username = qs.get("username", ["anonymous"])[0]
+        self.tasks = set()
+        self.sent = 0  # trames envoyées, comparées à l'accusé du heartbeat (game/backpressure.py)
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.refuse(4401)
+            return
+        self.username = user.username
 
-        await self.channel_layer.group_add(self.group, self.channel_name)
-        await self.accept()
+        try:
+            state = await room_states.acquire(self.code)
+        except Room.DoesNotExist:
+            await self.refuse(4404)
+            return
 
-        await self.group_send("presence", {
-            "username": self.username,
-            "online": True
-        })
+        # Seuls les membres de la room votent : refus dès le handshake
+        self.role = state.players.get(self.username)
+        if self.role is None:
+            await room_states.release(self.code)
+            await self.refuse(4403)
+            return
+        self.state = state
+        self.inbox = backpressure.Inbox()
+        self.pump = None
 
-        room = await self.get_room()
-        payload = await self.current_payload(room)
+        self.broadcast = broadcaster_for(self.channel_layer, self.group)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        # JSON par défaut, MessagePack si le client propose le sous-protocole
+        subprotocol, self.format = wire.negotiate(self.scope.get("subprotocols") or [])
+        await self.accept(subprotocol)
+        round_timers.ensure(state)
+
+        # historique du chat envoyé avec le snapshot (game/chat.py)
+        await chat_log.load(self.code, state.room_id)
+
+        # présence : notifiée au groupe par lots (game/presence.py)
+        state.online = await presence.join(self.code, self.username)
+
+        # ✅ UN SEUL SNAPSHOT (votes + seq inclus pour appliquer les deltas ensuite)
+        await self.send_snapshot(self.state)
+
+        # Reconnexion après le dernier vote : l'analyse déjà calculée, sans recalcul
+        analysis = cached_analysis(state.room_id, state.current_task_index, state.votes)
+        if analysis is not None:
+            counts = state.counts()
+            await self.send_json({
+                "type": "ai_analysis",
+                **analysis,
+                "total_votes": counts["voters"],
+                "required_votes": counts["total"]
+            })
 
-        # ✅ UN SEUL SNAPSHOT
-        await self.send_json({
-            "type": "snapshot",
-            **payload,
-            "is_paused": room.is_paused,
-            "paused_by": room.paused_by
-        })
+    async def refuse(self, code):
+        """
+        Accept, then close with an application code: a close before accept
+        makes Daphne reject the handshake and the browser only sees 1006.
+        4401 invalid token, 4403 not a member, 4404 unknown room.
+        """
+        await self.accept()
+        await self.close(code=code)
 
     @property
     def group(self):
-        return f"room_{self.code}"
+        return room_group(self.code)
 
     async def disconnect(self, close_code):
+        if not hasattr(self, "state"):
+            return
+        # les messages déjà acceptés (un vote juste avant de fermer l'onglet) sont traités
+        if self.pump is not None:
+            await self.pump
         await self.channel_layer.group_discard(self.group, self.channel_name)
-        await self.group_send("presence", {"username": self.username, "online": False})
+        self.state.online = await presence.leave(self.code, self.username)
+        await room_states.release(self.code)
+        if self.code not in room_states:
+            round_timers.cancel(self.code)
+            await release_broadcaster(self.group)
+            await chat_log.release(self.code)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        if text_data is not None or bytes_data is not None:
+            self.sent += 1
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return encoding.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return encoding.dumps(content)
+
+    async def send_json(self, content, close=False):
+        await self.send_payload(wire.encode(content, self.format), close=close)
+
+    async def send_frame(self, event, frame):
+        """Send the client frame built from a group event, encoded once per format in this worker."""
+        frame.pop(wire.FRAME_ID, None)
+        await self.send_payload(wire.encode_frame(frame, self.format, event.get(wire.FRAME_ID)))
+
+    async def send_payload(self, payload, close=False):
+        if isinstance(payload, bytes):
+            await self.send(bytes_data=payload, close=close)
+        else:
+            await self.send(text_data=payload, close=close)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.format == wire.MSGPACK:
+            await self.receive_json(wire.decode(bytes_data))
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
 
     async def receive_json(self, content, **kwargs):
+        """Queue the frame (limits in game/backpressure.py); the pump task handles it."""
         t = content.get("type")
-        if t == "vote":
-            room = await self.get_room()
+        label = t if t in MESSAGE_TYPES else "other"
+        metrics.messages.inc(label)
+
+        if t == "heartbeat" and backpressure.lagging(self.sent, content.get("received")):
+            logger.info("Room %s : %s en retard de %s trames, déconnecté",
+                        self.code, self.username, self.sent - content["received"])
+            await self.shed("slow_consumer")
+            return
 
-            if room.is_paused:
-                print("⛔ Vote ignoré – room en pause")
+        # vote connu seulement si l'état en mémoire est à jour (sinon pas de dédoublonnage)
+        current = None if self.state.stale else self.state.votes.get(self.username)
+        outcome = self.inbox.offer(label, content, current)
+        if outcome == backpressure.QUEUED:
+            if self.pump is None or self.pump.done():
+                self.pump = asyncio.ensure_future(self.drain())
+        elif outcome == backpressure.THROTTLED:
+            await self.send_json({"type": "error", "message": "Trop de messages, patientez un peu"})
+        elif outcome == backpressure.FULL:
+            logger.info("Room %s : %s envoie trop vite, déconnecté", self.code, self.username)
+            await self.shed("inbox_full")
+
+    async def shed(self, reason):
+        metrics.closed.inc(reason)
+        self.inbox.close()
+        await self.close(code=backpressure.CLOSE_CODE)
+
+    async def drain(self):
+        """Handle the inbox in order, one message at a time."""
+        while self.inbox:
+            label, content = self.inbox.popleft()
+            metrics.message_type.set(label)
+            try:
+                if not metrics.sampled():
+                    await self.handle_message(content.get("type"), content)
+                    continue
+                start = time.perf_counter()
+                await self.handle_message(content.get("type"), content)
+                metrics.message_seconds.observe(time.perf_counter() - start, label)
+            except Exception:
+                logger.exception("Room %s : échec du message %s de %s", self.code, label, self.username)
+
+    async def handle_message(self, t, content):
+        await presence.heartbeat(self.code, self.username)
+        if t == "heartbeat":
+            return
+        state = await room_states.get(self.code)
+        round_timers.ensure(state)
+        # Rôle relu en mémoire (mis à jour par invalidate après kick / promote)
+        self.role = state.players.get(self.username)
+        if self.role is None:
+            self.inbox.close()
+            await self.close(code=4403)
+            return
+        if t == "vote":
+            if state.is_paused:
+                logger.debug("Vote ignoré – room %s en pause", self.code)
                 return  
 
             value = content.get("value")
-            await self.save_vote(self.username, value)
+            kind = self.save_vote(state, self.username, value)
+            if kind is None:
+                return
 
-            counts = await self.vote_counts()
-            
-            # ✅ RÉCUPÉREZ LES VOTES ACTUALISÉS POUR TOUS LES JOUEURS
-            votes_data = await self.get_current_votes()
+            counts = state.counts()
             
-            # Envoyez les votes mis à jour à TOUT LE MONDE
-            await self.channel_layer.group_send(self.group, {
-                "type": "votes_updated",
-                "votes": votes_data,
-                "counts": counts
+            # Seul le vote modifié part à TOUT LE MONDE (delta numéroté par seq)
+            await self.broadcast.coalesce({
+                "type": "vote_delta",
+                "kind": kind,
+                "seq": state.seq,
+                "username": self.username,
+                "value": value,
+                **counts
             })
             
             # Broadcast "voted" progress
-            print(f"🎯 [IA DEBUG] Vote reçu - {counts['voters']}/{counts['total']} votes")
+            logger.debug("Room %s : vote reçu - %s/%s votes", self.code, counts["voters"], counts["total"])
             
             if counts["voters"] >= counts["total"]:
-                print("🎯 [IA] Tous ont voté - envoi de l'analyse TEST...")
-                
-                await self.channel_layer.group_send(self.group, {
-                    "type": "ai_analysis_event",
-                    "analysis": "🤖 ANALYSE IA : Divergence détectée ! Certains voient des complexités API cachées. Estimation recommandée : 8 points.",
-                    "vote_summary": {"5": 2, "8": 1, "13": 2},
-                    "total_votes": counts["voters"],
-                    "required_votes": counts["total"]
-                })
+                # calcul hors de la boucle (pool de threads), résultat en cache
+                self.spawn(self.send_analysis(state.room_id, state.current_task_index, dict(state.votes), counts))
 
         elif t == "coffee":
-            room = await self.get_room()
-            room.is_paused = True
-            room.paused_by = self.username
-            await database_sync_to_async(room.save)()
+            state.set_paused(self.username)
+            room_states.mark_dirty(state)
+            round_timers.pause(self.code)
 
-            await self.channel_layer.group_send(self.group, {
+            await self.broadcast.send_now({
                 "type": "pause_event",
                 "paused_by": self.username
             })
+            await broadcast_timer(self.code)
 
         elif t == "resume":
-            room = await self.get_room()
-            room.is_paused = False
-            room.paused_by = None
-            await database_sync_to_async(room.save)()
+            state.set_paused(None)
+            room_states.mark_dirty(state)
+            round_timers.resume(self.code)
 
-            await self.channel_layer.group_send(self.group, {
+            await self.broadcast.send_now({
                 "type": "resume_event"
             })
+            await broadcast_timer(self.code)
         elif t == "force_reveal":
-            room = await self.get_room()
-
-            if room.is_paused:
+            if state.is_paused:
                 return
 
-            #  PAS besoin d’être admin (c’est le timer)
-            res = await self.reveal_logic(force=True)
+            # Le timer tourne côté serveur (game/timers.py) : ici, reveal forcé par l'admin.
+            # "version" (celle du snapshot / timer) évite qu'un double envoi révèle aussi le round suivant.
+            if self.role != "admin":
+                await self.send_json({"type": "error", "message": f"Not admin: {self.username}"})
+                return
+            res = await reveal_round(state, force=True, version=content.get("version", state.version))
+            if res is None:
+                return
 
-            await self.channel_layer.group_send(self.group, {
+            await self.broadcast.send_now({
                 "type": "reveal_event",
-                **res
+                **res,
+                "seq": state.seq
             })
+            round_timers.rearm(state)
+            await broadcast_timer(self.code)
 
         elif t == "reveal":
-            print("👀 REVEAL RECEIVED FROM", self.username)
-            
-            room = await self.get_room()
+            logger.info("Room %s : reveal demandé par %s", self.code, self.username)
             
-            if room.is_paused:
+            if state.is_paused:
                 await self.send_json({"type": "error", "message": "Session en pause"})
                 return
             
-            if not await self.is_admin(self.username):
+            if self.role != "admin":
                 await self.send_json({"type": "error", "message": f"Not admin: {self.username}"})
                 return
             
             # ✅ VÉRIFIER SI TOUS ONT VOTÉ
-            counts = await self.vote_counts()
+            counts = state.counts()
             if counts["voters"] < counts["total"]:
                 await self.send_json({
                     "type": "error", 
@@ -133,203 +280,156 @@ class RoomConsumer(AsyncJsonWebsocketConsumer):
                 })
                 return
             
-            res = await self.reveal_logic()
-            
-            await self.channel_layer.group_send(self.group, {
+            res = await reveal_round(state)
+            if res is None:
+                # compare-and-swap perdu : le round a déjà été révélé (REST, timer, autre admin)
+                await self.send_json({"type": "error", "message": "Round already revealed"})
+                return
+
+            await self.broadcast.send_now({
                 "type": "reveal_broadcast",
                 "status": res.get("status"),
-                "result": res.get("result")
+                "result": res.get("result"),
+                "seq": state.seq
             })
+            round_timers.rearm(state)
+            await broadcast_timer(self.code)
+        # Le client a vu un trou dans les seq : on lui renvoie l'état complet
+        elif t == "resync":
+            await self.send_snapshot(state)
         # Gestion du chat
         elif t == "chat":
-            print(f"💬 Chat message from {self.username}: {content.get('message')}")
-            await self.channel_layer.group_send(self.group, {
-                "type": "chat_event",
-                "username": self.username,
-                "message": content.get("message")
-            })
-
-    # ---------- Group send wrappers ----------
-    async def group_send(self, kind, data):
-        await self.channel_layer.group_send(self.group, {"type": f"{kind}_event", **data})
+            logger.debug("Room %s : message de %s", self.code, self.username)
+            try:
+                entry = chat_log.post(self.code, state.room_id, self.username, content.get("message"))
+            except ChatRejected as e:
+                await self.send_json({"type": "error", "message": str(e)})
+                return
+            await self.broadcast.send_now({"type": "chat_event", **entry})
 
+    # ---------- Group event handlers ----------
     async def presence_event(self, event):
-        await self.send_json({"type": "presence", **event})
+        self.state.online = event["online"]
+        await self.send_frame(event, {**event, "type": "presence"})
+
+    async def room_invalidate(self, event):
+        """Un REST d'un autre worker a écrit dans la room : relecture au prochain message"""
+        room_states.invalidate(self.code)
+        if not self.state.started:
+            # peut-être start_game : le timer du premier round part sans attendre un message
+            state = await room_states.get(self.code)
+            if state.started and round_timers.get(self.code) is None:
+                round_timers.ensure(state)
+                await broadcast_timer(self.code)
 
     async def voted_event(self, event):
-        await self.send_json({"type": "voted", **event})
+        await self.send_frame(event, {"type": "voted", **event})
 
     async def push_snapshot(self, event):
-        await self.send_json({"type": "snapshot", **event})
+        await self.send_frame(event, {"type": "snapshot", **event})
 
     async def reveal_event(self, event):
-        await self.send_json({"type": "reveal", **event})
+        await self.send_frame(event, {**event, "type": "reveal"})
 
     async def chat_event(self, event):
-        await self.send_json({
+        await self.send_frame(event, {
             "type": "chat",
             "username": event["username"],
-            "message": event["message"]
+            "message": event["message"],
+            "at": event.get("at")
         })
     async def resume_event(self, event):
-        await self.send_json({
+        await self.send_frame(event, {
             "type": "resume_event"
         })
     async def pause_event(self, event):
-        await self.send_json({
+        await self.send_frame(event, {
             "type": "pause_event",
             "paused_by": event.get("paused_by")
         })
     async def reveal_broadcast(self, event):
         """Handler spécial pour le reveal qui envoie directement 'reveal'"""
-        await self.send_json({
+        await self.send_frame(event, {
             "type": "reveal",
             "status": event.get("status"),
-            "result": event.get("result")
+            "result": event.get("result"),
+            "seq": event.get("seq")
         })
-    async def votes_updated(self, event):
-        """Envoie les votes mis à jour à tous les clients"""
-        await self.send_json({
-            "type": "votes_updated",
-            "votes": event["votes"],
-            "counts": event["counts"]
+    async def vote_batch(self, event):
+        """Plusieurs votes fusionnés dans la même fenêtre (voir game/broadcast.py)"""
+        await self.send_frame(event, {
+            "type": "vote_batch",
+            "v": PROTOCOL_VERSION,
+            "seq": event["seq"],
+            "deltas": event["deltas"],
+            "voters": event["voters"],
+            "total": event["total"]
+        })
+    async def vote_delta(self, event):
+        """Envoie uniquement le vote qui a changé (vote_cast / vote_changed)"""
+        await self.send_frame(event, {
+            "type": event["kind"],
+            "v": PROTOCOL_VERSION,
+            "seq": event["seq"],
+            "username": event["username"],
+            "value": event["value"],
+            "voters": event["voters"],
+            "total": event["total"]
+        })
+    async def backlog_progress(self, event):
+        """Progression d'un import de backlog (envoyée par set_backlog)"""
+        await self.send_frame(event, {
+            "type": "backlog_progress",
+            "imported": event["imported"],
+            "done": event["done"]
         })
     #  AJOUT : Handler pour l'analyse IA
     async def ai_analysis_event(self, event):
-        print("🤖 [IA] Envoi de l'analyse au frontend...")
-        await self.send_json({
-            "type": "ai_analysis",
-            "analysis": event["analysis"],
-            "vote_summary": event.get("vote_summary", {}),
-            "total_votes": event.get("total_votes", 0),
-            "required_votes": event.get("required_votes", 0)
+        await self.send_frame(event, {**event, "type": "ai_analysis"})
+
+    async def send_analysis(self, room_id, task_index, votes, counts):
+        result = await analysis_for(room_id, task_index, votes)
+        await self.broadcast.send_now({
+            "type": "ai_analysis_event",
+            **result,
+            "total_votes": counts["voters"],
+            "required_votes": counts["total"]
         })
 
-    # ---------- DB helpers ----------
-    @database_sync_to_async
-    def get_room(self):
-        return get_object_or_404(Room, code=self.code)
-
-    @database_sync_to_async
-    def is_admin(self, username):
-        room = Room.objects.get(code=self.code)
-        return any(p.get("username") == username and p.get("role") == "admin" for p in room.players)
-
-    @database_sync_to_async
-    def current_payload(self, room):
-        idx = room.current_task_index
-        backlog = room.backlog or []
-        if idx >= len(backlog):
-            return {"done": True, "current": None, "total": len(backlog), "index": idx}
-        return {
-            "done": False,
-            "current": backlog[idx],
-            "total": len(backlog),
-            "index": idx + 1
-        }
-    @database_sync_to_async
-    def get_current_votes(self):
-        """Récupère tous les votes actuels"""
-        room = Room.objects.get(code=self.code)
-        idx = room.current_task_index
-        votes = Vote.objects.filter(room=room, task_index=idx)
-        
-        # Format: {username: vote_value}
-        votes_dict = {}
-        for vote in votes:
-            votes_dict[vote.username] = vote.value
-        
-        return votes_dict
-    @database_sync_to_async
-    def save_vote(self, username, value):
-        room = Room.objects.get(code=self.code)
-        valid = ["1","2","3","5","8","13","20","40","100","coffee"]
-        if value not in valid:
+    def spawn(self, coro):
+        """Run `coro` without holding up this socket's messages."""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def timer_event(self, event):
+        await self.send_frame(event, {**event, "type": "timer"})
+
+    # ---------- State helpers ----------
+    async def send_snapshot(self, state):
+        if self.format == wire.JSON:
+            await self.send(text_data=self.snapshot_text(state))
             return
-        idx = room.current_task_index
-        Vote.objects.filter(room=room, username=username, task_index=idx).delete()
-        Vote.objects.create(room=room, username=username, task_index=idx, value=value)
-
-    @database_sync_to_async
-    def vote_counts(self):
-        room = Room.objects.get(code=self.code)
-        idx = room.current_task_index
-        total = len(room.players)
-        count = Vote.objects.filter(room=room, task_index=idx).count()
-        return {"voters": count, "total": total}
-    @database_sync_to_async
-    def reveal_logic(self, force=False):
-        room = Room.objects.get(code=self.code)
-        idx = room.current_task_index
-        votes = list(Vote.objects.filter(room=room, task_index=idx))
-
-        # DEBUG: Afficher ce qu'on a
-        print(f"🔧 [DEBUG] Room {self.code} - Mode: {room.mode}")
-        print(f"🔧 [DEBUG] Votes reçus: {[(v.username, v.value) for v in votes]}")
-        
-        values = [v.value for v in votes if v.value != "coffee"]
-
-        # CAS 1 : aucun vote → skip
-        if len(values) == 0:
-            room.current_task_index += 1
-            room.save()
-            return {"status": "skipped"}
-
-        # CAS 2 : votes partiels AUTORISÉS si force
-        if not force:
-            if len(votes) < len(room.players):
-                return {"status": "wait"}
-
-        # ✅ CORRECTION COMPLÈTE POUR TOUS LES MODES
-        
-        if room.mode == "strict":
-            print("🔧 [DEBUG] Mode STRICT activé")
-            
-            # En mode strict, on exclut les votes "coffee" de la décision
-            # mais ils comptent comme une participation
-            
-            # Vérifier si TOUS les votes non-coffee sont identiques
-            unique_values = set(values)
-            print(f"🔧 [DEBUG] Valeurs uniques (sans coffee): {unique_values}")
-            
-            if len(unique_values) == 1:
-                # TOUT LE MONDE EST D'ACCORD
-                result = list(unique_values)[0]
-                print(f"🔧 [DEBUG] Accord trouvé: {result}")
-            else:
-                # DIVERGENCE → ON REVOTE
-                print(f"🔧 [DEBUG] Divergence détectée: {unique_values}")
-                Vote.objects.filter(room=room, task_index=idx).delete()
-                return {"status": "revote"}
-                
-        elif room.mode == "average":
-            print("🔧 [DEBUG] Mode AVERAGE activé")
-            nums = list(map(int, values))
-            result = str(round(sum(nums) / len(nums)))
-            
-        elif room.mode == "median":
-            print("🔧 [DEBUG] Mode MEDIAN activé")
-            nums = sorted(map(int, values))
-            result = str(nums[len(nums)//2])
-            
-        else:  # mode "majority" (par défaut)
-            print("🔧 [DEBUG] Mode MAJORITY activé")
-            from collections import Counter
-            counter = Counter(values)
-            print(f"🔧 [DEBUG] Comptage: {counter}")
-            
-            if counter:
-                most_common = counter.most_common(1)[0]
-                result = most_common[0]
-                print(f"🔧 [DEBUG] Majorité: {result} ({most_common[1]} votes)")
-            else:
-                result = values[0] if values else "0"
-
-        print(f"🔧 [DEBUG] Résultat final: {result}")
-        
-        room.backlog[idx]["estimate"] = result
-        room.current_task_index += 1
-        room.save()
-        Vote.objects.filter(room=room, task_index=idx).delete()
-
-        return {"status": "validated", "result": result}
\ No newline at end of file
+        timer = round_timers.get(self.code)
+        await self.send_payload(wire.encode({
+            **state.snapshot(),
+            "timer": timer.info() if timer else None,
+            "chat": chat_log.history(self.code),
+        }, self.format))
+
+    def snapshot_text(self, state):
+        # snapshot de la room sérialisé une fois pour toutes les sockets ; seul le timer est propre à l'envoi
+        timer = round_timers.get(self.code)
+        return (
+            state.snapshot_json()[:-1]
+            + ', "timer": ' + encoding.dumps(timer.info() if timer else None)
+            + ', "chat": ' + chat_log.history_json(self.code) + "}"
+        )
+
+    def save_vote(self, state, username, value):
+        if value not in VALID_VOTES:
+            return None
+        kind = state.cast_vote(username, value)
+        if kind is not None:
+            room_states.mark_dirty(state)
+        return kind
@@ -0,0 +1,72 @@
+"""
+Database access for the async side (consumers, timers, analysis).
+
+By default DB helpers run like @database_sync_to_async: thread-sensitive,
+i.e. every helper of the process queues on one shared thread, so a slow
+reveal in one room delays the state loads and vote flushes of all the
+others. DB_ASYNC_THREADS > 0 runs them on a dedicated pool of that many
+threads instead: at most DB_ASYNC_THREADS helpers hit the database at the
+same time, each thread on its own connection.
+
+That is safe for the helpers of this app: each one is a self-contained unit
+(one transaction, round transitions guarded by the Room.version CAS) that
+never relies on a connection or transaction opened by its caller. Keep the
+pool at or below the database pool size (DB_POOL_MAX_SIZE) or the threads
+will wait for connections. SQLite (tests) always stays thread-sensitive.
+
+Connections themselves are kept alive by CONN_MAX_AGE or, with
+DB_POOL_MAX_SIZE, by psycopg's pool (see agilecards/settings.py).
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def configure(threads):
+    """(Re)size the DB executor; 0 goes back to the thread-sensitive mode."""
+    global _executor
+    if threads > 0 and connections["default"].vendor == "sqlite":
+        logger.warning("DB_ASYNC_THREADS ignoré avec SQLite (écritures concurrentes impossibles)")
+        threads = 0
+    old, _executor = _executor, (
+        ThreadPoolExecutor(max_workers=threads, thread_name_prefix="db") if threads > 0 else None
+    )
+    if old is not None:
+        _close(old)
+
+
+def _close(executor):
+    """Close the connection of every thread of `executor`, then stop it."""
+    started = len(executor._threads)
+    if started:
+        barrier = threading.Barrier(started)
+
+        def close():
+            barrier.wait()  # une tâche par thread : toutes attendent ici avant de fermer
+            connections.close_all()
+
+        for _ in range(started):
+            executor.submit(close)
+    executor.shutdown(wait=True)
+
+
+def threads():
+    return _executor._max_workers if _executor is not None else 0
+
+
+def run(fn, *args, **kwargs):
+    """Await the sync `fn(*args, **kwargs)` in the configured executor."""
+    if _executor is None:
+        return DatabaseSyncToAsync(fn)(*args, **kwargs)
+    return DatabaseSyncToAsync(fn, thread_sensitive=False, executor=_executor)(*args, **kwargs)
+
+
+configure(getattr(settings, "DB_ASYNC_THREADS", 0))
@@ -0,0 +1,84 @@
+"""
+JSON encoding for WebSocket frames and REST responses.
+
+Every frame RoomConsumer sends and every DRF response went through the
+stdlib `json` module; encoding vote frames and room payloads that embed the
+whole backlog showed up in CPU profiles. Everything now goes through
+`dumps` / `loads` here, backed by orjson when it is installed (several
+times faster, see `bench.encoding()`), by `json` otherwise. JSON_BACKEND
+("auto", "orjson" or "json") forces one of them.
+
+Both backends produce the same documents: compact separators, UTF-8 rather
+than \\u escapes, non-string dict keys turned into strings. Types orjson
+doesn't know (Decimal, lazy translations, datetimes...) go through DRF's
+encoder, as with the stock JSONRenderer.
+
+`JSONRenderer` / `JSONParser` are the DRF classes installed in
+REST_FRAMEWORK; the renderer falls back to DRF's own when the client asks
+for indented output (browsable API).
+"""
+import json
+
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle : repli sur json
+    orjson = None
+
+BACKEND = getattr(settings, "JSON_BACKEND", "auto")
+if BACKEND == "auto":
+    BACKEND = "orjson" if orjson is not None else "json"
+elif BACKEND == "orjson" and orjson is None:
+    raise ImportError("JSON_BACKEND = 'orjson' but orjson is not installed")
+
+_default = JSONEncoder().default
+_encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+if orjson is not None:
+    # datetimes confiés à l'encodeur DRF : même format qu'avant (ms, "Z")
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+def dumpb(obj, backend=None):
+    """`obj` as UTF-8 JSON bytes."""
+    if (backend or BACKEND) == "orjson":
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+    return _encoder.encode(obj).encode()
+
+
+def dumps(obj, backend=None):
+    """`obj` as JSON text."""
+    if (backend or BACKEND) == "orjson":
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+    return _encoder.encode(obj)
+
+
+def loads(data, backend=None):
+    """Parse JSON text or bytes; raises ValueError on invalid input."""
+    if (backend or BACKEND) == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # comme DRF : U+2028 / U+2029 échappés pour pouvoir inclure la réponse dans du JS
+        return dumpb(data).replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class JSONParser(parsers.JSONParser):
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % exc)
@@ -0,0 +1,200 @@
+"""
+Estimation engine: turns a round's votes into the task estimate.
+
+Every reveal path (WebSocket `reveal_logic`, REST `reveal_votes`) goes through
+`estimate()`. Votes are encoded once as small integer card codes (index in
+CARDS, coffee excluded) and each mode is a strategy registered in STRATEGIES
+with two implementations:
+
+- `single(points, weights)` for one round, plain Python on a handful of ints;
+- `batch(np, points, weights, counts, codes)` for many rounds at once, on NumPy matrices
+  (one row per round, NaN where a seat has no vote), used by `estimate_batch`
+  to recompute historical rounds for retro analytics.
+
+A strategy returns the estimate in points, or None when the round must be
+revoted (strict mode without unanimity). Ties always go to the lower card.
+NumPy is only imported by the batch API.
+"""
+from .votes import VALID_VOTES
+
+COFFEE = "coffee"
+CARDS = [int(v) for v in VALID_VOTES if v != COFFEE]  # code -> points
+CODES = {str(p): code for code, p in enumerate(CARDS)}
+NO_VOTE = -1  # padding / coffee in encoded rounds
+
+ROLE_WEIGHTS = {"admin": 2.0, "player": 1.0}
+TRIM = 1  # trimmed_mean drops this many votes at each end (rounds of 3+ votes)
+
+
+class Strategy:
+    def __init__(self, single, batch):
+        self.single = single
+        self.batch = batch
+
+
+def _round(x):
+    # même arrondi que l'ancien code : round() Python (au pair le plus proche)
+    return int(round(x))
+
+
+def snap(x):
+    """Nearest card to `x`, the lower one on a tie."""
+    return min(CARDS, key=lambda card: (abs(card - x), card))
+
+
+# ---------- single round ----------
+
+def strict(points, weights):
+    return points[0] if min(points) == max(points) else None
+
+
+def average(points, weights):
+    return _round(sum(points) / len(points))
+
+
+def median(points, weights):
+    return sorted(points)[len(points) // 2]
+
+
+def majority(points, weights):
+    counts = {}
+    for p in points:
+        counts[p] = counts.get(p, 0) + 1
+    return max(sorted(counts), key=lambda p: counts[p])
+
+
+def trimmed_mean(points, weights):
+    kept = sorted(points)
+    if len(kept) > 2 * TRIM:
+        kept = kept[TRIM:len(kept) - TRIM]
+    return _round(sum(kept) / len(kept))
+
+
+def weighted_by_role(points, weights):
+    return _round(sum(p * w for p, w in zip(points, weights)) / sum(weights))
+
+
+def fibonacci_snap(points, weights):
+    return snap(sum(points) / len(points))
+
+
+def _strategy(mode):
+    # un mode inconnu retombe sur "majority", comme l'ancien reveal
+    return STRATEGIES.get(mode, STRATEGIES["majority"])
+
+
+def estimate(mode, votes, roles=None):
+    """
+    Estimate for one round. `votes`: {username: value}, `roles`: {username: role}.
+    Returns "coffee" when nobody voted a number, None for a revote, else the
+    estimate as a string (what BacklogItem.estimate stores).
+    """
+    roles = roles or {}
+    cast = [(CODES[v], ROLE_WEIGHTS.get(roles.get(u), 1.0)) for u, v in votes.items() if v in CODES]
+    if not cast:
+        return COFFEE
+    points = [CARDS[code] for code, _ in cast]
+    weights = [w for _, w in cast]
+    result = _strategy(mode).single(points, weights)
+    return None if result is None else str(result)
+
+
+# ---------- batch (NumPy) ----------
+
+def pack_rounds(rounds, roles=None):
+    """
+    Encode rounds ({username: value} each) as `(codes, weights)` int8 / float32
+    matrices padded with NO_VOTE / 0, ready for `estimate_batch`.
+    """
+    import numpy as np
+
+    roles = roles or {}
+    width = max((len(r) for r in rounds), default=0)
+    codes = np.full((len(rounds), width), NO_VOTE, dtype=np.int8)
+    weights = np.zeros((len(rounds), width), dtype=np.float32)
+    for i, votes in enumerate(rounds):
+        j = 0
+        for username, value in votes.items():
+            if value in CODES:
+                codes[i, j] = CODES[value]
+                weights[i, j] = ROLE_WEIGHTS.get(roles.get(username), 1.0)
+                j += 1
+    return codes, weights
+
+
+def estimate_batch(mode, codes, weights=None):
+    """
+    Vectorized `estimate` over many rounds. `codes`: (rounds, seats) card codes
+    with NO_VOTE padding (see pack_rounds). Returns an int64 array of estimates
+    in points, NO_VOTE where the round has no numeric vote or needs a revote.
+    """
+    import numpy as np
+
+    codes = np.asarray(codes)
+    valid = codes != NO_VOTE
+    points = np.where(valid, np.asarray(CARDS, dtype=np.float64)[np.where(valid, codes, 0)], np.nan)
+    weights = np.where(valid, 1.0 if weights is None else np.asarray(weights, dtype=np.float64), 0.0)
+    counts = valid.sum(axis=1)
+
+    out = np.full(len(codes), NO_VOTE, dtype=np.int64)
+    rows = counts > 0
+    if not rows.any():
+        return out
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = _strategy(mode).batch(
+            np, points[rows], weights[rows], counts[rows], codes[rows])
+    out[rows] = np.where(np.isnan(result), NO_VOTE, result).astype(np.int64)
+    return out
+
+
+def _mean(np, points, counts):
+    return np.nansum(points, axis=1) / counts
+
+
+def _strict_batch(np, points, weights, counts, codes):
+    lo, hi = np.nanmin(points, axis=1), np.nanmax(points, axis=1)
+    return np.where(lo == hi, lo, np.nan)
+
+
+def _average_batch(np, points, weights, counts, codes):
+    return np.round(_mean(np, points, counts))
+
+
+def _median_batch(np, points, weights, counts, codes):
+    ordered = np.sort(points, axis=1)  # NaN en dernier
+    return ordered[np.arange(len(ordered)), counts // 2]
+
+
+def _majority_batch(np, points, weights, counts, codes):
+    per_card = (codes[:, :, None] == np.arange(len(CARDS))).sum(axis=1)
+    return np.asarray(CARDS, dtype=np.float64)[per_card.argmax(axis=1)]  # argmax: plus petite carte
+
+
+def _trimmed_mean_batch(np, points, weights, counts, codes):
+    ordered = np.sort(points, axis=1)
+    seats = np.arange(ordered.shape[1])
+    trim = np.where(counts > 2 * TRIM, TRIM, 0)[:, None]
+    kept = (seats >= trim) & (seats < counts[:, None] - trim)
+    return np.round(np.where(kept, ordered, 0).sum(axis=1) / kept.sum(axis=1))
+
+
+def _weighted_by_role_batch(np, points, weights, counts, codes):
+    return np.round(np.nansum(points * weights, axis=1) / weights.sum(axis=1))
+
+
+def _fibonacci_snap_batch(np, points, weights, counts, codes):
+    cards = np.asarray(CARDS, dtype=np.float64)
+    distance = np.abs(_mean(np, points, counts)[:, None] - cards)
+    return cards[distance.argmin(axis=1)]  # argmin: plus petite carte en cas d'égalité
+
+
+STRATEGIES = {
+    "strict": Strategy(strict, _strict_batch),
+    "average": Strategy(average, _average_batch),
+    "median": Strategy(median, _median_batch),
+    "majority": Strategy(majority, _majority_batch),
+    "trimmed_mean": Strategy(trimmed_mean, _trimmed_mean_batch),
+    "weighted_by_role": Strategy(weighted_by_role, _weighted_by_role_batch),
+    "fibonacci_snap": Strategy(fibonacci_snap, _fibonacci_snap_batch),
+}
+MODES = list(STRATEGIES)
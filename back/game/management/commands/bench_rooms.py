@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import bench
+
+
+class Command(BaseCommand):
+    help = "Benchmark WebSocket de RoomConsumer (R rooms x P joueurs), résultats en JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rooms", type=int, default=2)
+        parser.add_argument("--players", type=int, default=5)
+        parser.add_argument("--rounds", type=int, default=3)
+        parser.add_argument("--chat", type=int, default=1, help="Messages de chat par joueur et par round")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--db-threads", type=int, default=0,
+                            help="Ajoute la comparaison du chemin de vote en base : thread-sensitive vs N threads (game/db.py)")
+        parser.add_argument("--encoding", action="store_true",
+                            help="Ajoute le micro-benchmark d'encodage JSON des trames et réponses (game/encoding.py)")
+        parser.add_argument("--output", help="Écrit le JSON dans ce fichier au lieu de la sortie standard")
+        parser.add_argument("--max-vote-p99", type=float, help="Échoue si la latence p99 des votes (ms) dépasse ce seuil")
+        parser.add_argument("--max-queries-per-vote", type=float, help="Échoue si les requêtes par vote dépassent ce seuil")
+
+    def handle(self, *args, **options):
+        if options["rooms"] < 1 or options["players"] < 1 or options["rounds"] < 1:
+            raise CommandError("--rooms, --players and --rounds must be >= 1")
+
+        results = bench.run(
+            rooms=options["rooms"],
+            players=options["players"],
+            rounds=options["rounds"],
+            chat=options["chat"],
+            seed=options["seed"],
+        )
+        if options["db_threads"] > 0:
+            results["db_vote_path"] = bench.vote_path(rooms=max(options["rooms"], 2), threads=options["db_threads"])
+        if options["encoding"]:
+            results["encoding"] = bench.encoding()
+        report = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+        else:
+            self.stdout.write(report)
+
+        failures = []
+        p99 = results["vote_latency_ms"]["p99"]
+        if options["max_vote_p99"] is not None and p99 is not None and p99 > options["max_vote_p99"]:
+            failures.append(f"vote p99 {p99} ms > {options['max_vote_p99']} ms")
+        per_vote = results["db_queries_per_vote"]
+        if options["max_queries_per_vote"] is not None and per_vote > options["max_queries_per_vote"]:
+            failures.append(f"{per_vote} queries per vote > {options['max_queries_per_vote']}")
+        if failures:
+            raise CommandError("Benchmark regression: " + "; ".join(failures))
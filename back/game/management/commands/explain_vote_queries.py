@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+
+from game.models import Room, Vote
+
+
+class Command(BaseCommand):
+    help = "Affiche le plan d'exécution des requêtes Vote utilisées par RoomConsumer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("code", nargs="?", help="Room à utiliser (par défaut : la plus récente)")
+        parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE pour les SELECT (PostgreSQL)")
+        parser.add_argument("--check", action="store_true", help="Échoue si un plan contient un Seq Scan sur game_vote")
+
+    def handle(self, *args, code=None, analyze=False, check=False, **options):
+        room = Room.objects.filter(code=code.upper()) if code else Room.objects.order_by("-id")
+        room = room.first()
+        if room is None:
+            raise CommandError("No room found")
+
+        idx = room.current_task_index
+        round_votes = Vote.objects.filter(room=room, task_index=idx)
+        explain_opts = {"analyze": True, "buffers": True} if analyze and connection.vendor == "postgresql" else {}
+
+        plans = {
+            "round votes (load state)": round_votes.values_list("username", "value").explain(**explain_opts),
+            "vote count": round_votes.values("room").annotate(n=Count("id")).explain(**explain_opts),
+            "tally": round_votes.values("value").annotate(n=Count("id")).explain(**explain_opts),
+        }
+        if connection.vendor == "postgresql":
+            # EXPLAIN sans ANALYZE : rien n'est exécuté
+            table = Vote._meta.db_table
+            plans["upsert"] = self._raw_explain(
+                f"INSERT INTO {table} (room_id, task_index, username, value) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (room_id, task_index, username) DO UPDATE SET value = EXCLUDED.value",
+                [room.id, idx, "explain", "5"],
+            )
+            plans["delete round"] = self._raw_explain(
+                f"DELETE FROM {table} WHERE room_id = %s AND task_index = %s", [room.id, idx]
+            )
+
+        self.stdout.write(f"Room {room.code} - task {idx} - {Vote.objects.count()} votes en base\n")
+        seq_scans = []
+        for name, plan in plans.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f"== {name}"))
+            self.stdout.write(plan + "\n")
+            if "Seq Scan on game_vote" in plan or "SCAN game_vote" in plan:
+                seq_scans.append(name)
+
+        if check and seq_scans:
+            raise CommandError(f"Sequential scan on game_vote: {', '.join(seq_scans)}")
+
+    def _raw_explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + sql, params)
+            return "\n".join(row[0] for row in cursor.fetchall())
@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from game.models import ChatMessage, Room, RoundArchive, Vote
+
+
+def _latest(model, field):
+    return Subquery(
+        model.objects.filter(room=OuterRef("pk")).values("room").annotate(last=Max(field)).values("last")[:1]
+    )
+
+
+def inactive_rooms(limit):
+    """
+    Rooms with no activity since `limit`: last reveal (RoundArchive), last chat
+    message, or creation when neither exists. Votes carry no timestamp.
+    """
+    return Room.objects.annotate(
+        last_activity=Greatest(
+            "created_at",
+            Coalesce(_latest(RoundArchive, "revealed_at"), "created_at"),
+            Coalesce(_latest(ChatMessage, "created_at"), "created_at"),
+        )
+    ).filter(last_activity__lt=limit)
+
+
+class Command(BaseCommand):
+    help = "Supprime les votes qui ne servent plus (tâches déjà passées, rooms abandonnées)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-days", type=int, default=None,
+                            help="Supprime aussi tous les votes des rooms sans activité (reveal, chat) depuis N jours")
+
+    def handle(self, *args, older_than_days=None, **options):
+        deleted, _ = Vote.objects.filter(task_index__lt=F("room__current_task_index")).delete()
+        self.stdout.write(f"{deleted} votes de tâches terminées supprimés")
+
+        if older_than_days is not None:
+            limit = timezone.now() - timedelta(days=older_than_days)
+            deleted, _ = Vote.objects.filter(room__in=inactive_rooms(limit).values("pk")).delete()
+            self.stdout.write(f"{deleted} votes de rooms abandonnées supprimés")
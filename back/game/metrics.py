@@ -0,0 +1,163 @@
+"""
+Process metrics for the WebSocket hot path, served by /metrics in the
+Prometheus text format (one set per worker: scrape each worker directly).
+
+What is recorded, and what it costs:
+
+- messages received, per type: one dict increment per message;
+- handling time per message type, group_send time per frame type:
+  histograms, timed on a sample of METRICS_SAMPLE_RATE (0.1 by default) of
+  the messages / frames;
+- DB helpers run through `db_helper` (state load and flush, reveal,
+  analysis history): duration and number of queries, labelled with the
+  message type being handled when the helper was scheduled;
+- inbound frames dropped by the per-socket limits (game/backpressure.py),
+  per type and reason, and sockets closed for flooding or lagging;
+- room group events scheduled, frames sent per type and frames saved by
+  coalescing (game/broadcast.py);
+- presence calls served from memory because Redis failed (game/presence.py);
+- gauges (active rooms, sockets, timers, pending broadcasts / flushes,
+  analysis queue): computed only when /metrics is scraped.
+
+Everything is updated from the event loop, never from executor threads, so
+no lock is needed.
+"""
+import random
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+from . import db
+
+SAMPLE_RATE = getattr(settings, "METRICS_SAMPLE_RATE", 0.1)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# type du message WebSocket en cours de traitement (hérité par les tâches qu'il lance)
+message_type = ContextVar("message_type", default="none")
+
+_metrics = []
+
+
+def sampled():
+    return SAMPLE_RATE >= 1 or random.random() < SAMPLE_RATE
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def render(self):
+        yield f"# TYPE {self.name} histogram"
+        for labels, row in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row):
+                cumulative += count
+                le = _labels(self.labels + ("le",), labels + (bound,))
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {row[-1]:.6f}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {cumulative}"
+
+
+class Gauge:
+    """Value read at scrape time from `fn` (a number)."""
+
+    def __init__(self, name, help, fn):
+        self.name, self.help, self.fn = name, help, fn
+        _metrics.append(self)
+
+    def render(self):
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.fn()}"
+
+
+messages = Counter("pocker_ws_messages_total", "WebSocket messages received", ("type",))
+message_seconds = Histogram("pocker_ws_message_seconds", "Message handling time (sampled)", ("type",))
+group_send_seconds = Histogram("pocker_group_send_seconds", "group_send time per frame (sampled)", ("type",))
+broadcast_events = Counter("pocker_broadcast_events_total", "Events scheduled for room groups (game/broadcast.py)")
+frames = Counter("pocker_group_frames_total", "Frames sent to room groups", ("type",))
+frames_saved = Counter("pocker_broadcast_frames_saved_total", "Frames saved by coalescing vote deltas")
+dropped = Counter("pocker_ws_dropped_total", "Inbound frames dropped before handling", ("type", "reason"))
+encodes = Counter("pocker_ws_encodes_total", "Frames encoded, per wire format (game/wire.py)", ("format",))
+closed = Counter("pocker_ws_closed_total", "Sockets closed by the server for backpressure", ("reason",))
+presence_fallbacks = Counter("pocker_presence_fallbacks_total", "Presence calls served from memory after a Redis error")
+db_seconds = Histogram("pocker_db_seconds", "DB helper time, executor wait included", ("helper",))
+db_queries = Counter("pocker_db_queries_total", "SQL queries run by DB helpers", ("helper", "message"))
+
+
+class QueryCounter:
+    """execute_wrapper counting every statement run on one connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def db_helper(name):
+    """
+    Replaces @database_sync_to_async on the consumers' DB helpers: runs them
+    through game/db.py (thread-sensitive or bounded pool) and records their
+    duration and query count in the metrics above.
+    """
+    def decorator(fn):
+        def counted(*args, **kwargs):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                return fn(*args, **kwargs), counter.count
+
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result, queries = await db.run(counted, *args, **kwargs)
+            db_seconds.observe(time.perf_counter() - start, name)
+            db_queries.inc(name, message_type.get(), amount=queries)
+            return result
+
+        return wrapper
+    return decorator
+
+
+def render():
+    """Every metric of this process, Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def drop_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of each (room, task_index, username)."""
+    Vote = apps.get_model("game", "Vote")
+    latest = (
+        Vote.objects.values("room_id", "task_index", "username")
+        .annotate(keep=Max("id"))
+        .values_list("keep", flat=True)
+    )
+    Vote.objects.exclude(id__in=list(latest)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_room_is_paused_room_paused_by'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('room', 'task_index', 'username'), name='unique_vote_per_task'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_vote_unique_vote_per_task'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['room', 'task_index'], include=('username', 'value'), name='vote_round_idx'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_players_to_memberships(apps, schema_editor):
+    Room = apps.get_model("game", "Room")
+    RoomMembership = apps.get_model("game", "RoomMembership")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+
+    users = dict(User.objects.values_list("username", "id"))
+    memberships = []
+    for room in Room.objects.only("id", "players").iterator():
+        seen = set()
+        for player in room.players or []:
+            user_id = users.get(player.get("username"))
+            if user_id is None or user_id in seen:
+                continue
+            seen.add(user_id)
+            role = "admin" if player.get("role") == "admin" else "player"
+            memberships.append(RoomMembership(room_id=room.id, user_id=user_id, role=role))
+    RoomMembership.objects.bulk_create(memberships, batch_size=1000)
+
+
+def copy_memberships_to_players(apps, schema_editor):
+    Room = apps.get_model("game", "Room")
+    RoomMembership = apps.get_model("game", "RoomMembership")
+
+    players = {}
+    for room_id, username, role in RoomMembership.objects.order_by("id").values_list("room_id", "user__username", "role"):
+        players.setdefault(room_id, []).append({"username": username, "role": role})
+    for room in Room.objects.all():
+        room.players = players.get(room.id, [])
+        room.save(update_fields=["players"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_vote_round_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('admin', 'Admin'), ('player', 'Player')], default='player', max_length=10)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='game.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room', 'user'), name='unique_room_member')],
+            },
+        ),
+        migrations.RunPython(copy_players_to_memberships, copy_memberships_to_players),
+        migrations.RemoveField(
+            model_name='room',
+            name='players',
+        ),
+    ]
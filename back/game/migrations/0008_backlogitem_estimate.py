@@ -0,0 +1,68 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+def copy_backlog_to_items(apps, schema_editor):
+    """Room.backlog JSON -> one BacklogItem per task, `order` = position in the list."""
+    Room = apps.get_model("game", "Room")
+    BacklogItem = apps.get_model("game", "BacklogItem")
+
+    for room in Room.objects.only("id", "backlog").iterator():
+        if not room.backlog:
+            continue
+        BacklogItem.objects.filter(room_id=room.id).delete()
+        BacklogItem.objects.bulk_create([
+            BacklogItem(
+                room_id=room.id,
+                external_id=item.get("external_id") or item.get("id"),
+                title=(item.get("title") or "")[:255],
+                description=item.get("description") or "",
+                order=i,
+                estimate=item.get("estimate"),
+            )
+            for i, item in enumerate(room.backlog)
+        ], batch_size=1000)
+
+
+def copy_items_to_backlog(apps, schema_editor):
+    Room = apps.get_model("game", "Room")
+    BacklogItem = apps.get_model("game", "BacklogItem")
+
+    for room in Room.objects.all():
+        items = BacklogItem.objects.filter(room_id=room.id).order_by("order")
+        room.backlog = [
+            {
+                "external_id": item.external_id,
+                "title": item.title,
+                "description": item.description,
+                "order": item.order,
+                **({"estimate": item.estimate} if item.estimate is not None else {}),
+            }
+            for item in items
+        ]
+        room.save(update_fields=["backlog"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_roommembership'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backlogitem',
+            name='estimate',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='backlogitem',
+            index=models.Index(fields=['room', 'order'], name='backlog_room_order_idx'),
+        ),
+        migrations.RunPython(copy_backlog_to_items, copy_items_to_backlog),
+        migrations.RemoveField(
+            model_name='room',
+            name='backlog',
+        ),
+    ]
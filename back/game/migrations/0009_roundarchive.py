@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_backlogitem_estimate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomEstimateStats',
+            fields=[
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estimate_stats', serialize=False, to='game.room')),
+                ('rounds', models.PositiveIntegerField(default=0)),
+                ('validated', models.PositiveIntegerField(default=0)),
+                ('revotes', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('points', models.FloatField(default=0)),
+                ('voting_seconds', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayerDivergence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('rounds', models.PositiveIntegerField(default=0)),
+                ('steps', models.PositiveIntegerField(default=0)),
+                ('above', models.PositiveIntegerField(default=0)),
+                ('below', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='divergences', to='game.room')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room', 'username'), name='unique_divergence_per_player')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RoundArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_index', models.IntegerField()),
+                ('mode', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('validated', 'Validated'), ('revote', 'Revote'), ('skipped', 'Skipped')], max_length=10)),
+                ('result', models.CharField(blank=True, max_length=20, null=True)),
+                ('voters', models.JSONField(default=list)),
+                ('votes', models.BinaryField()),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('revealed_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='game.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'task_index'], name='round_room_task_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_room_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150)),
+                ('message', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_messages', to='game.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'created_at'], name='chat_room_created_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,3 @@
-from django.db import models
-
 from django.db import models
 from django.contrib.auth.models import User
 import string, random
@@ -10,33 +8,101 @@ def generate_code(length=6):
 
 class Room(models.Model):
     code = models.CharField(max_length=10, unique=True, default=generate_code)
-    mode = models.CharField(max_length=20)  # "strict" | "average" | "median" | "majority"
+    mode = models.CharField(max_length=20)  # voir game.estimation.MODES
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name="created_rooms")
-    players = models.JSONField(default=list)      # [{ "username": "...", "role": "admin|player" }]
-    backlog = models.JSONField(default=list)      # [{ id, title, description }]
     current_task_index = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     started = models.BooleanField(default=False)  
     is_paused = models.BooleanField(default=False)
     paused_by = models.CharField(max_length=150, null=True, blank=True)
+    # version du round : +1 à chaque transition (tâche suivante, revote, nouveau backlog).
+    # Les reveals font un compare-and-swap dessus (voir game/reveal.py).
+    version = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"Room {self.code} ({self.mode})"
 
+
+class MembershipQuerySet(models.QuerySet):
+    def role_of(self, room, user):
+        """Role of `user` (a User or a username) in `room`, or None if not a member."""
+        if isinstance(user, str):
+            members = self.filter(room=room, user__username=user)
+        else:
+            members = self.filter(room=room, user=user)
+        return members.values_list("role", flat=True).first()
+
+    def is_admin(self, room, user):
+        return self.role_of(room, user) == RoomMembership.ADMIN
+
+    def players_of(self, room):
+        """[{ "username": "...", "role": "admin|player" }] in join order."""
+        rows = self.filter(room=room).order_by("id").values_list("user__username", "role")
+        return [{"username": username, "role": role} for username, role in rows]
+
+
+class RoomMembership(models.Model):
+    """One row per player of a room; replaces the old Room.players JSON list."""
+    ADMIN = "admin"
+    PLAYER = "player"
+    ROLES = [(ADMIN, "Admin"), (PLAYER, "Player")]
+
+    room = models.ForeignKey(Room, related_name="memberships", on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name="room_memberships", on_delete=models.CASCADE)
+    role = models.CharField(max_length=10, choices=ROLES, default=PLAYER)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MembershipQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "user"], name="unique_room_member"),
+        ]
+
+    def __str__(self):
+        return f"[{self.room.code}] {self.user.username} ({self.role})"
+
+class BacklogQuerySet(models.QuerySet):
+    def at(self, room, index):
+        """The task at `index` (same numbering as Room.current_task_index), or None."""
+        return self.filter(room=room, order=index).first()
+
+    def payloads(self, room):
+        return [item.as_payload() for item in self.filter(room=room).order_by("order")]
+
+
 class BacklogItem(models.Model):
     """
     Normalized backlog items stored one-per-row, linked to a Room.
-    Keeps id/title/description and an optional ordering/index.
+    `order` is the 0-based position of the task, matched against Room.current_task_index.
     """
     room = models.ForeignKey(Room, related_name="items", on_delete=models.CASCADE)
     external_id = models.CharField(max_length=100, blank=True, null=True)  
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     order = models.IntegerField(default=0)  
+    estimate = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = BacklogQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "order"], name="backlog_room_order_idx"),
+        ]
+
     def __str__(self):
         return f"[{self.room.code}] {self.title}"
+
+    def as_payload(self):
+        """Shape used by the API and the WebSocket snapshot (formerly a Room.backlog entry)."""
+        return {
+            "external_id": self.external_id,
+            "title": self.title,
+            "description": self.description,
+            "order": self.order,
+            "estimate": self.estimate,
+        }
     
     
 class Vote(models.Model):
@@ -45,3 +111,82 @@ class Vote(models.Model):
     task_index = models.IntegerField()
     value = models.CharField(max_length=20)  # ex: "5", "8", "coffee"
 
+    class Meta:
+        constraints = [
+            # un seul vote par joueur et par tâche : permet l'upsert (ON CONFLICT)
+            models.UniqueConstraint(fields=["room", "task_index", "username"], name="unique_vote_per_task"),
+        ]
+        indexes = [
+            # couvre les requêtes du round courant (votes, count) en index-only scan
+            models.Index(fields=["room", "task_index"], include=["username", "value"], name="vote_round_idx"),
+        ]
+
+
+
+class RoundArchive(models.Model):
+    """
+    Append-only history: one row per reveal (validated, revote or skipped).
+    Votes are packed one byte per voter (index in VALID_VOTES), `voters` holds
+    the usernames in the same order; see game/archive.py.
+    """
+    VALIDATED = "validated"
+    REVOTE = "revote"
+    SKIPPED = "skipped"
+    STATUSES = [(VALIDATED, "Validated"), (REVOTE, "Revote"), (SKIPPED, "Skipped")]
+
+    room = models.ForeignKey(Room, related_name="rounds", on_delete=models.CASCADE)
+    task_index = models.IntegerField()
+    mode = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUSES)
+    result = models.CharField(max_length=20, null=True, blank=True)
+    voters = models.JSONField(default=list)
+    votes = models.BinaryField()
+    started_at = models.DateTimeField(null=True, blank=True)
+    revealed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "task_index"], name="round_room_task_idx"),
+        ]
+
+    def __str__(self):
+        return f"[{self.room.code}] task {self.task_index}: {self.status} {self.result or ''}"
+
+
+class RoomEstimateStats(models.Model):
+    """Per-room rollup of RoundArchive, incremented at each reveal."""
+    room = models.OneToOneField(Room, related_name="estimate_stats", on_delete=models.CASCADE, primary_key=True)
+    rounds = models.PositiveIntegerField(default=0)
+    validated = models.PositiveIntegerField(default=0)
+    revotes = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    points = models.FloatField(default=0)  # somme des estimations numériques validées
+    voting_seconds = models.FloatField(default=0)  # somme des durées de round connues
+
+
+class PlayerDivergence(models.Model):
+    """Per-player rollup: how far their votes land from the validated estimate, in card steps."""
+    room = models.ForeignKey(Room, related_name="divergences", on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    rounds = models.PositiveIntegerField(default=0)
+    steps = models.PositiveIntegerField(default=0)  # somme des |vote - résultat| en cartes
+    above = models.PositiveIntegerField(default=0)
+    below = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "username"], name="unique_divergence_per_player"),
+        ]
+
+
+class ChatMessage(models.Model):
+    """Room chat, written in batches by game/chat.py (never from the event loop)."""
+    room = models.ForeignKey(Room, related_name="chat_messages", on_delete=models.CASCADE)
+    username = models.CharField(max_length=150)
+    message = models.TextField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "created_at"], name="chat_room_created_idx"),
+        ]
@@ -0,0 +1,252 @@
+"""
+Who is online in each room.
+
+One sorted set per room in Redis (`presence:<code>`, member = username,
+score = last heartbeat). Sockets refresh it when they connect and then at
+most every PRESENCE_TTL / 3 seconds while they talk (the front sends a
+`heartbeat` every 10 s). A member whose last heartbeat is older than
+PRESENCE_TTL (30 s by default) is expired by a sweeper, so a crashed worker
+or a dropped connection without close frame doesn't stay online forever.
+
+The online count is a ZCARD (O(1)); it is carried by every presence frame
+and stored on RoomState.online, which the consumers use as the "everybody
+voted" denominator instead of the number of members.
+
+Join / leave notifications are batched per room for NOTIFY_WINDOW seconds
+and leave as one `presence` frame: {"joined": [...], "left": [...],
+"online": n}.
+
+With several Redis hosts (PRESENCE_REDIS_URLS) a room's set lives on the
+host that also carries its channel group (`room_shard`), so one room's
+traffic stays on one Redis.
+
+PRESENCE_BACKEND = "memory" keeps the same structure in process memory
+(single worker, tests). If Redis cannot be reached the tracker falls back to
+memory as well rather than refusing connections, for PRESENCE_RETRY_AFTER
+seconds (5 by default), then tries Redis again. While it runs on the
+fallback the online counts only cover this worker's sockets:
+`pocker_presence_degraded` is 1 on /metrics and
+`pocker_presence_fallbacks_total` counts the failed Redis calls.
+"""
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import metrics
+from .broadcast import broadcaster_for, room_group, room_shard
+
+logger = logging.getLogger(__name__)
+
+TTL = getattr(settings, "PRESENCE_TTL", 30)
+RETRY_AFTER = getattr(settings, "PRESENCE_RETRY_AFTER", 5)
+NOTIFY_WINDOW = 0.25
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._rooms = {}  # code -> {username: last_seen}
+
+    async def touch(self, code, username, now):
+        """Record a heartbeat; True if `username` was not online."""
+        room = self._rooms.setdefault(code, {})
+        new = username not in room
+        room[username] = now
+        return new
+
+    async def remove(self, code, username):
+        room = self._rooms.get(code, {})
+        removed = room.pop(username, None) is not None
+        if not room:
+            self._rooms.pop(code, None)
+        return removed
+
+    async def count(self, code):
+        return len(self._rooms.get(code, ()))
+
+    async def members(self, code):
+        return sorted(self._rooms.get(code, ()))
+
+    async def expire(self, code, before):
+        room = self._rooms.get(code, {})
+        gone = [u for u, seen in room.items() if seen < before]
+        for username in gone:
+            del room[username]
+        return gone
+
+
+class RedisBackend:
+    def __init__(self, urls):
+        import redis.asyncio as redis
+
+        self.shards = [
+            redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5, decode_responses=True)
+            for url in urls
+        ]
+
+    def redis(self, code):
+        return self.shards[room_shard(code, len(self.shards))]
+
+    @staticmethod
+    def key(code):
+        return f"presence:{code}"
+
+    async def touch(self, code, username, now):
+        key = self.key(code)
+        async with self.redis(code).pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {username: now})
+            pipe.expire(key, int(TTL * 4))  # une room abandonnée disparaît seule
+            added, _ = await pipe.execute()
+        return bool(added)
+
+    async def remove(self, code, username):
+        return bool(await self.redis(code).zrem(self.key(code), username))
+
+    async def count(self, code):
+        return await self.redis(code).zcard(self.key(code))
+
+    async def members(self, code):
+        return await self.redis(code).zrange(self.key(code), 0, -1)
+
+    async def expire(self, code, before):
+        key = self.key(code)
+        async with self.redis(code).pipeline(transaction=True) as pipe:
+            pipe.zrangebyscore(key, "-inf", f"({before}")
+            pipe.zremrangebyscore(key, "-inf", f"({before}")
+            gone, _ = await pipe.execute()
+        return gone
+
+
+def _backend():
+    if getattr(settings, "PRESENCE_BACKEND", "memory") == "redis":
+        return RedisBackend(settings.PRESENCE_REDIS_URLS)
+    return MemoryBackend()
+
+
+class PresenceTracker:
+    def __init__(self, backend=None):
+        self.backend = backend or _backend()
+        self._sockets = {}  # (code, username) -> sockets open in this process
+        self._touched = {}  # (code, username) -> last heartbeat sent to the backend
+        self._pending = {}  # code -> {"joined": set, "left": set}
+        self._notifier = None
+        self._sweeper = None
+        self._fallback = MemoryBackend()
+        self._degraded_until = 0  # monotonic ; non nul tant que Redis n'a pas répondu de nouveau
+
+    @property
+    def degraded(self):
+        return bool(self._degraded_until)
+
+    async def _call(self, method, *args):
+        backend = self.backend
+        if isinstance(backend, MemoryBackend):
+            return await getattr(backend, method)(*args)
+        if time.monotonic() < self._degraded_until:
+            return await getattr(self._fallback, method)(*args)
+        try:
+            result = await getattr(backend, method)(*args)
+        except Exception as exc:
+            metrics.presence_fallbacks.inc()
+            if not self.degraded:  # un appel concurrent a peut-être déjà basculé
+                logger.warning("Presence : Redis injoignable (%r), repli en mémoire pendant %ss", exc, RETRY_AFTER)
+            self._degraded_until = time.monotonic() + RETRY_AFTER
+            return await getattr(self._fallback, method)(*args)
+        if self.degraded:
+            logger.warning("Presence : Redis de nouveau joignable")
+            self._degraded_until = 0
+            self._fallback = MemoryBackend()
+            self._touched.clear()  # le prochain heartbeat de chaque socket le réinscrit dans Redis
+        return result
+
+    async def join(self, code, username):
+        """A socket of `username` opened; returns the room's online count."""
+        key = (code, username)
+        self._sockets[key] = self._sockets.get(key, 0) + 1
+        self._touched[key] = time.time()
+        if await self._call("touch", code, username, self._touched[key]):
+            self._queue(code, "joined", username)
+        self._ensure_sweeper()
+        return await self.count(code)
+
+    async def leave(self, code, username):
+        """A socket closed; the user goes offline once their last socket here is gone."""
+        key = (code, username)
+        left = self._sockets.get(key, 0) - 1
+        if left > 0:
+            self._sockets[key] = left
+        else:
+            self._sockets.pop(key, None)
+            self._touched.pop(key, None)
+            if await self._call("remove", code, username):
+                self._queue(code, "left", username)
+        return await self.count(code)
+
+    async def heartbeat(self, code, username):
+        """Cheap to call on every message: the backend is only hit every TTL / 3."""
+        key = (code, username)
+        now = time.time()
+        if key in self._sockets and now - self._touched.get(key, 0) >= TTL / 3:
+            self._touched[key] = now
+            if await self._call("touch", code, username, now):
+                self._queue(code, "joined", username)
+
+    async def count(self, code):
+        return await self._call("count", code)
+
+    async def members(self, code):
+        return await self._call("members", code)
+
+    # ---------- notifications groupées ----------
+    def _queue(self, code, kind, username):
+        other = "left" if kind == "joined" else "joined"
+        pending = self._pending.setdefault(code, {"joined": set(), "left": set()})
+        if username in pending[other]:
+            pending[other].discard(username)  # arrivé puis reparti dans la fenêtre : rien à dire
+        else:
+            pending[kind].add(username)
+        if self._notifier is None or self._notifier.done():
+            self._notifier = asyncio.ensure_future(self._notify_later())
+
+    async def _notify_later(self):
+        await asyncio.sleep(NOTIFY_WINDOW)
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        layer = get_channel_layer()
+        for code, changes in pending.items():
+            await broadcaster_for(layer, room_group(code)).send_now({
+                "type": "presence_event",
+                "joined": sorted(changes["joined"]),
+                "left": sorted(changes["left"]),
+                "online": await self.count(code),
+            })
+
+    # ---------- expiration ----------
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.ensure_future(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while self._sockets:
+            await asyncio.sleep(TTL / 3)
+            await self.sweep()
+
+    async def sweep(self):
+        """Expire the members of this process's rooms that missed their heartbeats."""
+        before = time.time() - TTL
+        for code in {code for code, _ in self._sockets}:
+            for username in await self._call("expire", code, before):
+                # socket encore ouvert ici mais muet : il revient au prochain heartbeat
+                self._touched.pop((code, username), None)
+                self._queue(code, "left", username)
+
+
+presence = PresenceTracker()
+
+metrics.Gauge("pocker_presence_pending", "Rooms with a presence notification pending", lambda: len(presence._pending))
+metrics.Gauge("pocker_presence_degraded", "1 while presence runs on the in-memory fallback",
+              lambda: int(presence.degraded))
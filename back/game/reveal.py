@@ -0,0 +1,105 @@
+"""
+Round reveal, shared by RoomConsumer (admin reveal), the round timers
+(game/timers.py) and, for the write, the REST `reveal_votes` view.
+
+A round is identified by Room.version. Every transition (next task, revote)
+is a compare-and-swap UPDATE on (current_task_index, version): if another
+worker or a REST call got there first, the UPDATE matches no row, nothing
+else is written and the caller gets None. A reveal is therefore applied at
+most once per (room, version), whoever races for it; the estimate always
+lands on the task of the version that was revealed.
+
+`reveal_round` also runs under the room's lock, so inside one process the
+losers don't even reach the database.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from . import snapshots
+from .archive import archive_round
+from .estimation import estimate
+from .metrics import db_helper
+from .models import BacklogItem, Room, Vote
+
+
+def compute_reveal(state, force=False):
+    votes = state.votes
+
+    # CAS 1 : aucun vote (ou que des cafés) → skip
+    if not any(v != "coffee" for v in votes.values()):
+        return {"status": "skipped"}
+
+    # CAS 2 : votes partiels AUTORISÉS si force
+    if not force:
+        counts = state.counts()
+        if counts["voters"] < counts["total"]:
+            return {"status": "wait"}
+
+    # Calcul selon le mode de la room (voir game/estimation.py)
+    result = estimate(state.mode, votes, state.players)
+    if result is None:
+        # DIVERGENCE → ON REVOTE
+        return {"status": "revote"}
+
+    return {"status": "validated", "result": result}
+
+
+async def reveal_round(state, force=False, version=None):
+    """
+    Compute the round result from the in-memory votes and persist it right away.
+    Returns None when `version` (default: the state's) is no longer the current round.
+    """
+    async with state.lock:
+        if version is not None and version != state.version:
+            return None
+        res = compute_reveal(state, force)
+        idx = state.current_task_index
+        if res["status"] == "wait":
+            return res
+        # le round part dans l'archive avant que les votes soient effacés
+        archive = {
+            "mode": state.mode,
+            "status": res["status"],
+            "votes": dict(state.votes),
+            "result": res.get("result"),
+            "started_at": state.round_started_at,
+        }
+        advance = res["status"] != "revote"
+        applied, nxt = await _apply_reveal(
+            state.room_id, idx, state.version, advance, res.get("result"), archive)
+        if not applied:
+            # un autre worker (ou le REST) a déjà changé de round : on relira la room
+            state.stale = True
+            return None
+        if advance:
+            state.advance(nxt)
+        else:
+            state.clear_votes()
+    snapshots.invalidate(state.code)
+    return res
+
+
+def apply_reveal(room_id, idx, version, advance, result=None, archive=None):
+    """
+    Sync: move the room from round `version` to the next one, in one transaction.
+    `advance` moves to the next task and writes `result` on task `idx`; otherwise
+    the round is replayed on the same task (revote). Returns (applied, next task
+    payload); applied is False, with nothing written, if `version` is not current.
+    """
+    with transaction.atomic():
+        moved = Room.objects.filter(pk=room_id, current_task_index=idx, version=version).update(
+            current_task_index=idx + 1 if advance else idx,
+            version=F("version") + 1,
+        )
+        if not moved:
+            return False, None
+        if archive is not None:
+            archive_round(room_id, idx, **archive)
+        if advance and result is not None:
+            BacklogItem.objects.filter(room_id=room_id, order=idx).update(estimate=result)
+        Vote.objects.filter(room_id=room_id, task_index=idx).delete()
+        nxt = BacklogItem.objects.filter(room_id=room_id, order=idx + 1).first() if advance else None
+    return True, nxt.as_payload() if nxt else None
+
+
+_apply_reveal = db_helper("apply_reveal")(apply_reveal)
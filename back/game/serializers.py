@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import BacklogItem, Room
+from .models import BacklogItem, Room, RoomMembership
 
 class RoomCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,10 +7,20 @@ class RoomCreateSerializer(serializers.ModelSerializer):
         fields = ["code", "mode"]
 
 class RoomDetailSerializer(serializers.ModelSerializer):
+    players = serializers.SerializerMethodField()
+    backlog = serializers.SerializerMethodField()
+
     class Meta:
         model = Room
         fields = ["code", "mode", "players", "backlog", "current_task_index", "created_at","started"]
+
+    def get_players(self, room):
+        return RoomMembership.objects.players_of(room)
+
+    def get_backlog(self, room):
+        return BacklogItem.objects.payloads(room)
+
 class BacklogItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = BacklogItem
-        fields = ["id", "external_id", "title", "description", "order", "created_at"]
+        fields = ["id", "external_id", "title", "description", "order", "estimate", "created_at"]
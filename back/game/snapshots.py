@@ -0,0 +1,100 @@
+"""
+Serialized room snapshots for the REST pollers.
+
+`get_room`, `get_current_task` and `get_votes` used to rebuild their answer
+from the database for every polling client. Each answer is now built once,
+serialized once and kept here as bytes with a content ETag; the next
+pollers get the bytes (or a 304 when they send the ETag back) until the
+room changes.
+
+A room's entries are dropped by `invalidate(code)`, which is called:
+
+- by `invalidate_room` after every REST write (vote, reveal, join, kick,
+  promote, backlog import);
+- by the room state registry after the flusher has written votes or a pause
+  (game/state.py) and after a WebSocket reveal (game/reveal.py) — REST reads
+  the database, so the cache is dropped once the change is visible there;
+- on `room_invalidate`, when another worker wrote to the room.
+
+Entries are kept per room, so an invalidation is a single dict pop. Every
+build holds on to its room's bucket from before reading and is only stored
+if that bucket is still the current one, i.e. no invalidation happened
+meanwhile. At most CACHE_SIZE rooms are kept (least recently read first
+out). Entries also expire after
+SNAPSHOT_CACHE_TTL seconds (5 by default): the bound on staleness for a
+write made by a worker that holds none of the room's sockets.
+
+WebSocket connects don't come here: they are served from the in-memory
+RoomState, whose serialized snapshot is cached on the state itself.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .encoding import JSONRenderer
+
+TTL = getattr(settings, "SNAPSHOT_CACHE_TTL", 5)
+CACHE_SIZE = 512  # rooms
+
+_lock = threading.Lock()
+_rooms = OrderedDict()  # code -> {kind: Snapshot}, remplacé à chaque invalidation
+
+
+class Snapshot:
+    __slots__ = ("body", "etag", "players", "expires")
+
+    def __init__(self, body, players):
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+        self.players = players  # {username: role}, for the membership checks
+        self.expires = time.monotonic() + TTL
+
+
+def invalidate(code):
+    with _lock:
+        _rooms.pop(code, None)
+
+
+def get(code, kind, build):
+    """The room's `kind` snapshot; `build()` -> (data, players) runs on a miss."""
+    with _lock:
+        bucket = _rooms.get(code)
+        if bucket is None:
+            bucket = _rooms[code] = {}
+        else:
+            _rooms.move_to_end(code)
+            entry = bucket.get(kind)
+            if entry is not None and entry.expires > time.monotonic():
+                return entry
+        while len(_rooms) > CACHE_SIZE:
+            _rooms.popitem(last=False)
+
+    try:
+        data, players = build()
+    except Exception:
+        with _lock:
+            # room inconnue (404...) : ne pas garder de seau vide pour elle
+            if not bucket and _rooms.get(code) is bucket:
+                del _rooms[code]
+        raise
+    entry = Snapshot(JSONRenderer().render(data), players)
+    with _lock:
+        if _rooms.get(code) is bucket:  # sinon invalidée pendant la construction
+            bucket[kind] = entry
+    return entry
+
+
+def respond(request, entry):
+    """200 with the cached bytes, or 304 if the client already has them."""
+    if entry.etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry.body, content_type="application/json")
+    response["ETag"] = entry.etag
+    response["Cache-Control"] = "no-cache"  # toujours revalider, le 304 ne coûte rien
+    return response
@@ -0,0 +1,340 @@
+"""
+In-process room state for the WebSocket consumers.
+
+RoomConsumer used to re-read the Room row several times per message. The
+registry below keeps one RoomState per active room and serves every consumer
+read from memory. Votes and pause flags are written back to Room/Vote by a
+background flusher, in batches.
+
+Durability window: a change is persisted at most ROOM_STATE_FLUSH_INTERVAL
+seconds (0.25s by default) after it was applied in memory. If the process
+dies inside that window the pending changes are lost. A failed write is
+logged and retried every interval until it goes through. Reveals are
+persisted synchronously, never through the flusher.
+
+The registry lives in one process: every socket of a room must be served by
+the same worker (with several workers the load balancer routes by room code,
+see deploy/nginx.conf), and REST views must call `invalidate_room(code)`
+after writing to a room so the next read reloads it, on whichever worker
+holds it.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import encoding, metrics, snapshots
+from .broadcast import room_group
+from .metrics import db_helper
+from .models import BacklogItem, Room, Vote
+from .votes import record_votes
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, "ROOM_STATE_FLUSH_INTERVAL", 0.25)
+
+# Version of the WebSocket protocol. v2: votes travel as deltas (vote_cast /
+# vote_changed) numbered by `seq`; a client that sees a gap sends "resync"
+# and gets a fresh snapshot.
+PROTOCOL_VERSION = 2
+
+
+def task_snapshot(current, idx, total):
+    """{done, current, total, index} as sent to clients; `current` is a BacklogItem payload."""
+    if current is None or idx >= total:
+        return {"done": True, "current": None, "total": total, "index": idx}
+    return {
+        "done": False,
+        "current": current,
+        "total": total,
+        "index": idx + 1
+    }
+
+
+class RoomState:
+    """Authoritative copy of a room while at least one socket is connected."""
+
+    def __init__(self, room, players, task, votes):
+        self.code = room.code
+        self.room_id = room.id
+        self.connections = 0
+        self.seq = 0  # bumped on every change of the vote map
+        self.stale = False
+        self.lock = asyncio.Lock()
+        self._dirty_votes = {}  # (task_index, username) -> value
+        self._dirty_room = False
+        self.version = None  # Room.version of the current round
+        self.online = None  # live online count (game/presence.py); None until the first socket joins
+        self._snapshot = (None, None)  # (key, serialized snapshot) shared by connecting sockets
+        self.load(room, players, task, votes)
+
+    def load(self, room, players, task, votes):
+        if room.version != self.version:
+            self.version = room.version
+            self.round_started_at = timezone.now()
+        if room.started and not getattr(self, "started", False):
+            # partie lancée : le premier round commence maintenant, pas à l'ouverture du lobby
+            self.round_started_at = timezone.now()
+        self.started = room.started
+        self.mode = room.mode
+        self.players = players  # {username: role}
+        self.task_count, self.current = task  # only the current BacklogItem is kept
+        self.current_task_index = room.current_task_index
+        self.is_paused = room.is_paused
+        self.paused_by = room.paused_by
+        self.votes = votes  # {username: value} for the current task
+        self.seq = getattr(self, "seq", 0) + 1
+
+    @property
+    def dirty(self):
+        return bool(self._dirty_votes) or self._dirty_room
+
+    def is_admin(self, username):
+        return self.players.get(username) == "admin"
+
+    def counts(self):
+        """`total` is who is online right now, not every member who ever joined."""
+        total = self.online if self.online is not None else len(self.players)
+        return {"voters": len(self.votes), "total": total}
+
+    def payload(self):
+        return task_snapshot(self.current, self.current_task_index, self.task_count)
+
+    def snapshot(self):
+        """Full state for a (re)connecting client; deltas numbered after `seq` follow it."""
+        return {
+            "type": "snapshot",
+            "v": PROTOCOL_VERSION,
+            "seq": self.seq,
+            "version": self.version,
+            **self.payload(),
+            "votes": dict(self.votes),
+            "counts": self.counts(),
+            "is_paused": self.is_paused,
+            "paused_by": self.paused_by
+        }
+
+    def snapshot_json(self):
+        """`snapshot()` as JSON text, serialized once per state change for all the sockets."""
+        key = (self.seq, self.version, self.counts()["total"], self.is_paused, self.paused_by,
+               self.current_task_index, self.task_count)
+        if self._snapshot[0] != key:
+            self._snapshot = (key, encoding.dumps(self.snapshot()))
+        return self._snapshot[1]
+
+    def cast_vote(self, username, value):
+        """Returns the delta kind ("vote_cast" / "vote_changed"), or None if nothing changed."""
+        previous = self.votes.get(username)
+        if previous == value:
+            return None
+        self.votes[username] = value
+        self._dirty_votes[(self.current_task_index, username)] = value
+        self.seq += 1
+        return "vote_changed" if previous is not None else "vote_cast"
+
+    def set_paused(self, paused_by):
+        self.is_paused = paused_by is not None
+        self.paused_by = paused_by
+        self._dirty_room = True
+
+    def clear_votes(self):
+        """Drop the current round's votes (revote / reveal); the caller deletes the rows."""
+        idx = self.current_task_index
+        self.votes = {}
+        self.seq += 1
+        self._new_round()
+        self._dirty_votes = {k: v for k, v in self._dirty_votes.items() if k[0] != idx}
+
+    def _new_round(self):
+        # suit le compare-and-swap de Room.version fait par game/reveal.py
+        self.version += 1
+        self.round_started_at = timezone.now()
+
+    def advance(self, next_task):
+        """Move to the next task; `next_task` is its payload, or None past the end."""
+        self.clear_votes()
+        self.current_task_index += 1
+        self.current = next_task
+
+    def take_changes(self):
+        """Hand the pending changes to the flusher and reset them."""
+        votes, self._dirty_votes = self._dirty_votes, {}
+        room = None
+        if self._dirty_room:
+            room = {"is_paused": self.is_paused, "paused_by": self.paused_by}
+            self._dirty_room = False
+        return votes, room
+
+    def restore(self, votes, room):
+        """Put back changes whose write failed; newer in-memory values win."""
+        self._dirty_votes = {**votes, **self._dirty_votes}
+        if room:
+            self._dirty_room = True
+
+
+@db_helper("load_room")
+def _load_room(code):
+    room = Room.objects.get(code=code)
+    players = dict(room.memberships.values_list("user__username", "role"))
+    item = BacklogItem.objects.at(room, room.current_task_index)
+    task = (room.items.count(), item.as_payload() if item else None)
+    votes = Vote.objects.filter(room=room, task_index=room.current_task_index)
+    return room, players, task, {v.username: v.value for v in votes}
+
+
+@db_helper("write_changes")
+def _write_changes(batch):
+    """batch: [(room_id, {(task_index, username): value}, room_fields | None)]"""
+    with transaction.atomic():
+        rows = []
+        for room_id, votes, room_fields in batch:
+            if room_fields:
+                Room.objects.filter(pk=room_id).update(**room_fields)
+            rows.extend((room_id, idx, username, value) for (idx, username), value in votes.items())
+        record_votes(rows)
+
+
+class RoomStateRegistry:
+    """One RoomState per room code, shared by all consumers of this process."""
+
+    def __init__(self):
+        self._states = {}
+        self._loading = {}
+        self._flusher = None
+
+    def __contains__(self, code):
+        return code in self._states
+
+    async def acquire(self, code):
+        """Called on connect: loads the room if needed and pins it in memory."""
+        state = await self.get(code)
+        state.connections += 1
+        return state
+
+    async def release(self, code):
+        """Called on disconnect: flushes and evicts the room once its last socket leaves."""
+        state = self._states.get(code)
+        if state is None:
+            return
+        state.connections -= 1
+        if state.connections <= 0:
+            try:
+                await self.flush(state)
+            except Exception:
+                # gardée en mémoire : le flusher réessaie et l'évince une fois écrite
+                logger.exception("Échec de l'écriture de la room %s, nouvel essai", code)
+                self._ensure_flusher()
+                return
+            if state.connections <= 0:
+                self._states.pop(code, None)
+
+    async def get(self, code):
+        state = self._states.get(code)
+        if state is not None and not state.stale:
+            return state
+
+        lock = self._loading.setdefault(code, asyncio.Lock())
+        async with lock:
+            state = self._states.get(code)
+            if state is None:
+                state = RoomState(*await _load_room(code))
+                self._states[code] = state
+            elif state.stale:
+                # Persist what we have before re-reading what REST wrote.
+                await self.flush(state)
+                state.stale = False
+                state.load(*await _load_room(code))
+        self._loading.pop(code, None)
+        return state
+
+    def invalidate(self, code):
+        """Sync-safe: the next `get` reloads the room from the database."""
+        snapshots.invalidate(code)
+        state = self._states.get(code)
+        if state is not None:
+            state.stale = True
+
+    def mark_dirty(self, state):
+        self._ensure_flusher()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        # tant qu'il reste des changements, y compris ceux remis en place après un échec
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.flush_all()
+            except Exception:
+                logger.exception("Échec de l'écriture des votes, nouvel essai")
+                continue
+            for code, state in list(self._states.items()):
+                # rooms dont le dernier socket est parti pendant un échec d'écriture
+                if state.connections <= 0 and not state.dirty:
+                    self._states.pop(code, None)
+            if not any(s.dirty for s in self._states.values()):
+                return
+
+    async def flush(self, state):
+        async with state.lock:
+            if not state.dirty:
+                return
+            votes, room_fields = state.take_changes()
+            try:
+                await _write_changes([(state.room_id, votes, room_fields)])
+            except Exception:
+                state.restore(votes, room_fields)
+                raise
+            snapshots.invalidate(state.code)  # les GET REST voient maintenant ces votes
+
+    async def flush_all(self):
+        """Write every pending change in a single transaction."""
+        states = [s for s in list(self._states.values()) if s.dirty]
+        if not states:
+            return
+        for state in states:
+            await state.lock.acquire()
+        try:
+            batch = []
+            for state in states:
+                votes, room_fields = state.take_changes()
+                batch.append((state.room_id, votes, room_fields))
+            try:
+                await _write_changes(batch)
+            except Exception:
+                for state, (_, votes, room_fields) in zip(states, batch):
+                    state.restore(votes, room_fields)
+                raise
+            for state in states:
+                snapshots.invalidate(state.code)
+        finally:
+            for state in states:
+                state.lock.release()
+
+
+room_states = RoomStateRegistry()
+
+metrics.Gauge("pocker_active_rooms", "Rooms held in memory by this worker", lambda: len(room_states._states))
+metrics.Gauge("pocker_sockets", "Room sockets open on this worker",
+              lambda: sum(s.connections for s in room_states._states.values()))
+metrics.Gauge("pocker_rooms_pending_flush", "Rooms with changes not yet written",
+              lambda: sum(1 for s in room_states._states.values() if s.dirty))
+
+
+def invalidate_room(code):
+    """
+    Sync, for REST views: mark the room stale here, and through the room's
+    group on the worker that serves its sockets if that is another process.
+    """
+    room_states.invalidate(code)
+    try:
+        async_to_sync(get_channel_layer().group_send)(room_group(code), {"type": "room_invalidate"})
+    except Exception as exc:
+        # l'écriture est faite ; seule la copie en mémoire d'un autre worker reste en retard
+        logger.warning("Room %s : invalidation non diffusée (%r)", code, exc)
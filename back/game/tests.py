@@ -1,14 +1,42 @@
 from email.mime import application
-import os
+import asyncio
+import gzip
+import importlib.util
+import json
+import random
 from unittest import skipIf
+from unittest.mock import AsyncMock, patch
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
 from django.test import TestCase
 from django.contrib.auth.models import User
 from rest_framework.test import APIClient
-from .models import Room, Vote
+from .backlog_io import BacklogImportError, iter_json_array
+from .analysis import analysis_for, analyze, cached
+from .archive import unpack
+from .models import BacklogItem, ChatMessage, Room, RoomMembership, RoundArchive, Vote
+from .estimation import MODES, NO_VOTE, estimate, estimate_batch, pack_rounds
+from .broadcast import RoomBroadcaster, stats as broadcast_stats
+from . import backpressure, bench, chat as chat_module, db, encoding, metrics, snapshots, timers, wire
+from .reveal import reveal_round
+from . import presence as presence_module
+from . import state as state_module
+from .broadcast import room_group, room_shard
+from .presence import MemoryBackend, PresenceTracker
+from .state import RoomState, _load_room, invalidate_room, room_states
+from .throttle import Throttle
+from .timers import round_timers
+from .votes import VALID_VOTES
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.db import database_sync_to_async
 from channels.testing import WebsocketCommunicator
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
 from asgiref.sync import async_to_sync
 
+from accounts.tokens import access_token_for
 from agilecards.asgi import application
 
 class PokerGameTests(TestCase):
@@ -17,19 +45,23 @@ class PokerGameTests(TestCase):
         self.user = User.objects.create_user(username="admin", password="1234")
         self.client.force_authenticate(user=self.user)
 
+    def _room(self, mode):
+        room = Room.objects.create(mode=mode, creator=self.user)
+        RoomMembership.objects.create(room=room, user=self.user, role="admin")
+        return room
+
     def test_create_room(self):
         """Créer une room en mode strict"""
         response = self.client.post("/api/rooms/create/", {"mode": "strict"}, format="json")
         self.assertEqual(response.status_code, 201)
         self.assertIn("code", response.data)
         self.assertEqual(Room.objects.count(), 1)
+        room = Room.objects.get()
+        self.assertTrue(RoomMembership.objects.is_admin(room, self.user))
 
     def test_join_room(self):
-        room = Room.objects.create(
-            mode="strict",
-            creator=self.user,
-            players=[{"username": "admin", "role": "admin"}]
-        )
+        room = Room.objects.create(mode="strict", creator=self.user)
+        RoomMembership.objects.create(room=room, user=self.user, role="admin")
 
         user2 = User.objects.create_user(username="player1", password="test")
         self.client.force_authenticate(user=user2)
@@ -37,12 +69,15 @@ class PokerGameTests(TestCase):
         response = self.client.post("/api/rooms/join/", {"code": room.code}, format="json")
         self.assertEqual(response.status_code, 200)
 
-        room.refresh_from_db()
-        self.assertEqual(len(room.players), 2)
+        self.assertEqual(room.memberships.count(), 2)
+        self.assertEqual(RoomMembership.objects.role_of(room, user2), "player")
+
+        response = self.client.post("/api/rooms/join/", {"code": room.code}, format="json")
+        self.assertEqual(response.data["status"], "already_joined")
 
     def test_set_backlog(self):
         """Upload d’un backlog JSON"""
-        room = Room.objects.create(mode="strict", creator=self.user, players=[{"username": "admin", "role": "admin"}])
+        room = self._room("strict")
         backlog = [
             {"title": "User Login", "description": "Implement login feature"},
             {"title": "Vote System", "description": "Add poker voting logic"},
@@ -50,13 +85,94 @@ class PokerGameTests(TestCase):
 
         response = self.client.post(f"/api/rooms/{room.code}/backlog/", backlog, format="json")
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(Room.objects.get(code=room.code).backlog), 2)
+        self.assertEqual(list(room.items.order_by("order").values_list("order", "title")), [
+            (0, "User Login"), (1, "Vote System"),
+        ])
+
+    def test_set_backlog_ndjson_and_csv(self):
+        room = self._room("strict")
+        ndjson = '{"id": "J-1", "title": "Login"}\n\n{"title": "Logout"}\n'
+        response = self.client.generic("POST", f"/api/rooms/{room.code}/backlog/", ndjson,
+                                       content_type="application/x-ndjson")
+        self.assertEqual(response.data, {"status": "backlog_set", "count": 2})
+        self.assertEqual(BacklogItem.objects.at(room, 0).external_id, "J-1")
+
+        csv_body = 'Issue key,Summary,Description\nJ-7,"Export, CSV","multi\nline"\n'
+        response = self.client.generic("POST", f"/api/rooms/{room.code}/backlog/", csv_body,
+                                       content_type="text/csv")
+        self.assertEqual(response.data["count"], 1)
+        item = BacklogItem.objects.at(room, 0)
+        self.assertEqual((item.external_id, item.title, item.description), ("J-7", "Export, CSV", "multi\nline"))
+
+    def test_set_backlog_invalid_item_keeps_previous_backlog(self):
+        room = self._room("strict")
+        BacklogItem.objects.create(room=room, title="Existing", order=0)
+        response = self.client.post(f"/api/rooms/{room.code}/backlog/", [{"title": "ok"}, {"description": "no title"}], format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["error"], "Item #2 is missing a valid 'title'")
+        self.assertEqual(list(room.items.values_list("title", flat=True)), ["Existing"])
+
+    def test_json_array_is_parsed_across_chunks(self):
+        class Trickle:
+            def __init__(self, data):
+                self.data = data.encode()
+
+            def read(self, n):
+                chunk, self.data = self.data[:7], self.data[7:]
+                return chunk
+
+        items = [{"title": f"Tâche {i}", "description": "x" * i} for i in range(20)]
+        self.assertEqual(list(iter_json_array(Trickle(json.dumps(items, indent=1)))), items)
+        with self.assertRaises(BacklogImportError):
+            list(iter_json_array(Trickle('[{"title": "a"}, {"title": ')))
+
+    def test_export_streams_results_with_etag(self):
+        room = self._room("strict")
+        BacklogItem.objects.create(room=room, title="Login", order=0, estimate="5")
+        BacklogItem.objects.create(room=room, title="Logout", order=1)
+
+        response = self.client.get(f"/api/rooms/{room.code}/export/")
+        self.assertTrue(response.streaming)
+        body = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(body["room"], room.code)
+        self.assertEqual([(r["title"], r["estimate"]) for r in body["results"]], [("Login", "5"), ("Logout", None)])
+
+        etag = response["ETag"]
+        response = self.client.get(f"/api/rooms/{room.code}/export/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # autre format, autre enveloppe ou corps gzip : autre représentation, pas de 304
+        for url, headers in ((f"/api/rooms/{room.code}/export/?export=csv", {}),
+                             (f"/api/rooms/{room.code}/backlog/export/", {}),
+                             (f"/api/rooms/{room.code}/export/", {"HTTP_ACCEPT_ENCODING": "gzip"})):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **headers)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response["ETag"], etag)
+
+        BacklogItem.objects.filter(room=room, order=1).update(estimate="8")
+        room.current_task_index = 2
+        room.save()
+        response = self.client.get(f"/api/rooms/{room.code}/export/?export=ndjson", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[1])["estimate"], "8")
+
+    def test_backlog_export_csv_gzip(self):
+        room = self._room("strict")
+        BacklogItem.objects.create(room=room, external_id="J-1", title="Login, SSO", order=0)
+
+        response = self.client.get(f"/api/rooms/{room.code}/backlog/export/?export=csv", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        csv_text = gzip.decompress(b"".join(response.streaming_content)).decode()
+        self.assertEqual(csv_text.splitlines(), [
+            "external_id,title,description,order,estimate",
+            'J-1,"Login, SSO",,0,',
+        ])
 
     def test_vote_and_reveal(self):
         """Un joueur vote et l’admin révèle"""
-        room = Room.objects.create(mode="strict", creator=self.user, players=[{"username": "admin", "role": "admin"}])
-        room.backlog = [{"title": "Task A"}]
-        room.save()
+        room = self._room("strict")
+        BacklogItem.objects.create(room=room, title="Task A", order=0)
 
         # Vote de l'admin
         response = self.client.post(f"/api/rooms/{room.code}/vote/", {"value": "5"}, format="json")
@@ -65,23 +181,777 @@ class PokerGameTests(TestCase):
 
         # Reveal
         response = self.client.post(f"/api/rooms/{room.code}/reveal/", {}, format="json")
-        self.assertIn(response.status_code, [200, 400])  # selon si plusieurs joueurs requis
+        self.assertEqual(response.data, {"status": "validated", "result": "5"})
+        self.assertEqual(BacklogItem.objects.at(room, 0).estimate, "5")
+
+        response = self.client.get(f"/api/rooms/{room.code}/current/")
+        self.assertEqual(response.json(), {"done": True, "current": None, "total": 1, "index": 1})
+
+    def test_snapshot_cache_is_dropped_per_room(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            if len(builds) == 1:
+                snapshots.invalidate("ROOM")  # une écriture pendant la construction
+            return {"n": len(builds)}, {}
+
+        self.assertEqual(snapshots.get("ROOM", "votes", build).body, b'{"n":1}')
+        self.assertEqual(snapshots.get("ROOM", "votes", build).body, b'{"n":2}')  # pas gardée
+        self.assertEqual(snapshots.get("ROOM", "votes", build).body, b'{"n":2}')
+        snapshots.invalidate("ROOM")
+        self.assertNotIn("ROOM", snapshots._rooms)  # plus rien pour cette room
+
+    def test_rest_reveal_waits_for_online_players_only(self):
+        room = self._room("strict")
+        bob = User.objects.create_user(username="bob", password="x")
+        RoomMembership.objects.create(room=room, user=bob)
+        BacklogItem.objects.create(room=room, title="Task A", order=0)
+        Vote.objects.create(room=room, username="admin", task_index=0, value="5")
+
+        tracker = PresenceTracker(MemoryBackend())
+        with patch("game.views.presence", tracker):
+            # personne de connecté : tous les membres comptent
+            response = self.client.post(f"/api/rooms/{room.code}/reveal/")
+            self.assertEqual(response.status_code, 400)
+            async_to_sync(tracker.join)(room.code, "admin")  # bob est absent
+            response = self.client.post(f"/api/rooms/{room.code}/reveal/")
+        self.assertEqual(response.data, {"status": "validated", "result": "5"})
+
+    def test_polling_is_served_from_snapshot_cache(self):
+        room = self._room("strict")
+        BacklogItem.objects.create(room=room, title="Task A", order=0)
+        url = f"/api/rooms/{room.code}/votes/"
+
+        first = self.client.get(url)
+        self.assertEqual(first.json(), {})
+        with self.assertNumQueries(0):  # ni relecture de la room ni des votes
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        self.client.post(f"/api/rooms/{room.code}/vote/", {"value": "5"}, format="json")
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json(), {"admin": "5"})
+
+        outsider = APIClient()
+        outsider.force_authenticate(User.objects.create_user(username="eve", password="x"))
+        self.assertEqual(outsider.get(url).status_code, 403)
+
+    def test_reveals_are_archived_with_rollups(self):
+        room = self._room("strict")
+        bob = User.objects.create_user(username="bob", password="x")
+        RoomMembership.objects.create(room=room, user=bob)
+        BacklogItem.objects.create(room=room, title="Task A", order=0)
+
+        Vote.objects.create(room=room, username="admin", task_index=0, value="3")
+        Vote.objects.create(room=room, username="bob", task_index=0, value="8")
+        self.assertEqual(self.client.post(f"/api/rooms/{room.code}/reveal/").data, {"status": "revote"})
+        # le revote efface les votes du round
+        self.assertFalse(Vote.objects.filter(room=room).exists())
+        Vote.objects.create(room=room, username="admin", task_index=0, value="8")
+        Vote.objects.create(room=room, username="bob", task_index=0, value="8")
+        self.client.post(f"/api/rooms/{room.code}/reveal/")
+
+        rounds = list(RoundArchive.objects.filter(room=room).order_by("id"))
+        self.assertEqual([r.status for r in rounds], ["revote", "validated"])
+        self.assertEqual(unpack(rounds[0]), {"admin": "3", "bob": "8"})
+        self.assertEqual(len(bytes(rounds[0].votes)), 2)
+
+        response = self.client.get(f"/api/rooms/{room.code}/stats/revotes/")
+        self.assertEqual(response.data["revote_rate"], 0.5)
+        response = self.client.get(f"/api/rooms/{room.code}/stats/velocity/")
+        self.assertEqual((response.data["estimated_tasks"], response.data["points"]), (1, 8.0))
+        response = self.client.get(f"/api/rooms/{room.code}/stats/divergence/")
+        self.assertEqual([p["mean_steps"] for p in response.data["players"]], [0, 0])
+
+        # les stats par joueur ne sont visibles que des membres de la room
+        outsider = APIClient()
+        outsider.force_authenticate(user=User.objects.create_user(username="outsider", password="1234"))
+        for stat in ("divergence", "velocity", "revotes"):
+            self.assertEqual(outsider.get(f"/api/rooms/{room.code}/stats/{stat}/").status_code, 403)
+
+    def test_vote_is_upserted_and_tallied(self):
+        room = self._room("average")
+        Vote.objects.create(room=room, username="bob", task_index=0, value="8")
+
+        self.client.post(f"/api/rooms/{room.code}/vote/", {"value": "5"}, format="json")
+        response = self.client.post(f"/api/rooms/{room.code}/vote/", {"value": "8"}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["voters"], 2)
+        self.assertEqual(response.data["tally"], {"8": 2})
+        self.assertEqual(Vote.objects.filter(room=room).count(), 2)
+
+    def test_kick_and_promote_update_single_membership(self):
+        room = self._room("strict")
+        bob = User.objects.create_user(username="bob", password="test")
+        carl = User.objects.create_user(username="carl", password="test")
+        RoomMembership.objects.create(room=room, user=bob)
+        RoomMembership.objects.create(room=room, user=carl)
+
+        response = self.client.post(f"/api/rooms/{room.code}/promote/", {"username": "bob"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(RoomMembership.objects.is_admin(room, "bob"))
+
+        response = self.client.post(f"/api/rooms/{room.code}/kick/", {"username": "bob"}, format="json")
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(f"/api/rooms/{room.code}/kick/", {"username": "carl"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RoomMembership.objects.players_of(room), [
+            {"username": "admin", "role": "admin"},
+            {"username": "bob", "role": "admin"},
+        ])
+
     def test_unauthorized_access(self):
         self.client.logout()
         response = self.client.post("/api/rooms/create/", {"mode": "strict"})
         self.assertEqual(response.status_code, 401)
 
 
+class MaintenanceCommandTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="1234")
+
+    def _room(self, days_ago, task_index=1):
+        room = Room.objects.create(mode="strict", creator=self.user, current_task_index=task_index)
+        Room.objects.filter(pk=room.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        for idx in (0, task_index):
+            Vote.objects.create(room=room, username="admin", task_index=idx, value="5")
+        return room
+
+    def test_prune_votes_keeps_rooms_with_recent_activity(self):
+        abandoned = self._room(days_ago=100)
+        revealed = self._room(days_ago=100)
+        RoundArchive.objects.create(room=revealed, task_index=0, mode="strict", status="validated", votes=b"")
+        chatting = self._room(days_ago=100)
+        ChatMessage.objects.create(room=chatting, username="admin", message="hop", created_at=timezone.now())
+        recent = self._room(days_ago=1)
+
+        out = StringIO()
+        call_command("prune_votes", "--older-than-days", "30", stdout=out)
+        # tâches passées supprimées partout, room abandonnée vidée, rooms actives intactes
+        remaining = {room: Vote.objects.filter(room=room).count() for room in (abandoned, revealed, chatting, recent)}
+        self.assertEqual(remaining, {abandoned: 0, revealed: 1, chatting: 1, recent: 1})
+        self.assertIn("4 votes de tâches terminées", out.getvalue())
+
+    def test_explain_vote_queries_prints_plans(self):
+        room = self._room(days_ago=0)
+        out = StringIO()
+        call_command("explain_vote_queries", room.code, stdout=out)
+        self.assertIn(f"Room {room.code}", out.getvalue())
+        self.assertIn("round votes (load state)", out.getvalue())
+
+
+class EstimationTests(TestCase):
+    def test_modes(self):
+        votes = {"a": "3", "b": "5", "c": "5", "d": "13", "e": "coffee"}
+        self.assertIsNone(estimate("strict", votes))
+        self.assertEqual(estimate("strict", {"a": "8", "b": "8", "c": "coffee"}), "8")
+        self.assertEqual(estimate("average", votes), "6")
+        self.assertEqual(estimate("median", votes), "5")
+        self.assertEqual(estimate("majority", votes), "5")
+        self.assertEqual(estimate("majority", {"a": "8", "b": "3"}), "3")  # égalité -> plus petite carte
+        self.assertEqual(estimate("trimmed_mean", votes), "5")
+        self.assertEqual(estimate("weighted_by_role", {"a": "2", "b": "8"}, {"a": "admin"}), "4")
+        self.assertEqual(estimate("fibonacci_snap", votes), "5")
+        self.assertEqual(estimate("average", {"a": "coffee"}), "coffee")
+
+    @skipIf(importlib.util.find_spec("numpy") is None, "numpy not installed")
+    def test_batch_matches_single_round(self):
+        rng = random.Random(7)
+        roles = {"p0": "admin"}
+        rounds = [
+            {f"p{j}": rng.choice(VALID_VOTES) for j in range(rng.randint(1, 9))}
+            for _ in range(500)
+        ]
+        codes, weights = pack_rounds(rounds, roles)
+        for mode in MODES:
+            batch = estimate_batch(mode, codes, weights)
+            for votes, got in zip(rounds, batch):
+                expected = estimate(mode, votes, roles)
+                expected = NO_VOTE if expected in (None, "coffee") else int(expected)
+                self.assertEqual(got, expected, (mode, votes))
+
+
+class AnalysisTests(TestCase):
+    def test_analyze_reports_spread_outliers_and_suggestion(self):
+        votes = {"a": "5", "b": "5", "c": "8", "d": "40", "e": "coffee"}
+        result = analyze(votes, divergence={"d": 3.0}, recent=[5, 8, 5])
+        self.assertEqual(result["vote_summary"], {"5": 2, "8": 1, "40": 1, "coffee": 1})
+        self.assertEqual(result["spread"], 4)
+        self.assertEqual(result["outliers"], ["d"])
+        self.assertEqual(result["suggested"], "5")
+        self.assertEqual(result["consensus"], "divergent")
+
+    def test_analysis_is_cached_per_vote_set(self):
+        room = Room.objects.create(mode="strict", creator=User.objects.create_user(username="u"))
+        votes = {"a": "3", "b": "5"}
+        first = async_to_sync(analysis_for)(room.id, 0, votes)
+        self.assertIs(cached(room.id, 0, dict(reversed(votes.items()))), first)
+        self.assertIsNone(cached(room.id, 0, {"a": "3", "b": "8"}))
+        self.assertIs(async_to_sync(analysis_for)(room.id, 0, votes), first)
+
+
+class RoomStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="1234")
+        bob = User.objects.create_user(username="bob", password="1234")
+        self.room = Room.objects.create(mode="average", creator=self.user)
+        BacklogItem.objects.create(room=self.room, title="Task A", order=0)
+        BacklogItem.objects.create(room=self.room, title="Task B", order=1)
+        RoomMembership.objects.create(room=self.room, user=self.user, role="admin")
+        RoomMembership.objects.create(room=self.room, user=bob)
+
+    def test_votes_are_kept_in_memory_then_flushed(self):
+        async def scenario():
+            state = await room_states.acquire(self.room.code)
+            state.cast_vote("admin", "5")
+            state.cast_vote("admin", "8")
+            self.assertEqual(state.counts(), {"voters": 1, "total": 2})
+            await room_states.release(self.room.code)
+
+        async_to_sync(scenario)()
+        vote = Vote.objects.get(room=self.room)
+        self.assertEqual((vote.username, vote.value), ("admin", "8"))
+
+    def test_votes_are_numbered_deltas(self):
+        async def scenario():
+            state = await room_states.acquire(self.room.code)
+            seq = state.seq
+            kinds = [state.cast_vote("admin", "5"), state.cast_vote("admin", "5"), state.cast_vote("admin", "8")]
+            snapshot = state.snapshot()
+            await room_states.release(self.room.code)
+            return seq, kinds, snapshot
+
+        seq, kinds, snapshot = async_to_sync(scenario)()
+        self.assertEqual(kinds, ["vote_cast", None, "vote_changed"])
+        self.assertEqual(snapshot["seq"], seq + 2)
+        self.assertEqual(snapshot["votes"], {"admin": "8"})
+        self.assertEqual(snapshot["counts"], {"voters": 1, "total": 2})
+
+    def test_invalidate_reloads_rest_writes(self):
+        async def scenario():
+            state = await room_states.acquire(self.room.code)
+            state.set_paused("admin")
+            room_states.invalidate(self.room.code)
+            state = await room_states.get(self.room.code)
+            await room_states.release(self.room.code)
+            return state
+
+        Vote.objects.create(room=self.room, username="bob", task_index=0, value="3")
+        state = async_to_sync(scenario)()
+        self.assertEqual(state.votes, {"bob": "3"})
+        self.room.refresh_from_db()
+        self.assertTrue(self.room.is_paused)
+
+    def test_flusher_retries_after_a_failed_write(self):
+        write = state_module._write_changes
+        calls = []
+
+        async def flaky(batch):
+            calls.append(batch)
+            if len(calls) == 1:
+                raise RuntimeError("pool timeout")
+            return await write(batch)
+
+        async def scenario():
+            state = await room_states.acquire(self.room.code)
+            state.cast_vote("admin", "5")
+            room_states.mark_dirty(state)
+            await room_states._flusher
+            dirty = state.dirty
+            await room_states.release(self.room.code)
+            return dirty
+
+        with patch.object(state_module, "_write_changes", flaky), \
+                patch.object(state_module, "FLUSH_INTERVAL", 0.01), \
+                self.assertLogs("game.state", "ERROR"):
+            dirty = async_to_sync(scenario)()
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(dirty)
+        vote = Vote.objects.get(room=self.room)
+        self.assertEqual((vote.username, vote.value), ("admin", "5"))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class RoundTimerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="admin", password="1234")
+        self.room = Room.objects.create(mode="average", creator=self.user)
+        BacklogItem.objects.create(room=self.room, title="Task A", order=0)
+        BacklogItem.objects.create(room=self.room, title="Task B", order=1)
+        RoomMembership.objects.create(room=self.room, user=self.user, role="admin")
+
+    def test_concurrent_reveals_apply_once_per_version(self):
+        """Stress : des centaines de reveals simultanés, deux 'workers' (deux RoomState) + le REST"""
+        async def scenario():
+            # deux copies de la room, comme deux processus qui la servent
+            workers = [RoomState(*await _load_room(self.room.code)) for _ in range(2)]
+            for state in workers:
+                state.cast_vote("admin", "5")
+            version = workers[0].version
+            results = await asyncio.gather(*[
+                reveal_round(workers[i % 2], force=True, version=version) for i in range(300)
+            ])
+            return version, results
+
+        version, results = async_to_sync(scenario)()
+        self.assertEqual(sum(r is not None for r in results), 1)
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        Vote.objects.create(room=self.room, username="admin", task_index=1, value="8")
+        response = client.post(f"/api/rooms/{self.room.code}/reveal/", {"version": version}, format="json")
+        self.assertEqual(response.status_code, 409)
+        response = client.post(f"/api/rooms/{self.room.code}/reveal/", {"version": "abc"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.current_task_index, self.room.version), (1, version + 1))
+        self.assertEqual(RoundArchive.objects.filter(room=self.room).count(), 1)
+        self.assertEqual(list(self.room.items.order_by("order").values_list("estimate", flat=True)), ["5", None])
+
+    def test_timer_fires_once_and_respects_pause(self):
+        async def scenario():
+            state = await room_states.acquire(self.room.code)
+            lobby_timer = round_timers.ensure(state)  # partie pas encore lancée
+            await database_sync_to_async(Room.objects.filter(pk=self.room.pk).update)(started=True)
+            room_states.invalidate(self.room.code)
+            state = await room_states.get(self.room.code)
+            self.assertIsNone(lobby_timer)
+            timer = round_timers.ensure(state)
+            timer.pause()
+            await asyncio.sleep(0.15)
+            paused_index = state.current_task_index
+            timer.resume()
+            await asyncio.sleep(0.15)
+            fired_index, info = state.current_task_index, timer.info()
+            round_timers.cancel(self.room.code)
+            await room_states.release(self.room.code)
+            return paused_index, fired_index, info
+
+        with patch.object(timers, "ROUND_TIMEOUT", 0.1):
+            paused_index, fired_index, info = async_to_sync(scenario)()
+        self.assertEqual(paused_index, 0)
+        self.assertEqual(fired_index, 1)
+        self.assertEqual(info["version"], 1)
+        self.assertEqual(RoundArchive.objects.get(room=self.room).status, "skipped")
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class PresenceTests(TestCase):
+    def test_sockets_heartbeats_and_batched_notifications(self):
+        async def scenario():
+            tracker = PresenceTracker(MemoryBackend())
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(room_group("ROOM"), channel)
+
+            await tracker.join("ROOM", "alice")
+            await tracker.join("ROOM", "alice")  # deuxième onglet
+            await tracker.join("ROOM", "bob")
+            await tracker.join("ROOM", "carol")
+            self.assertEqual(await tracker.leave("ROOM", "alice"), 3)
+            self.assertEqual(await tracker.leave("ROOM", "carol"), 2)
+            await tracker.flush()
+            frame = await layer.receive(channel)
+
+            with patch.object(presence_module, "TTL", 0.05):
+                await asyncio.sleep(0.1)
+                await tracker.heartbeat("ROOM", "bob")
+                await tracker.sweep()
+            await tracker.flush()
+            return frame, await layer.receive(channel), await tracker.members("ROOM")
+
+        frame, expired, online = async_to_sync(scenario)()
+        self.assertEqual((frame["joined"], frame["left"], frame["online"]), (["alice", "bob"], [], 2))
+        self.assertEqual((expired["left"], expired["online"]), (["alice"], 1))
+        self.assertEqual(online, ["bob"])
+
+    def test_absent_members_do_not_block_all_voted(self):
+        user = User.objects.create_user(username="admin", password="1234")
+        room = Room.objects.create(mode="average", creator=user)
+        for name in ("admin", "bob", "carol"):
+            member = user if name == "admin" else User.objects.create_user(username=name, password="x")
+            RoomMembership.objects.create(room=room, user=member)
+
+        async def scenario():
+            state = await room_states.acquire(room.code)
+            state.online = 1  # seul l'admin est connecté
+            state.cast_vote("admin", "5")
+            counts = state.counts()
+            await room_states.release(room.code)
+            return counts
+
+        self.assertEqual(async_to_sync(scenario)(), {"voters": 1, "total": 1})
+
+    def test_redis_is_retried_after_a_fallback(self):
+        class FlakyBackend:
+            def __init__(self):
+                self.down, self.calls, self.memory = True, 0, MemoryBackend()
+
+            def __getattr__(self, method):
+                async def call(*args):
+                    self.calls += 1
+                    if self.down:
+                        raise ConnectionError("redis down")
+                    return await getattr(self.memory, method)(*args)
+                return call
+
+        async def scenario():
+            backend = FlakyBackend()
+            tracker = PresenceTracker(backend)
+            await tracker.join("ROOM", "alice")
+            degraded = tracker.degraded
+            backend.down = False
+            calls = backend.calls
+            await tracker.count("ROOM")  # encore dans le délai : servi par la mémoire
+            skipped = backend.calls == calls
+            await asyncio.sleep(0.06)
+            online = await tracker.count("ROOM")  # Redis répond, mais ne connaît pas alice
+            recovered = not tracker.degraded
+            await tracker.heartbeat("ROOM", "alice")  # qui y est réinscrite au heartbeat suivant
+            return degraded, skipped, (recovered, online), await tracker.members("ROOM")
+
+        with patch.object(presence_module, "RETRY_AFTER", 0.05), \
+                self.assertLogs("game.presence", "WARNING"):
+            degraded, skipped, recovered, online = async_to_sync(scenario)()
+        self.assertTrue(degraded)
+        self.assertTrue(skipped)
+        self.assertEqual(recovered, (True, 0))
+        self.assertEqual(online, ["alice"])
+
+
+class BroadcastTests(TestCase):
+    def test_votes_are_coalesced_and_flushed_before_urgent_events(self):
+        layer = InMemoryChannelLayer()
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.group_add("room_T", channel)
+            broadcaster = RoomBroadcaster(layer, "room_T")
+            before = broadcast_stats()["frames_saved"]
+            for seq, user in enumerate(["a", "b", "c"], start=1):
+                await broadcaster.coalesce({"type": "vote_delta", "kind": "vote_cast", "seq": seq,
+                                            "username": user, "value": "5", "voters": seq, "total": 3})
+            await broadcaster.send_now({"type": "reveal_broadcast", "status": "validated"})
+            frames = [await layer.receive(channel), await layer.receive(channel)]
+            return frames, broadcast_stats()["frames_saved"] - before
+
+        (batch, reveal), saved = async_to_sync(scenario)()
+        self.assertEqual(batch["type"], "vote_batch")
+        self.assertEqual([d["seq"] for d in batch["deltas"]], [1, 2, 3])
+        self.assertEqual((batch["seq"], batch["voters"]), (3, 3))
+        self.assertEqual(reveal["type"], "reveal_broadcast")
+        self.assertEqual(saved, 2)
+        body = self.client.get("/metrics").content.decode()
+        self.assertIn(f"pocker_broadcast_frames_saved_total {broadcast_stats()['frames_saved']}", body)
+        self.assertIn(f"pocker_broadcast_events_total {broadcast_stats()['events']}", body)
+
+    def test_room_shard_follows_channels_redis_groups(self):
+        from channels_redis.utils import _consistent_hash
+
+        for code in ("ABC123", "ZZ9ZZ9", "Q1W2E3", "POKER1"):
+            for ring_size in (1, 2, 3, 5):
+                self.assertEqual(room_shard(code, ring_size), _consistent_hash(room_group(code), ring_size))
+
+    @override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+    def test_rest_invalidation_reaches_other_workers(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(room_group("ROOM"), channel)
+        invalidate_room("ROOM")
+        self.assertEqual(async_to_sync(layer.receive)(channel), {"type": "room_invalidate"})
+
+
+class ChatTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="admin", password="1234")
+        self.room = Room.objects.create(mode="strict", creator=user)
+
+    def test_limits_history_and_batched_persistence(self):
+        log = chat_module.ChatLog()
+
+        async def scenario():
+            await log.load(self.room.code, self.room.id)
+            with patch.object(chat_module, "throttle", Throttle(rate=1, burst=3)), \
+                    patch.object(chat_module, "HISTORY", 2):
+                for text in ("a", "b", "c"):
+                    log.post(self.room.code, self.room.id, "admin", text)
+                errors = []
+                for username, message in (("admin", "d"), ("bob", "   "),
+                                          ("bob", "x" * (chat_module.MAX_LENGTH + 1))):
+                    try:
+                        log.post(self.room.code, self.room.id, username, message)
+                    except chat_module.ChatRejected as e:
+                        errors.append(str(e))
+                written_before_flush = await database_sync_to_async(ChatMessage.objects.count)()
+                await log.release(self.room.code)
+                await log.load(self.room.code, self.room.id)
+                return errors, written_before_flush, json.loads(log.history_json(self.room.code))
+
+        errors, written_before_flush, history = async_to_sync(scenario)()
+        self.assertEqual(len(errors), 3)  # débit dépassé, message vide, message trop long
+        self.assertEqual(written_before_flush, 0)
+        self.assertEqual(ChatMessage.objects.filter(room=self.room).count(), 3)
+        self.assertEqual([m["message"] for m in history], ["b", "c"])
+
+
+class BackpressureTests(TestCase):
+    def test_inbox_merges_votes_and_enforces_limits(self):
+        inbox = backpressure.Inbox({"reveal": (0.001, 1)})
+        self.assertEqual(inbox.offer("vote", {"value": "5"}, current_vote="5"), backpressure.DROPPED)
+        self.assertEqual(inbox.offer("vote", {"value": "3"}), backpressure.QUEUED)
+        self.assertEqual(inbox.offer("vote", {"value": "8"}), backpressure.DROPPED)
+        self.assertEqual(list(inbox.items), [("vote", {"value": "8"})])
+
+        # vote 5 en attente derrière le 3 enregistré : revenir à 3 n'est pas redondant
+        waiting = backpressure.Inbox({})
+        for message in ({"type": "vote", "value": "5"}, {"type": "chat"}, {"type": "vote", "value": "3"}):
+            self.assertEqual(waiting.offer(message["type"], message, current_vote="3"), backpressure.QUEUED)
+        self.assertEqual([c.get("value") for _, c in waiting.items], ["5", None, "3"])
+        self.assertEqual(waiting.offer("vote", {"value": "3"}, current_vote="3"), backpressure.DROPPED)
+
+        # les votes fusionnés avec celui en attente débitent aussi le seau
+        spam = backpressure.Inbox({"vote": (0.001, 2)})
+        outcomes = [spam.offer("vote", {"value": v}) for v in ("1", "2", "3", "5")]
+        self.assertEqual(outcomes, [backpressure.QUEUED, backpressure.DROPPED,
+                                    backpressure.THROTTLED, backpressure.DROPPED])
+        self.assertEqual(list(spam.items), [("vote", {"value": "2"})])
+
+        # un seul avertissement tant que le seau est vide
+        outcomes = [inbox.offer("reveal", {}) for _ in range(3)]
+        self.assertEqual(outcomes, [backpressure.QUEUED, backpressure.THROTTLED, backpressure.DROPPED])
+
+        with patch.object(backpressure, "INBOX_SIZE", 3):
+            self.assertEqual(inbox.offer("chat", {}), backpressure.QUEUED)
+            self.assertEqual(inbox.offer("chat", {}), backpressure.FULL)
+        inbox.close()
+        self.assertEqual((len(inbox), inbox.offer("chat", {})), (0, backpressure.DROPPED))
+
+
+class EncodingTests(TestCase):
+    def test_backends_produce_the_same_documents(self):
+        from decimal import Decimal
+        from django.utils import timezone
+        data = {"title": "Tâche \u2028 é", 3: [1.5, None, True], "at": timezone.now(), "points": Decimal("2.5")}
+        backends = ["json"] + (["orjson"] if encoding.orjson is not None else [])
+        documents = {encoding.dumpb(data, backend) for backend in backends}
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(encoding.loads(documents.pop())["3"], [1.5, None, True])
+
+    def test_api_renders_and_parses_with_configured_encoder(self):
+        user = User.objects.create_user(username="admin", password="1234")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.post("/api/rooms/create/", {"mode": "strict"}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertIsInstance(response.accepted_renderer, encoding.JSONRenderer)
+        self.assertNotIn(b", ", response.content)
+        response = client.post("/api/rooms/create/", "{not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_encoding_micro_benchmark(self):
+        results = bench.encoding(players=(3,), backlog=(2, 20), repeat=2)
+        self.assertEqual([c["payload"] for c in results["cases"]],
+                         ["vote_batch", "snapshot", "room_detail", "room_detail"])
+        self.assertTrue({"former", *results["backends"]} <= set(results["cases"][0]["us_per_encode"]))
+        self.assertNotIn("msgpack", results["cases"][2]["us_per_encode"])  # REST : pas de MessagePack
+
+
+class MetricsTests(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "test", ("type",), buckets=(0.01, 0.1))
+        metrics._metrics.remove(histogram)
+        for value in (0.005, 0.05, 0.05, 3):
+            histogram.observe(value, "vote")
+        lines = list(histogram.render())
+        self.assertIn('test_seconds_bucket{type="vote",le="0.01"} 1', lines)
+        self.assertIn('test_seconds_bucket{type="vote",le="0.1"} 3', lines)
+        self.assertIn('test_seconds_bucket{type="vote",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{type="vote"} 4', lines)
+
+    def test_db_helpers_count_queries_per_message_type(self):
+        @metrics.db_helper("test_rooms")
+        def count_rooms():
+            return Room.objects.count() + Room.objects.count()
+
+        async def scenario():
+            metrics.message_type.set("reveal")
+            return await count_rooms()
+
+        before = metrics.db_queries.values.get(("test_rooms", "reveal"), 0)
+        self.assertEqual(async_to_sync(scenario)(), 0)
+        self.assertEqual(metrics.db_queries.values[("test_rooms", "reveal")] - before, 2)
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('pocker_db_queries_total{helper="test_rooms",message="reveal"}', body)
+        self.assertIn("pocker_active_rooms 0", body)
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class WebSocketAuthTests(TransactionTestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username="admin", password="1234")
+        self.outsider = User.objects.create_user(username="outsider", password="1234")
+        self.room = Room.objects.create(mode="strict", creator=self.admin)
+        RoomMembership.objects.create(room=self.room, user=self.admin, role="admin")
+
+    async def _connect(self, query):
+        communicator = WebsocketCommunicator(application, f"/ws/rooms/{self.room.code}/?{query}")
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    def test_member_with_token_gets_snapshot(self):
+        async def scenario():
+            ws, connected = await self._connect(f"token={access_token_for(self.admin)}")
+            self.assertTrue(connected)
+            snapshot = await ws.receive_json_from()
+            while snapshot["type"] != "snapshot":
+                snapshot = await ws.receive_json_from()
+            self.assertEqual(snapshot["counts"], {"voters": 0, "total": 1})
+            await ws.disconnect()
+        async_to_sync(scenario)()
+
+    def test_handshake_rejected_without_valid_token_or_membership(self):
+        async def scenario():
+            # accepté puis fermé avec un code applicatif, que le navigateur voit (sinon 1006)
+            for query, code in (("username=admin", 4401), ("token=not-a-jwt", 4401),
+                                (f"token={access_token_for(self.outsider)}", 4403)):
+                ws, connected = await self._connect(query)
+                self.assertTrue(connected, query)
+                self.assertEqual(await ws.receive_output(), {"type": "websocket.close", "code": code}, query)
+            self.assertNotIn(self.room.code, room_states)
+        async_to_sync(scenario)()
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
 class WebSocketTests(TransactionTestCase):
-    @skipIf(os.getenv("GITHUB_ACTIONS") == "true", "WebSocket tests skipped in CI")
     def test_websocket_connection(self):
         async_to_sync(self._test_websocket_connection)()
 
     async def _test_websocket_connection(self):
+        user = await database_sync_to_async(User.objects.create_user)(username="admin", password="1234")
+        room = await database_sync_to_async(Room.objects.create)(mode="strict", creator=user)
+        await database_sync_to_async(RoomMembership.objects.create)(room=room, user=user, role="admin")
         communicator = WebsocketCommunicator(
             application,
-            "/ws/poker/testroom/"
+            f"/ws/rooms/{room.code}/?token={access_token_for(user)}"
         )
         connected, _ = await communicator.connect()
         self.assertTrue(connected)
         await communicator.disconnect()
+
+    def test_lagging_client_is_disconnected(self):
+        async def scenario():
+            user = await database_sync_to_async(User.objects.create_user)(username="admin", password="1234")
+            room = await database_sync_to_async(Room.objects.create)(mode="strict", creator=user)
+            await database_sync_to_async(RoomMembership.objects.create)(room=room, user=user, role="admin")
+            ws = WebsocketCommunicator(application, f"/ws/rooms/{room.code}/?token={access_token_for(user)}")
+            await ws.connect()
+            self.assertEqual((await ws.receive_json_from())["type"], "snapshot")
+            await ws.send_json_to({"type": "heartbeat", "received": 1})
+            await ws.send_json_to({"type": "vote", "value": "5"})
+            self.assertEqual((await ws.receive_json_from())["type"], "vote_cast")
+
+            # le client dit n'avoir rien reçu depuis bien plus que WS_MAX_UNACKED trames
+            with patch.object(backpressure, "MAX_UNACKED", 1):
+                await ws.send_json_to({"type": "heartbeat", "received": 0})
+                closed = await ws.receive_output()
+                while closed["type"] != "websocket.close":  # analyse du round, envoyée avant
+                    closed = await ws.receive_output()
+            self.assertEqual(closed, {"type": "websocket.close", "code": backpressure.CLOSE_CODE})
+            await ws.disconnect()
+        async_to_sync(scenario)()
+
+    def test_msgpack_subprotocol_and_one_encode_per_format(self):
+        async def until(ws, frame_type):
+            while True:
+                data = await ws.receive_from()
+                frame = wire.decode(data) if isinstance(data, bytes) else json.loads(data)
+                if frame["type"] == frame_type:
+                    return frame
+
+        async def scenario():
+            admin = await database_sync_to_async(User.objects.create_user)(username="admin", password="1234")
+            bob = await database_sync_to_async(User.objects.create_user)(username="bob", password="1234")
+            room = await database_sync_to_async(Room.objects.create)(mode="strict", creator=admin)
+            for user, role in ((admin, "admin"), (bob, "player")):
+                await database_sync_to_async(RoomMembership.objects.create)(room=room, user=user, role=role)
+
+            def socket(user, **kwargs):
+                return WebsocketCommunicator(
+                    application, f"/ws/rooms/{room.code}/?token={access_token_for(user)}", **kwargs)
+
+            packed = socket(admin, subprotocols=["pocker.msgpack.v1", "pocker.json"])
+            connected, subprotocol = await packed.connect()
+            self.assertEqual(subprotocol, "pocker.msgpack.v1")
+            snapshot = await until(packed, "snapshot")
+            self.assertEqual((snapshot["votes"], snapshot["counts"]["total"]), ({}, 1))
+            plain = [socket(bob), socket(admin)]
+            for ws in plain:
+                await ws.connect()
+                await until(ws, "snapshot")
+
+            with patch.object(wire, "encode", wraps=wire.encode) as encode:
+                await packed.send_to(bytes_data=wire.msgpack.packb({"t": wire.TYPES.index("vote"), "x": "5"}))
+                frames = [await until(ws, "vote_cast") for ws in [packed, *plain]]
+            self.assertEqual({(f["username"], f["value"]) for f in frames}, {("admin", "5")})
+            # trois sockets, deux formats : deux encodages de la trame
+            self.assertEqual(sorted(c.args[1] for c in encode.call_args_list if c.args[0]["type"] == "vote_cast"),
+                             [wire.JSON, wire.MSGPACK])
+            for ws in [packed, *plain]:
+                await ws.disconnect()
+        async_to_sync(scenario)()
+
+    def test_wire_tags_round_trip(self):
+        frame = {"type": "vote_batch", "v": 2, "seq": 3, "voters": 1, "total": 2, "extra": 1,
+                 "deltas": [{"kind": "vote_cast", "seq": 3, "username": "type", "value": "5"}],
+                 "votes": {"type": "5"}}
+        packed = wire.encode(frame, wire.MSGPACK)
+        self.assertLess(len(packed), len(wire.encode(frame, wire.JSON)))
+        self.assertEqual(wire.decode(packed), frame)
+        self.assertEqual(len(set(wire.TAGS.values())), len(wire.TAGS))
+        self.assertEqual(wire.negotiate(["graphql-ws"]), (None, wire.JSON))
+
+    def test_reveal_lost_to_concurrent_reveal_answers_with_error(self):
+        async def scenario():
+            user = await database_sync_to_async(User.objects.create_user)(username="admin", password="1234")
+            room = await database_sync_to_async(Room.objects.create)(mode="strict", creator=user)
+            await database_sync_to_async(RoomMembership.objects.create)(room=room, user=user, role="admin")
+            ws = WebsocketCommunicator(application, f"/ws/rooms/{room.code}/?token={access_token_for(user)}")
+            await ws.connect()
+            await ws.send_json_to({"type": "vote", "value": "5"})
+            with patch("game.consumers.reveal_round", AsyncMock(return_value=None)):
+                await ws.send_json_to({"type": "reveal"})
+                frame = await ws.receive_json_from()
+                while frame["type"] != "error":
+                    frame = await ws.receive_json_from()
+            self.assertEqual(frame["message"], "Round already revealed")
+            await ws.disconnect()
+        async_to_sync(scenario)()
+
+    def test_bench_reports_latency_and_queries(self):
+        results = bench.run(rooms=2, players=3, rounds=2, chat=1)
+        self.assertEqual(results["votes"], 12)
+        self.assertEqual(results["vote_latency_ms"]["samples"], 2 * 2 * 3 * 3)
+        self.assertEqual(results["reveal_latency_ms"]["samples"], 2 * 2 * 3)
+        self.assertGreater(results["messages_per_second"], 0)
+        self.assertLess(results["db_queries_per_vote"], 5)
+        self.assertFalse(Room.objects.exists())
+
+    def test_bench_with_one_player_per_room(self):
+        # un vote seul dans sa fenêtre part en vote_cast, pas en vote_batch
+        results = bench.run(rooms=1, players=1, rounds=2, chat=0)
+        self.assertEqual(results["vote_latency_ms"]["samples"], 2)
+        self.assertEqual(results["reveal_latency_ms"]["samples"], 2)
+
+    def test_vote_path_bench_compares_db_executors(self):
+        results = bench.vote_path(rooms=2, writes=5, threads=2)
+        self.assertEqual(results["thread_sensitive"]["threads"], 0)
+        self.assertEqual(results["pool"]["threads"], 0 if connection.vendor == "sqlite" else 2)
+        self.assertEqual(db.threads(), 0)
+        self.assertFalse(Room.objects.exists())
@@ -0,0 +1,60 @@
+"""
+Token buckets for per-user / per-socket rate limits.
+
+A bucket holds up to `burst` tokens and refills at `rate` tokens per second;
+each allowed action takes one. `Throttle` keeps one bucket per key (user,
+socket, message type...) in process memory: limits are per worker, which
+is where the sockets of a room live anyway (see deploy/nginx.conf).
+"""
+import time
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def allow(self, cost=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    @property
+    def full(self):
+        return self.tokens + (time.monotonic() - self.stamp) * self.rate >= self.burst
+
+
+class Throttle:
+    """One TokenBucket per key; rate <= 0 disables the limit."""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def allow(self, key, cost=1):
+        if self.rate <= 0:
+            return True
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune()
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket.allow(cost)
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def _prune(self):
+        # un seau plein équivaut à un seau neuf : on peut l'oublier
+        for key in [k for k, b in self._buckets.items() if b.full]:
+            del self._buckets[key]
@@ -0,0 +1,193 @@
+"""
+Server-side round timers.
+
+Each active room gets one RoundTimer: an asyncio task that sleeps until the
+current round's deadline (ROUND_TIMEOUT seconds after the round started,
+120 by default, 0 disables the timers), then force-reveals it through
+`reveal_round(..., version=...)`. The round version pins the reveal to the
+round the deadline belongs to, so an expiry racing an admin reveal, or
+several workers, cannot advance the room twice.
+
+Pausing (coffee) freezes the remaining time; resuming re-arms it. Timers
+belong to the room, not to a socket: they outlive consumer disconnects and
+are cancelled when the room's state is evicted. A sleeping timer costs one
+task and one Event, so thousands of rooms per process are fine.
+"""
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import metrics
+from .broadcast import broadcaster_for, room_group
+from .reveal import reveal_round
+from .state import room_states
+
+logger = logging.getLogger(__name__)
+
+ROUND_TIMEOUT = getattr(settings, "ROUND_TIMEOUT", 120)
+
+
+class RoundTimer:
+    def __init__(self, code):
+        self.code = code
+        self.version = None
+        self.deadline = None  # loop.time() of the expiry, None while paused
+        self.remaining = None  # seconds left while paused
+        self._wake = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def arm(self, state):
+        """Start the countdown for the state's current round."""
+        loop = asyncio.get_running_loop()
+        elapsed = time.time() - state.round_started_at.timestamp()
+        left = max(ROUND_TIMEOUT - elapsed, 0)
+        self.version = state.version
+        if state.current is None:
+            # backlog vide ou terminé : rien à révéler
+            self.deadline, self.remaining = None, None
+        elif state.is_paused:
+            self.deadline, self.remaining = None, left
+        else:
+            self.deadline, self.remaining = loop.time() + left, None
+        self._wake.set()
+
+    def pause(self):
+        if self.deadline is not None:
+            self.remaining = max(self.deadline - asyncio.get_running_loop().time(), 0)
+            self.deadline = None
+            self._wake.set()
+
+    def resume(self):
+        if self.remaining is not None:
+            self.deadline = asyncio.get_running_loop().time() + self.remaining
+            self.remaining = None
+            self._wake.set()
+
+    @property
+    def idle(self):
+        return self.deadline is None and self.remaining is None
+
+    def info(self):
+        """{version, ends_at (epoch seconds) | None, remaining, paused} for clients."""
+        if self.deadline is not None:
+            remaining = max(self.deadline - asyncio.get_running_loop().time(), 0)
+            ends_at = time.time() + remaining
+        else:
+            remaining, ends_at = self.remaining, None
+        return {
+            "version": self.version,
+            "ends_at": ends_at,
+            "remaining": None if remaining is None else round(remaining, 1),
+            "paused": self.remaining is not None,
+        }
+
+    def cancel(self):
+        self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wake.clear()
+            if self.deadline is None:
+                await self._wake.wait()
+                continue
+            delay = self.deadline - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.deadline = None
+            try:
+                await _expire(self.code, self.version)
+            except Exception:
+                logger.exception("Timer %s : échec du reveal automatique", self.code)
+
+
+async def _expire(code, version):
+    if code not in room_states:
+        return
+    state = await room_states.get(code)
+    timer = round_timers.get(code)
+    if state.is_paused:
+        if timer is not None:
+            timer.arm(state)
+        return
+    res = await reveal_round(state, force=True, version=version)
+    if res is not None:
+        await broadcaster_for(get_channel_layer(), room_group(code)).send_now({
+            "type": "reveal_event",
+            **res,
+            "seq": state.seq
+        })
+    # nouveau round (ou round changé entre-temps par un reveal / le REST)
+    if timer is not None and code in room_states:
+        timer.arm(state)
+        await broadcast_timer(code)
+
+
+async def broadcast_timer(code):
+    timer = round_timers.get(code)
+    if timer is not None:
+        await broadcaster_for(get_channel_layer(), room_group(code)).send_now({
+            "type": "timer_event",
+            **timer.info()
+        })
+
+
+class RoundTimers:
+    """One RoundTimer per active room of this process."""
+
+    def __init__(self):
+        self._timers = {}
+
+    def get(self, code):
+        return self._timers.get(code)
+
+    def __len__(self):
+        return len(self._timers)
+
+    def ensure(self, state):
+        """
+        Arm the room's timer if it has none yet, or if it is idle (the backlog
+        was empty or finished). Returns it, or None when timers are disabled
+        or the room is still in its lobby (not started).
+        """
+        if ROUND_TIMEOUT <= 0 or not state.started:
+            return None
+        timer = self._timers.get(state.code)
+        if timer is None:
+            timer = self._timers[state.code] = RoundTimer(state.code)
+            timer.arm(state)
+        elif timer.idle and state.current is not None:
+            timer.arm(state)
+        return timer
+
+    def rearm(self, state):
+        timer = self._timers.get(state.code)
+        if timer is not None:
+            timer.arm(state)
+
+    def pause(self, code):
+        timer = self._timers.get(code)
+        if timer is not None:
+            timer.pause()
+
+    def resume(self, code):
+        timer = self._timers.get(code)
+        if timer is not None:
+            timer.resume()
+
+    def cancel(self, code):
+        timer = self._timers.pop(code, None)
+        if timer is not None:
+            timer.cancel()
+
+
+round_timers = RoundTimers()
+
+metrics.Gauge("pocker_round_timers", "Round timers armed on this worker", lambda: len(round_timers))
@@ -3,9 +3,17 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Room, Vote
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from . import archive, backlog_io, snapshots
+from .broadcast import room_group
+from .estimation import MODES, estimate
+from .models import BacklogItem, Room, RoomMembership, RoundArchive, Vote
+from .presence import presence
+from .reveal import apply_reveal
 from .serializers import RoomCreateSerializer, RoomDetailSerializer
-import uuid
+from .state import invalidate_room, task_snapshot
+from .votes import VALID_VOTES, record_vote
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 import os
@@ -18,16 +26,12 @@ import json
 def start_game(request, code):
     try:
         room = Room.objects.get(code=code.upper())
-        username = request.user.username
-        is_admin = any(
-            p.get("username") == username and p.get("role") == "admin"
-            for p in room.players
-        )
-        if not is_admin:
+        if not RoomMembership.objects.is_admin(room, request.user):
             return Response({"error": "Only admin can start the game"}, status=403)
 
         room.started = True
         room.save()
+        invalidate_room(room.code)  # les sockets relisent la room : le timer des rounds démarre
 
         return Response({"success": True, "started": True})
     except Room.DoesNotExist:
@@ -37,18 +41,15 @@ def start_game(request, code):
 @permission_classes([IsAuthenticated])
 def create_room(request):
     """
-    BODY: { "mode": "strict" | "average" | "median" | "majority" }
+    BODY: { "mode": "strict" | "average" | "median" | "majority" | "trimmed_mean" | "weighted_by_role" | "fibonacci_snap" }
     """
     mode = request.data.get("mode")
-    if mode not in ["strict", "average", "median", "majority"]:
+    if mode not in MODES:
         return Response({"error": "Invalid mode"}, status=400)
 
     user = request.user
-    room = Room.objects.create(
-        mode=mode,
-        creator=user,
-        players=[{ "username": user.username, "role": "admin" }]
-    )
+    room = Room.objects.create(mode=mode, creator=user)
+    RoomMembership.objects.create(room=room, user=user, role=RoomMembership.ADMIN)
     return Response(RoomCreateSerializer(room).data, status=201)
 
 @api_view(["POST"])
@@ -62,216 +63,159 @@ def join_room(request):
         return Response({"error": "Room code required"}, status=400)
 
     room = get_object_or_404(Room, code=code)
-    username = request.user.username
 
-    for p in room.players:
-        if p.get("username") == username:
-            return Response({"status": "already_joined", "code": room.code})
+    # une seule ligne insérée, sûr même si tout le monde rejoint en même temps
+    _, created = RoomMembership.objects.get_or_create(room=room, user=request.user)
+    if not created:
+        return Response({"status": "already_joined", "code": room.code})
 
-    room.players.append({ "username": username, "role": "player" })
-    room.save()
+    invalidate_room(room.code)
     return Response({"status": "joined", "code": room.code})
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_room(request, code):
-    room = get_object_or_404(Room, code=code.upper())
-    return Response(RoomDetailSerializer(room).data)
-def _validate_backlog(payload):
-    """
-    payload: list[dict] with at least a title
-    returns (ok, normalized_list | error_msg)
-    """
-    if not isinstance(payload, list) or len(payload) == 0:
-        return False, "Backlog must be a non-empty array"
-
-    normalized = []
-    for i, item in enumerate(payload, start=1):
-        if not isinstance(item, dict):
-            return False, f"Item #{i} must be an object"
-        title = item.get("title")
-        if not title or not isinstance(title, str) or len(title.strip()) == 0:
-            return False, f"Item #{i} is missing a valid 'title'"
-
-        normalized.append({
-            "id": item.get("id", str(uuid.uuid4())),
-            "title": title.strip()[:200],
-            "description": (item.get("description") or "").strip()[:2000],
-        })
-    return True, normalized
-
-
-def _validate_backlog(payload):
-    """
-    payload: list[dict] with at least a title
-    returns (ok, normalized_list | error_msg)
-    """
-    if not isinstance(payload, list) or len(payload) == 0:
-        return False, "Backlog must be a non-empty array"
-
-    normalized = []
-    for i, item in enumerate(payload, start=1):
-        if not isinstance(item, dict):
-            return False, f"Item #{i} must be an object"
-        title = item.get("title")
-        if not title or not isinstance(title, str) or len(title.strip()) == 0:
-            return False, f"Item #{i} is missing a valid 'title'"
-
-        normalized.append({
-            "external_id": item.get("id") or str(uuid.uuid4()),
-            "title": title.strip()[:255],
-            "description": (item.get("description") or "").strip()[:2000],
-            "order": item.get("order", i),
-        })
-    return True, normalized
+    code = code.upper()
+
+    def build():
+        room = get_object_or_404(Room, code=code)
+        return RoomDetailSerializer(room).data, None
+
+    return snapshots.respond(request, snapshots.get(code, "room", build))
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def set_backlog(request, code: str):
     """
-    BODY: JSON array of features [{id?, title, description?}, ...]
+    BODY: the backlog, streamed — JSON array [{id?, title, description?}, ...],
+    NDJSON (application/x-ndjson) or CSV (text/csv), or a multipart "file" upload.
     Replaces the room backlog and resets progress (current_task_index = 0)
     """
     room = get_object_or_404(Room, code=code.upper())
 
     # sécurité: seuls admin/creator peuvent uploader
-    username = request.user.username
-    is_admin = any(p.get("username") == username and p.get("role") == "admin" for p in room.players)
-    if not is_admin and room.creator.username != username:
+    is_admin = RoomMembership.objects.is_admin(room, request.user)
+    if not is_admin and room.creator_id != request.user.id:
         return Response({"error": "Only room admin can set backlog"}, status=403)
 
-    ok, result = _validate_backlog(request.data)
-    if not ok:
-        return Response({"error": result}, status=400)
+    upload = request.FILES.get("file") if request.content_type.startswith("multipart/") else None
+    if upload is not None:
+        fmt = backlog_io.EXTENSIONS.get(os.path.splitext(upload.name)[1].lower(), "json")
+        stream = upload
+    else:
+        fmt = backlog_io.FORMATS.get(request.content_type.split(";")[0].strip(), "json")
+        stream = request.stream
+    if stream is None:
+        return Response({"error": "Backlog must be a non-empty array"}, status=400)
 
-    room.backlog = result
-    room.current_task_index = 0
-    room.save()
-    return Response({"status": "backlog_set", "count": len(result)})
+    group_send = async_to_sync(get_channel_layer().group_send)
+
+    def on_progress(imported):
+        group_send(room_group(room.code), {"type": "backlog_progress", "imported": imported, "done": False})
+
+    try:
+        count = backlog_io.import_backlog(room, backlog_io.READERS[fmt](stream), on_progress=on_progress)
+    except backlog_io.BacklogImportError as e:
+        return Response({"error": str(e)}, status=400)
+
+    invalidate_room(room.code)
+    group_send(room_group(room.code), {"type": "backlog_progress", "imported": count, "done": True})
+    return Response({"status": "backlog_set", "count": count})
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_backlog(request, code: str):
     room = get_object_or_404(Room, code=code.upper())
-    return Response(room.backlog or [])
+    return backlog_io.export_response(request, room)
 
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def submit_vote(request, code):
-    room = get_object_or_404(Room, code=code.upper())
-    index = room.current_task_index
     user = request.user.username
     value = request.data.get("value")
 
     # validation
-    valid_values = ["1","2","3","5","8","13","20","40","100","coffee"]
-    if value not in valid_values:
+    if value not in VALID_VOTES:
         return Response({"error": "Invalid vote"}, status=400)
 
-    # delete previous vote of this player for this task
-    Vote.objects.filter(room=room, username=user, task_index=index).delete()
+    # upsert + décompte en un seul aller-retour
+    res = record_vote(code.upper(), user, value)
+    if res is None:
+        return Response({"error": "Room not found"}, status=404)
 
-    Vote.objects.create(room=room, username=user, task_index=index, value=value)
-    return Response({"status": "ok"})
+    invalidate_room(code.upper())
+    return Response({"status": "ok", "voters": res["voters"], "tally": res["tally"]})
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_votes(request, code):
-    room = get_object_or_404(Room, code=code.upper())
-    
+    code = code.upper()
+
+    def build():
+        room = get_object_or_404(Room, code=code)
+        votes = Vote.objects.filter(room=room, task_index=room.current_task_index)
+        players = dict(room.memberships.values_list("user__username", "role"))
+        return {v.username: v.value for v in votes}, players
+
+    snapshot = snapshots.get(code, "votes", build)
     # Vérifier que l'utilisateur est dans la room
-    user_in_room = any(
-        p.get("username") == request.user.username 
-        for p in room.players
-    )
-    
-    if not user_in_room:
+    if request.user.username not in snapshot.players:
         return Response({"error": "Not in room"}, status=403)
-
-    index = room.current_task_index
-    votes = Vote.objects.filter(room=room, task_index=index)
-    return Response({v.username: v.value for v in votes})
+    return snapshots.respond(request, snapshot)
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_current_task(request, code):
-    room = get_object_or_404(Room, code=code.upper())
-    idx = room.current_task_index
-    backlog = room.backlog or []
-
-    if idx >= len(backlog):
-        return Response({"done": True, "current": None, "total": len(backlog), "index": idx})
+    code = code.upper()
 
-    return Response({
-        "done": False,
-        "current": backlog[idx],
-        "total": len(backlog),
-        "index": idx + 1
-    })
+    def build():
+        room = get_object_or_404(Room, code=code)
+        idx = room.current_task_index
+        item = BacklogItem.objects.at(room, idx)
+        return task_snapshot(item.as_payload() if item else None, idx, room.items.count()), None
 
+    return snapshots.respond(request, snapshots.get(code, "current", build))
 
-def _calculate_result(room, votes):
-    values = [v.value for v in votes if v.value != "coffee"]
 
-    # Si tout le monde a voté café
-    if len(values) == 0:
-        return "coffee"
-
-    mode = room.mode
-
-    # STRICT
-    if mode == "strict":
-        if len(set(values)) == 1:
-            return values[0]
-        return None  # pas unanimité -> revote
-
-    # OTHER MODES (Average / Median / Majority)
-    numbers = list(map(int, values))
-
-    if mode == "average":
-        avg = sum(numbers) / len(numbers)
-        return str(round(avg))  # simplifié: arrondi standard
-
-    if mode == "median":
-        sorted_vals = sorted(numbers)
-        mid = len(numbers) // 2
-        return str(sorted_vals[mid])
-
-    if mode == "majority":
-        return max(set(values), key=values.count)
-    
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def reveal_votes(request, code):
     room = get_object_or_404(Room, code=code.upper())
     idx = room.current_task_index
-    user = request.user.username
 
     # admin only
-    is_admin = any(p.get("username") == user and p.get("role") == "admin" for p in room.players)
-    if not is_admin:
+    if not RoomMembership.objects.is_admin(room, request.user):
         return Response({"error": "Only admin can reveal"}, status=403)
 
     votes = Vote.objects.filter(room=room, task_index=idx)
-    players_in_room = len(room.players)
+    # même dénominateur que RoomState.counts() : les joueurs en ligne, à défaut tous les membres
+    players_in_room = async_to_sync(presence.count)(room.code) or room.memberships.count()
 
     if votes.count() < players_in_room:
         return Response({"error": "Waiting for all players"}, status=400)
 
-    result = _calculate_result(room, votes)
+    by_user = {v.username: v.value for v in votes}
+    roles = dict(room.memberships.values_list("user__username", "role"))
+    result = estimate(room.mode, by_user, roles)
+
+    # idempotent par (room, version) : le client peut renvoyer la version qu'il a affichée
+    try:
+        version = int(request.data.get("version", room.version))
+    except (TypeError, ValueError):
+        return Response({"error": "Invalid version"}, status=400)
+    status = RoundArchive.REVOTE if result is None else RoundArchive.VALIDATED
+    applied, _ = apply_reveal(
+        room.id, idx, version, advance=result is not None, result=result,
+        archive={"mode": room.mode, "status": status, "votes": by_user, "result": result},
+    )
+    if not applied:
+        return Response({"error": "Round already revealed", "version": Room.objects.get(pk=room.pk).version}, status=409)
+    invalidate_room(room.code)
 
     if result is None:
         return Response({"status": "revote"})
-
-    # On applique la note au backlog
-    room.backlog[idx]["estimate"] = result
-    room.current_task_index += 1
-    room.save()
-
-    Vote.objects.filter(room=room, task_index=idx).delete()
-
     return Response({"status": "validated", "result": result})
 
 
@@ -279,24 +223,16 @@ def reveal_votes(request, code):
 def export_results(request, code: str):
     room = get_object_or_404(Room, code=code.upper())
 
-    return Response({
-        "room": room.code,
-        "mode": room.mode,
-        "results": room.backlog  # contient les estimates
-    })
+    # streaming : {"room", "mode", "results"} en JSON, ou ?export=ndjson|csv
+    return backlog_io.export_response(request, room, envelope=True)
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def kick_player(request, code):
     room = get_object_or_404(Room, code=code.upper())
-    username = request.user.username
 
     # Vérifier si demandeur = admin
-    is_admin = any(
-        p.get("username") == username and p.get("role") == "admin"
-        for p in room.players
-    )
-    if not is_admin:
+    if not RoomMembership.objects.is_admin(room, request.user):
         return Response({"error": "Only admin can kick players"}, status=403)
 
     target = request.data.get("username")
@@ -305,12 +241,11 @@ def kick_player(request, code):
         return Response({"error": "Username required"}, status=400)
 
     # Ne pas kicker un admin
-    if any(p.get("username") == target and p.get("role") == "admin" for p in room.players):
+    if RoomMembership.objects.is_admin(room, target):
         return Response({"error": "Cannot kick an admin"}, status=403)
 
-    # Filtrer out le player
-    room.players = [p for p in room.players if p.get("username") != target]
-    room.save()
+    RoomMembership.objects.filter(room=room, user__username=target).delete()
+    invalidate_room(room.code)
 
     return Response({"status": "kicked", "username": target})
 
@@ -319,14 +254,9 @@ def kick_player(request, code):
 @permission_classes([IsAuthenticated])
 def promote_player(request, code):
     room = get_object_or_404(Room, code=code.upper())
-    username = request.user.username
 
     # Vérifier admin
-    is_admin = any(
-        p.get("username") == username and p.get("role") == "admin"
-        for p in room.players
-    )
-    if not is_admin:
+    if not RoomMembership.objects.is_admin(room, request.user):
         return Response({"error": "Only admin can promote players"}, status=403)
 
     target = request.data.get("username")
@@ -334,14 +264,36 @@ def promote_player(request, code):
         return Response({"error": "Username required"}, status=400)
 
     # Mettre le role admin à la target
-    updated_players = []
-    for p in room.players:
-        if p.get("username") == target:
-            updated_players.append({ "username": target, "role": "admin" })
-        else:
-            updated_players.append(p)
-
-    room.players = updated_players
-    room.save()
+    RoomMembership.objects.filter(room=room, user__username=target).update(role=RoomMembership.ADMIN)
+    invalidate_room(room.code)
 
     return Response({"status": "promoted", "username": target})
+
+
+# ---------- Analytics (rollups précalculés, voir game/archive.py) ----------
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def divergence_stats(request, code):
+    room = get_object_or_404(Room, code=code.upper())
+    if RoomMembership.objects.role_of(room, request.user) is None:
+        return Response({"error": "Not in room"}, status=403)
+    return Response({"room": room.code, "players": archive.divergence(room)})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def velocity_stats(request, code):
+    room = get_object_or_404(Room, code=code.upper())
+    if RoomMembership.objects.role_of(room, request.user) is None:
+        return Response({"error": "Not in room"}, status=403)
+    return Response({"room": room.code, **archive.velocity(room)})
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def revote_stats(request, code):
+    room = get_object_or_404(Room, code=code.upper())
+    if RoomMembership.objects.role_of(room, request.user) is None:
+        return Response({"error": "Not in room"}, status=403)
+    return Response({"room": room.code, **archive.revote_rate(room)})
@@ -0,0 +1,82 @@
+"""
+Vote ingestion.
+
+One entry point for both vote paths: the REST `submit_vote` view calls
+`record_vote`, and the consumers' write-behind flusher calls `record_votes`
+with everything cast since the last flush. Both rely on the
+`unique_vote_per_task` constraint to upsert instead of delete + insert.
+"""
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import Room, Vote
+
+VALID_VOTES = ["1", "2", "3", "5", "8", "13", "20", "40", "100", "coffee"]
+
+_UPSERT_AND_TALLY = """
+WITH target AS (
+    SELECT id, current_task_index FROM {room} WHERE code = %(code)s
+), upsert AS (
+    INSERT INTO {vote} (room_id, task_index, username, value)
+    SELECT id, current_task_index, %(username)s, %(value)s FROM target
+    ON CONFLICT (room_id, task_index, username) DO UPDATE SET value = EXCLUDED.value
+    RETURNING task_index, value
+)
+SELECT upsert.task_index, round_votes.value, COUNT(*)
+FROM upsert, (
+    SELECT v.value FROM {vote} v, target
+    WHERE v.room_id = target.id AND v.task_index = target.current_task_index
+      AND v.username <> %(username)s
+    UNION ALL
+    SELECT value FROM upsert
+) AS round_votes
+GROUP BY upsert.task_index, round_votes.value
+"""
+
+
+def record_vote(code, username, value):
+    """
+    Upsert `username`'s vote on the room's current task.
+    Returns {"task_index", "tally": {value: n}, "voters"} or None if the room does not exist.
+    On PostgreSQL this is a single statement; other backends use one transaction.
+    """
+    if connection.vendor == "postgresql":
+        sql = _UPSERT_AND_TALLY.format(room=Room._meta.db_table, vote=Vote._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, {"code": code, "username": username, "value": value})
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+        tally = {v: n for _, v, n in rows}
+        return {"task_index": rows[0][0], "tally": tally, "voters": sum(tally.values())}
+
+    with transaction.atomic():
+        room = Room.objects.filter(code=code).values("id", "current_task_index").first()
+        if room is None:
+            return None
+        idx = room["current_task_index"]
+        record_votes([(room["id"], idx, username, value)])
+        tally = current_tally(room["id"], idx)
+    return {"task_index": idx, "tally": tally, "voters": sum(tally.values())}
+
+
+def record_votes(rows):
+    """Bulk upsert of (room_id, task_index, username, value) tuples in one statement."""
+    if not rows:
+        return
+    Vote.objects.bulk_create(
+        [Vote(room_id=r, task_index=i, username=u, value=v) for r, i, u, v in rows],
+        update_conflicts=True,
+        unique_fields=["room", "task_index", "username"],
+        update_fields=["value"],
+    )
+
+
+def current_tally(room_id, task_index):
+    """{value: count} for one round."""
+    rows = (
+        Vote.objects.filter(room_id=room_id, task_index=task_index)
+        .values("value")
+        .annotate(n=Count("id"))
+    )
+    return {r["value"]: r["n"] for r in rows}
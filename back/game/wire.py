@@ -0,0 +1,131 @@
+"""
+WebSocket wire formats, negotiated per socket.
+
+JSON text frames stay the default. A client that offers the
+`pocker.msgpack.v1` subprotocol gets binary MessagePack frames instead, and
+sends its own messages the same way. Besides the binary encoding, the
+MessagePack frames use short tags for the keys that every frame repeats
+(TAGS: "type" -> "t", "votes" -> "vs", "counts" -> "c"...) and small
+integers for the frame types (TYPES). The tags apply to top-level keys and
+to the dicts under NESTED; other maps (votes by username, vote summary by
+card...) keep their keys. Keys missing from the tables are sent as is.
+The tables are part of the protocol: change them only with a new
+subprotocol version.
+
+Room events go out once per room through game/broadcast.py, which gives
+each one a `frame_id`; `encode_frame` keeps the payload per (frame_id,
+format) for a moment, so a room's sockets on this worker share one encode
+per format instead of one each.
+"""
+from collections import OrderedDict
+
+from . import encoding, metrics
+
+try:
+    import msgpack
+except ImportError:  # dépendance de channels_redis, mais optionnelle ici
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# sous-protocoles acceptés, dans l'ordre de préférence du serveur
+SUBPROTOCOLS = {"pocker.msgpack.v1": MSGPACK, "pocker.json": JSON}
+
+TAGS = {
+    "type": "t", "v": "v", "seq": "s", "version": "ver", "votes": "vs", "counts": "c",
+    "voters": "n", "total": "N", "deltas": "d", "kind": "k", "username": "u", "value": "x",
+    "is_paused": "p", "paused_by": "pb", "timer": "tm", "chat": "ch", "message": "m", "at": "at",
+    "current": "cur", "index": "i", "done": "dn", "online": "o", "joined": "j", "left": "l",
+    "status": "st", "result": "r", "ends_at": "e", "remaining": "rem", "paused": "pa",
+    "total_votes": "tv", "required_votes": "rv", "imported": "im", "received": "rc",
+    "vote_summary": "vsum", "spread": "sp", "outliers": "out", "suggested": "sg",
+    "consensus": "cs", "analysis": "an",
+}
+_UNTAGS = {tag: key for key, tag in TAGS.items()}
+
+TYPES = [
+    # serveur -> client
+    "snapshot", "vote_cast", "vote_changed", "vote_batch", "reveal", "pause_event",
+    "resume_event", "chat", "presence", "timer", "ai_analysis", "backlog_progress", "error",
+    "voted",
+    # client -> serveur
+    "heartbeat", "vote", "coffee", "resume", "force_reveal", "resync",
+]
+_TYPE_CODES = {t: i for i, t in enumerate(TYPES)}
+
+# clés dont la valeur (dict ou liste de dicts) est étiquetée elle aussi
+NESTED = {"counts", "deltas", "timer", "chat"}
+
+FRAME_ID = "frame_id"
+CACHE_SIZE = 256
+
+_cache = OrderedDict()  # (frame_id, format) -> payload
+
+
+def negotiate(offered):
+    """(subprotocol to accept or None, format) for the subprotocols a client offered."""
+    for name, fmt in SUBPROTOCOLS.items():
+        if name in offered and (fmt != MSGPACK or msgpack is not None):
+            return name, fmt
+    return None, JSON
+
+
+def _tag(obj, table):
+    if isinstance(obj, list):
+        return [_tag(item, table) for item in obj]
+    if isinstance(obj, dict):
+        return {table.get(k, k): v for k, v in obj.items()}
+    return obj
+
+
+def tag(frame):
+    out = {}
+    for key, value in frame.items():
+        if key in NESTED:
+            value = _tag(value, TAGS)
+        elif key == "type":
+            value = _TYPE_CODES.get(value, value)
+        out[TAGS.get(key, key)] = value
+    return out
+
+
+def untag(frame):
+    out = {}
+    for tag_, value in frame.items():
+        key = _UNTAGS.get(tag_, tag_)
+        if key in NESTED:
+            value = _tag(value, _UNTAGS)
+        elif key == "type" and isinstance(value, int) and 0 <= value < len(TYPES):
+            value = TYPES[value]
+        out[key] = value
+    return out
+
+
+def encode(frame, fmt):
+    """JSON text or MessagePack bytes."""
+    metrics.encodes.inc(fmt)
+    if fmt == MSGPACK:
+        return msgpack.packb(tag(frame), use_bin_type=True, default=encoding._default)
+    return encoding.dumps(frame)
+
+
+def decode(data):
+    """A MessagePack message from a client, keys untagged."""
+    frame = msgpack.unpackb(data, raw=False)
+    if not isinstance(frame, dict):
+        raise ValueError("MessagePack frame is not a map")
+    return untag(frame)
+
+
+def encode_frame(frame, fmt, frame_id=None):
+    """`encode`, shared by the sockets of this worker that get the same room event."""
+    if frame_id is None:
+        return encode(frame, fmt)
+    key = (frame_id, fmt)
+    payload = _cache.get(key)
+    if payload is None:
+        payload = _cache[key] = encode(frame, fmt)
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return payload
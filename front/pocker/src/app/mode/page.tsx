@@ -90,6 +90,9 @@ export default function ModePage() {
     { label: "Average", value: "average" },
     { label: "Median", value: "median" },
     { label: "Majority", value: "majority" },
+    { label: "Trimmed mean", value: "trimmed_mean" },
+    { label: "Weighted by role", value: "weighted_by_role" },
+    { label: "Fibonacci snap", value: "fibonacci_snap" },
   ];
 
   // Rendu du composant
@@ -1,6 +1,6 @@
 "use client";
 import "./play.css";
-import { use } from "react";
+import { use, useEffect, useState } from "react";
 import { CARDS } from "./play.constants";
 import { usePlayLogic } from "./usePlayLogic";
 
@@ -12,9 +12,18 @@ export default function PlayPage({ params }: { params: Promise<{ code: string }>
      chatInput, hasVoted, isConnected, pauseCoffee,
     setChatInput, setSelectedCard,
     sendMessage, sendVote, sendReveal,
-    messagesEndRef,    resumeSession  ,allVoted,votesCount,totalPlayers
+    messagesEndRef,    resumeSession  ,allVoted,votesCount,totalPlayers, roundEndsAt
   } = usePlayLogic(code);
 
+  // Compte à rebours du round (timer serveur) : reveal automatique à l'échéance
+  const [now, setNow] = useState(() => Date.now());
+  useEffect(() => {
+    if (roundEndsAt === null) return;
+    const tick = setInterval(() => setNow(Date.now()), 1000);
+    return () => clearInterval(tick);
+  }, [roundEndsAt]);
+  const secondsLeft = roundEndsAt === null ? null : Math.max(0, Math.ceil(roundEndsAt - now / 1000));
+
   if (!story) return <p>Chargement de la tâche…</p>;
 
   return (
@@ -28,6 +37,11 @@ export default function PlayPage({ params }: { params: Promise<{ code: string }>
           <h2>{story.current?.title}</h2>
           <p className="task-description">{story.current?.description}</p>
           <p className="task-progress">Tâche {story.index} sur {story.total}</p>
+          {secondsLeft !== null && (
+            <div className="timer-badge">
+              ⏱️ {Math.floor(secondsLeft / 60)}:{String(secondsLeft % 60).padStart(2, "0")}
+            </div>
+          )}
         </div>
 
 
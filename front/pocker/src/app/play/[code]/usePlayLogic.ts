@@ -5,6 +5,8 @@ import { API_URL } from "../../../../lib/api.js";
 
 export function usePlayLogic(code: string) {
   const ws = useRef<WebSocket | null>(null);
+  // Dernier numéro de séquence appliqué (protocole v2 : deltas de votes)
+  const lastSeq = useRef(0);
 
   const [story, setStory] = useState<any>(null);
   const [selectedCard, setSelectedCard] = useState<string | null>(null);
@@ -26,6 +28,8 @@ export function usePlayLogic(code: string) {
   const [pauseCoffee, setPauseCoffee] = useState(false);
   const [votesCount, setVotesCount] = useState(0);
   const [totalPlayers, setTotalPlayers] = useState(0);
+  // Timer du round, tenu par le serveur (fin en secondes epoch, null si en pause / inactif)
+  const [roundEndsAt, setRoundEndsAt] = useState<number | null>(null);
 
   //  Scroll auto du chat
   useEffect(() => {
@@ -102,12 +106,21 @@ export function usePlayLogic(code: string) {
 
   // ---------- CONNEXION WEBSOCKET ----------
   useEffect(() => {
-    if (!code || !username || loading) return;
+    if (!code || !username || !token || loading) return;
 
     let reconnectTimeout: NodeJS.Timeout;
+    // Trames reçues sur la socket courante : le serveur coupe un client trop en retard
+    let received = 0;
+    // Heartbeat de présence : sans lui le serveur nous compte hors ligne après 30 s
+    const heartbeat = setInterval(() => {
+      if (ws.current?.readyState === WebSocket.OPEN) {
+        ws.current.send(JSON.stringify({ type: "heartbeat", received }));
+      }
+    }, 10000);
 
     const connect = () => {
-      ws.current = new WebSocket(`ws://localhost:8000/ws/rooms/${code}/?username=${username}`);
+      received = 0;
+      ws.current = new WebSocket(`ws://localhost:8000/ws/rooms/${code.toUpperCase()}/?token=${encodeURIComponent(token)}`);
 
       ws.current.onopen = () => {
         setIsConnected(true);
@@ -115,6 +128,7 @@ export function usePlayLogic(code: string) {
       };
 
       ws.current.onmessage = (event) => {
+        received++;
         const data = JSON.parse(event.data);
         console.log("📩 WS Message received:", data.type); // Debug
 
@@ -125,14 +139,36 @@ export function usePlayLogic(code: string) {
           alert(`☕ Pause demandée par ${data.paused_by}`);
           return;
         }
-  // Dans ws.current.onmessage, ajoutez :
-  if (data.type === "votes_updated") {
-      console.log("🗳️ Votes updated:", data.votes);
-      setVotes(data.votes);
-      setVotesCount(Object.keys(data.votes).length);
-      setRequiredVotes(data.counts.total);
-      return;
-  }
+        // ---- VOTE BATCH (plusieurs deltas fusionnés côté serveur) ----
+        if (data.type === "vote_batch") {
+          if (data.deltas[0]?.seq !== lastSeq.current + 1) {
+            ws.current?.send(JSON.stringify({ type: "resync" }));
+            return;
+          }
+          lastSeq.current = data.seq;
+          setVotes((prev: any) => {
+            const next = { ...prev };
+            data.deltas.forEach((d: any) => { next[d.username] = d.value; });
+            return next;
+          });
+          setVotesCount(data.voters);
+          setRequiredVotes(data.total);
+          return;
+        }
+
+        // ---- VOTE DELTA (un seul vote a changé) ----
+        if (data.type === "vote_cast" || data.type === "vote_changed") {
+          if (data.seq !== lastSeq.current + 1) {
+            // trou dans la séquence → on redemande l'état complet
+            ws.current?.send(JSON.stringify({ type: "resync" }));
+            return;
+          }
+          lastSeq.current = data.seq;
+          setVotes((prev: any) => ({ ...prev, [data.username]: data.value }));
+          setVotesCount(data.voters);
+          setRequiredVotes(data.total);
+          return;
+        }
         // ---- ERROR ----
         if (data.type === "error") {
           console.log("⛔ WS ERROR:", data);
@@ -152,6 +188,7 @@ export function usePlayLogic(code: string) {
         // Dans ws.current.onmessage
         if (data.type === "reveal") {
             console.log("🃏 Reveal event received:", data);
+            if (typeof data.seq === "number") lastSeq.current = data.seq;
             
             if (data.status === "skipped") {
                 alert("⏱️ Temps écoulé — tâche ignorée");
@@ -204,6 +241,8 @@ export function usePlayLogic(code: string) {
 
         // ---- PRESENCE EVENT ----
         if (data.type === "presence") {
+          // "online" = joueurs connectés : c'est le nombre de votes attendus
+          setRequiredVotes(data.online);
           loadRoomData();
           return;
         }
@@ -211,9 +250,25 @@ export function usePlayLogic(code: string) {
         // ---- SNAPSHOT EVENT ----
         if (data.type === "snapshot") {
           setStory(data);
+          lastSeq.current = data.seq ?? 0;
+          if (data.votes) {
+            setVotes(data.votes);
+            setVotesCount(Object.keys(data.votes).length);
+          }
+          if (data.counts) setRequiredVotes(data.counts.total);
           if (data.is_paused) {
             setPauseCoffee(true);
           }
+          setRoundEndsAt(data.timer?.ends_at ?? null);
+          // historique du chat (derniers messages de la room)
+          if (data.chat) {
+            setMessages(data.chat.map((m: any) => ({ user: m.username, msg: m.message })));
+          }
+          return;
+        }
+        // ---- TIMER (le reveal automatique est fait par le serveur) ----
+        if (data.type === "timer") {
+          setRoundEndsAt(data.ends_at ?? null);
           return;
         }
 
@@ -224,8 +279,11 @@ export function usePlayLogic(code: string) {
         }
       };
 
-      ws.current.onclose = () => {
+      ws.current.onclose = (event) => {
         setIsConnected(false);
+        // 4401 token invalide, 4403 plus membre de la room (kick), 4404 room inconnue :
+        // inutile de se reconnecter
+        if ([4401, 4403, 4404].includes(event.code)) return;
         console.log("🔌 WebSocket disconnected - reconnecting...");
         reconnectTimeout = setTimeout(connect, 2000);
       };
@@ -239,6 +297,7 @@ export function usePlayLogic(code: string) {
     
     return () => {
       clearTimeout(reconnectTimeout);
+      clearInterval(heartbeat);
       if (ws.current) {
         ws.current.close();
       }
@@ -274,24 +333,11 @@ export function usePlayLogic(code: string) {
     }
 
     try {
-      // Enregistrer le vote via API REST
-      await fetch(`${API_URL}/api/rooms/${code}/vote/`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          Authorization: `Bearer ${token}`,
-        },
-        body: JSON.stringify({ value: selectedCard }),
-      });
-
-      // Envoyer le vote via WebSocket
+      // Envoyer le vote via WebSocket (le serveur l'enregistre et diffuse le delta)
       ws.current?.send(JSON.stringify({ type: "vote", value: selectedCard }));
 
       setHasVoted(true);
       
-      // Recharger les votes immédiatement
-      setTimeout(() => loadVotes(), 100);
-      
       console.log("✅ Vote sent:", selectedCard);
     } catch (error) {
       console.error("Error sending vote:", error);
@@ -334,6 +380,7 @@ export function usePlayLogic(code: string) {
     votesCount,
     totalPlayers,
     allVoted,
+    roundEndsAt,
     setChatInput,
     setSelectedCard,
     sendMessage,